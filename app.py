@@ -1,9 +1,10 @@
 import tkinter as tk
 from tkinter import ttk
-from PIL import Image, ImageTk
-import json
 import os
 from ttkbootstrap import Style
+from student_list import VirtualStudentList
+from student_db import open_database
+from thumbnails import ThumbnailCache
 
 class StudentApp(tk.Tk):
     def __init__(self):
@@ -15,15 +16,18 @@ class StudentApp(tk.Tk):
         self.style = Style(theme="darkly")  # Colorful theme
         self.configure(bg=self.style.colors.dark)
         
+        # Resized photos are cached in memory and on disk so navigation does no image decoding
+        self.thumbnails = ThumbnailCache()
         self.load_database()
+        self.frames = {}
         self.current_frame = None
         self.show_student_selection()
 
     def load_database(self):
-        if not os.path.exists("user.json"):
+        # Students live in an indexed SQLite file; user.json is only imported on first run
+        self.students = open_database()
+        if len(self.students) == 0:
             self.create_sample_database()
-        with open("user.json", "r") as f:
-            self.students = json.load(f)
 
     def create_sample_database(self):
         students = {}
@@ -37,22 +41,34 @@ class StudentApp(tk.Tk):
                 "courses": ["Course A", "Course B", "Course C"]
             }
         
-        with open("user.json", "w") as f:
-            json.dump(students, f, indent=2)
+        self.students.put_many(students.items())
 
     def show_student_selection(self):
-        if self.current_frame:
-            self.current_frame.destroy()
-        self.current_frame = StudentSelectionFrame(self)
-        self.current_frame.pack(fill=tk.BOTH, expand=True)
+        selection_frame = self.get_frame(StudentSelectionFrame)
+        self.raise_frame(selection_frame)
 
     def show_main(self, student_id):
+        # The same MainFrame is reused for every student; only its widgets are updated
+        main_frame = self.get_frame(MainFrame)
+        main_frame.show_student(student_id)
+        self.raise_frame(main_frame)
+
+    def get_frame(self, frame_class):
+        # Screens are built once and swapped in and out instead of being destroyed
+        if frame_class not in self.frames:
+            self.frames[frame_class] = frame_class(self)
+        return self.frames[frame_class]
+
+    def raise_frame(self, frame):
+        if self.current_frame is frame:
+            return
         if self.current_frame:
-            self.current_frame.destroy()
-        self.current_frame = MainFrame(self, student_id)
+            self.current_frame.pack_forget()
+        self.current_frame = frame
         self.current_frame.pack(fill=tk.BOTH, expand=True)
 
     def exit_application(self):
+        self.students.close()
         self.destroy()
 
 class StudentSelectionFrame(ttk.Frame):
@@ -71,21 +87,22 @@ class StudentSelectionFrame(ttk.Frame):
 
         logo_path = "images/facereg.jpg"
         if os.path.exists(logo_path):
-            logo = Image.open(logo_path)
-            logo = logo.resize((150, 150), Image.LANCZOS)
-            logo_photo = ImageTk.PhotoImage(logo)
+            logo_photo = self.master.thumbnails.photo(logo_path, (150, 150))
             logo_label = ttk.Label(main_frame, image=logo_photo, background=self.master.style.colors.dark)
             logo_label.image = logo_photo
             logo_label.pack(pady=20, anchor="n")
 
         ttk.Label(main_frame, text="Select a Student", font=("Helvetica Neue", 22, "bold"), background=self.master.style.colors.dark, foreground=self.master.style.colors.primary).pack(pady=20)
 
-        self.student_names = {value["name"]: student_id for student_id, value in self.master.students.items()}
-        
-        self.student_listbox = tk.Listbox(main_frame, height=10, font=("Helvetica Neue", 14), bg=self.master.style.colors.light, selectmode=tk.SINGLE, bd=0, highlightthickness=0)
-        self.student_listbox.pack(pady=20, fill=tk.X, padx=20)
-        for name in self.student_names.keys():
-            self.student_listbox.insert(tk.END, name)
+        # Only the visible rows live in the Listbox; typing in the search box filters by name
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add("write", lambda *args: self.student_list.set_filter(self.search_var.get()))
+        search_entry = ttk.Entry(main_frame, textvariable=self.search_var, font=("Helvetica Neue", 14))
+        search_entry.pack(pady=(20, 0), fill=tk.X, padx=20)
+
+        entries = self.master.students.names()
+        self.student_list = VirtualStudentList(main_frame, entries, visible_rows=10, on_activate=self.master.show_main, font=("Helvetica Neue", 14), bg=self.master.style.colors.light, bd=0, highlightthickness=0)
+        self.student_list.pack(pady=20, fill=tk.X, padx=20)
 
         button_frame = ttk.Frame(main_frame)
         button_frame.pack(pady=20)
@@ -97,64 +114,96 @@ class StudentSelectionFrame(ttk.Frame):
         exit_button.pack(side=tk.RIGHT, padx=10)
 
     def select_student(self):
-        selected_index = self.student_listbox.curselection()
-        if selected_index:
-            selected_name = self.student_listbox.get(selected_index)
-            student_id = self.student_names[selected_name]
+        student_id = self.student_list.selected_student_id()
+        if student_id is not None:
             self.master.show_main(student_id)
 
 class MainFrame(ttk.Notebook):
-    def __init__(self, master, student_id):
+    def __init__(self, master):
         style = ttk.Style()
         style.configure('lefttab.TNotebook', tabposition='wn')
         super().__init__(master, style='lefttab.TNotebook', padding=10)
         
-        self.student_id = student_id
-        self.student_data = master.students[student_id]
+        self.student_id = None
+        self.student_data = None
         self.create_tabs()
 
     def create_tabs(self):
-        self.add(StudentInfoFrame(self, self.student_data), text="📊 Info")
-        self.add(StudyTableFrame(self, self.student_data), text="📅 Schedule")
+        # Tabs start empty and are filled the first time they are shown for each student
+        self.stale_tabs = set()
+        self.add(StudentInfoFrame(self), text="📊 Info")
+        self.add(StudyTableFrame(self), text="📅 Schedule")
+        self.bind("<<NotebookTabChanged>>", self.refresh_selected_tab)
+
+    def show_student(self, student_id):
+        self.student_id = student_id
+        self.student_data = self.master.students[student_id]
+        self.stale_tabs = {str(tab_id) for tab_id in self.tabs()}
+        self.select(0)
+        self.refresh_selected_tab()
+
+    def refresh_selected_tab(self, event=None):
+        tab_id = str(self.select())
+        if tab_id in self.stale_tabs:
+            self.stale_tabs.discard(tab_id)
+            self.nametowidget(tab_id).show_student(self.student_data)
 
 class StudentInfoFrame(ttk.Frame):
-    def __init__(self, master, student_data):
+    def __init__(self, master):
         super().__init__(master, padding=20, style="Card.TFrame")
-        self.create_widgets(student_data)
+        self.field_labels = []
+        self.image_label = None
 
-    def create_widgets(self, student_data):
+    def create_widgets(self):
         self.columnconfigure(0, weight=1)
         self.columnconfigure(1, weight=1)
 
         ttk.Label(self, text="Student Information", font=("Helvetica Neue", 26, "bold"), background=self.master.master.style.colors.dark, foreground=self.master.master.style.colors.primary).grid(row=0, column=0, columnspan=2, pady=20)
 
-        row = 1
-        for key, value in student_data.items():
-            if key not in ["image", "courses"]:
-                ttk.Label(self, text=f"{key.capitalize()}:", font=("Helvetica Neue", 16, "bold")).grid(row=row, column=0, sticky="e", pady=10)
-                ttk.Label(self, text=str(value), font=("Helvetica Neue", 16)).grid(row=row, column=1, sticky="w", pady=10)
-                row += 1
-
-        img_frame = ttk.Frame(self, style="Card.TFrame")
-        img_frame.grid(row=row, column=0, columnspan=2, pady=20, sticky="nsew")
-        img_frame.columnconfigure(0, weight=1)
-        img_frame.rowconfigure(0, weight=1)
+        self.img_frame = ttk.Frame(self, style="Card.TFrame")
+        self.img_frame.columnconfigure(0, weight=1)
+        self.img_frame.rowconfigure(0, weight=1)
+        self.image_label = ttk.Label(self.img_frame, font=("Helvetica Neue", 16), background=self.master.master.style.colors.dark)
+        self.image_label.grid(pady=20)
+
+    def show_student(self, student_data):
+        if self.image_label is None:
+            self.create_widgets()
+
+        # Reuse the label pairs from the previous student and hide any that are left over
+        fields = [(key, value) for key, value in student_data.items() if key not in ["image", "courses"]]
+        while len(self.field_labels) < len(fields):
+            self.field_labels.append((ttk.Label(self, font=("Helvetica Neue", 16, "bold")), ttk.Label(self, font=("Helvetica Neue", 16))))
+        for row, ((key_label, value_label), (key, value)) in enumerate(zip(self.field_labels, fields), 1):
+            key_label.configure(text=f"{key.capitalize()}:")
+            value_label.configure(text=str(value))
+            key_label.grid(row=row, column=0, sticky="e", pady=10)
+            value_label.grid(row=row, column=1, sticky="w", pady=10)
+        for key_label, value_label in self.field_labels[len(fields):]:
+            key_label.grid_remove()
+            value_label.grid_remove()
+        self.img_frame.grid(row=len(fields) + 1, column=0, columnspan=2, pady=20, sticky="nsew")
 
         try:
-            img = Image.open(student_data["image"])
-            img = img.resize((300, 300), Image.LANCZOS)
-            photo = ImageTk.PhotoImage(img)
-            label = ttk.Label(img_frame, image=photo, background=self.master.master.style.colors.dark)
-            label.image = photo
-            label.grid(pady=20)
+            photo = self.master.master.thumbnails.photo(student_data["image"], (300, 300))
+            self.image_label.configure(image=photo, text="", foreground="")
+            self.image_label.image = photo
         except FileNotFoundError:
-            ttk.Label(img_frame, text="Image not found", font=("Helvetica Neue", 16), foreground="red").grid(pady=20)
+            self.image_label.configure(image="", text="Image not found", foreground="red")
+            self.image_label.image = None
 
 class StudyTableFrame(ttk.Frame):
-    def __init__(self, master, student_data):
+    def __init__(self, master):
         super().__init__(master, padding=20, style="Card.TFrame")
+        self.student_data = None
+        self.built = False
+
+    def show_student(self, student_data):
+        # The schedule is the same for every student, so it is only built on first view
         self.student_data = student_data
-        self.create_widgets()
+        if not self.built:
+            self.create_widgets()
+            self.built = True
 
     def create_widgets(self):
         ttk.Label(self, text="Study Schedule", font=("Helvetica Neue", 26, "bold"), background=self.master.master.style.colors.dark, foreground=self.master.master.style.colors.primary).grid(row=0, column=0, pady=20)
@@ -166,9 +215,7 @@ class StudyTableFrame(ttk.Frame):
         for index, (day, image_file) in enumerate(schedule_images.items()):
             ttk.Label(self, text=day, font=("Helvetica Neue", 18, "bold")).grid(row=index + 1, column=0, padx=10, pady=10, sticky="w")
             try:
-                img = Image.open(image_file)
-                img = img.resize((600, 400), Image.LANCZOS)
-                photo = ImageTk.PhotoImage(img)
+                photo = self.master.master.thumbnails.photo(image_file, (600, 400))
                 img_label = ttk.Label(self, image=photo)
                 img_label.image = photo
                 img_label.grid(row=index + 1, column=1, padx=10, pady=10)
@@ -0,0 +1,252 @@
+import argparse
+import datetime
+import json
+import os
+import queue
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+from instrumentation import metrics
+
+ATTENDANCE_FILE = "attendance.db"
+# Repeat sightings of a student within this many seconds are not recorded again
+DEDUP_SECONDS = 300.0
+# The writer commits up to this many events at once, waiting at most COMMIT_DELAY for company
+BATCH_SIZE = 500
+COMMIT_DELAY = 0.1
+# A batch that fails to commit (e.g. the file stayed locked past the connection timeout) is retried
+# this many times, RETRY_DELAY seconds apart and doubling, before it is given up
+WRITE_RETRIES = 3
+RETRY_DELAY = 1.0
+# Which kiosk or camera an event came from (default: the host name)
+KIOSK_ENV = "STUDENT_KIOSK_ID"
+# School day as (start, end) local times; period 1 is the first entry
+DEFAULT_PERIODS = [("08:00", "08:50"), ("09:00", "09:50"), ("10:00", "10:50"), ("11:00", "11:50"),
+                   ("13:00", "13:50"), ("14:00", "14:50"), ("15:00", "15:50"), ("16:00", "16:50")]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    student_id TEXT NOT NULL,
+    seen_at REAL NOT NULL,
+    source TEXT,
+    distance REAL
+);
+CREATE INDEX IF NOT EXISTS events_seen_at ON events (seen_at);
+CREATE INDEX IF NOT EXISTS events_student ON events (student_id, seen_at);
+"""
+
+
+def kiosk_id(environ=os.environ):
+    return environ.get(KIOSK_ENV) or socket.gethostname()
+
+
+def connect(db_file):
+    # WAL lets queries read while the writer commits; FULL syncs the WAL on every commit, so a
+    # committed batch survives a power cut (one fsync per batch, not per event)
+    conn = sqlite3.connect(db_file, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=FULL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def period_bounds(period, day=None, periods=DEFAULT_PERIODS):
+    # (start, end) unix seconds of a 1-based period on a date (default: today, local time)
+    day = day or datetime.date.today()
+    start, end = periods[period - 1]
+    return tuple(datetime.datetime.combine(day, datetime.time.fromisoformat(value)).timestamp()
+                 for value in (start, end))
+
+
+class AttendanceLog:
+    # Append-only log of recognition events. record() only does the de-duplication check and a
+    # queue put, so it can be called from the Tk thread or a camera loop; a background thread
+    # writes the queued events in batches, one transaction (and one fsync) per batch.
+    def __init__(self, db_file=ATTENDANCE_FILE, dedup_seconds=DEDUP_SECONDS, batch_size=BATCH_SIZE,
+                 commit_delay=COMMIT_DELAY, source=None, write_retries=WRITE_RETRIES, retry_delay=RETRY_DELAY):
+        self.db_file = db_file
+        self.dedup_seconds = dedup_seconds
+        self.batch_size = batch_size
+        self.commit_delay = commit_delay
+        self.source = source or kiosk_id()
+        self.write_retries = write_retries
+        self.retry_delay = retry_delay
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.recorded = 0
+        self.duplicates = 0
+        self.written = 0
+        self.lost = 0
+        # Last sighting per student, seeded from the log so a restart does not re-record everyone
+        conn = connect(db_file)
+        try:
+            self.last_seen = dict(conn.execute(
+                "SELECT student_id, MAX(seen_at) FROM events WHERE seen_at >= ? GROUP BY student_id",
+                (time.time() - dedup_seconds,)))
+        finally:
+            conn.close()
+        self.last_pruned = time.time()
+        self.writer = threading.Thread(target=self.run_writer, name="attendance-writer", daemon=True)
+        self.writer.start()
+
+    def record(self, student_id, distance=None, seen_at=None, source=None):
+        # Returns False for a repeat sighting inside the de-duplication window
+        seen_at = time.time() if seen_at is None else seen_at
+        with self.lock:
+            last = self.last_seen.get(student_id)
+            if last is not None and seen_at - last < self.dedup_seconds:
+                self.duplicates += 1
+                metrics.count("attendance_duplicates")
+                return False
+            self.last_seen[student_id] = seen_at
+            self.recorded += 1
+            if seen_at - self.last_pruned > max(self.dedup_seconds, 60.0):
+                self.prune(seen_at)
+        metrics.count("attendance_events")
+        self.pending.put((student_id, seen_at, source or self.source, distance))
+        return True
+
+    def prune(self, now):
+        # Forget sightings that can no longer suppress anything; called with the lock held
+        self.last_seen = {student_id: seen for student_id, seen in self.last_seen.items()
+                          if now - seen < self.dedup_seconds}
+        self.last_pruned = now
+
+    def run_writer(self):
+        conn = connect(self.db_file)
+        stopping = False
+        while not stopping:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.commit_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    batch.append(self.pending.get(timeout=timeout) if timeout > 0 else self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            events = [event for event in batch if event is not None]
+            stopping = len(events) < len(batch)
+            if events:
+                self.write_batch(conn, events)
+            for _ in batch:
+                self.pending.task_done()
+        conn.close()
+
+    def write_batch(self, conn, events):
+        delay = self.retry_delay
+        for attempt in range(self.write_retries + 1):
+            try:
+                with metrics.timer("attendance_commit"), conn:
+                    conn.executemany("INSERT INTO events (student_id, seen_at, source, distance) VALUES (?, ?, ?, ?)", events)
+                self.written += len(events)
+                return
+            except sqlite3.Error as e:
+                metrics.count("attendance_write_errors")
+                error = e
+            if attempt < self.write_retries:
+                time.sleep(delay)
+                delay *= 2
+        print(f"Could not write {len(events)} attendance events to {self.db_file}: {error}")
+        # Let the next sighting of these students through instead of de-duplicating it against
+        # an event that was never stored
+        with self.lock:
+            for student_id, seen_at, _, _ in events:
+                if self.last_seen.get(student_id) == seen_at:
+                    del self.last_seen[student_id]
+        self.lost += len(events)
+
+    def flush(self):
+        # Block until everything recorded so far is committed
+        self.pending.join()
+
+    def close(self):
+        self.pending.put(None)
+        self.writer.join()
+
+    def query(self, sql, params=()):
+        # Queries see every event recorded before the call
+        self.flush()
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def present(self, start, end):
+        # (student_id, first_seen, last_seen, sightings) for everyone seen in [start, end)
+        return self.query("SELECT student_id, MIN(seen_at), MAX(seen_at), COUNT(*) FROM events "
+                          "WHERE seen_at >= ? AND seen_at < ? GROUP BY student_id ORDER BY MIN(seen_at)",
+                          (start, end))
+
+    def present_in_period(self, period, day=None, periods=DEFAULT_PERIODS):
+        return self.present(*period_bounds(period, day, periods))
+
+    def history(self, student_id, start=0.0, end=float("inf")):
+        # (seen_at, source, distance) for one student, oldest first
+        return self.query("SELECT seen_at, source, distance FROM events "
+                          "WHERE student_id = ? AND seen_at >= ? AND seen_at < ? ORDER BY seen_at",
+                          (student_id, start, end))
+
+
+def format_time(seconds):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(seconds))
+
+
+def run_benchmark(events, students):
+    # Sustained rate into a scratch log with every event distinct (no de-duplication)
+    with tempfile.TemporaryDirectory() as workdir:
+        log = AttendanceLog(os.path.join(workdir, ATTENDANCE_FILE), dedup_seconds=0)
+        start = time.perf_counter()
+        base = time.time()
+        for i in range(events):
+            log.record(f"bench{i % students}", 0.4, seen_at=base + i * 1e-3, source="bench")
+        queued = time.perf_counter() - start
+        log.close()
+        total = time.perf_counter() - start
+    print(f"{events} events: queued in {queued:.3f}s, committed in {total:.3f}s ({events / total:.0f} events/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the attendance log written by the kiosks and live check-in.")
+    parser.add_argument('--db', default=ATTENDANCE_FILE)
+    parser.add_argument('--periods-file', default=None, help="JSON list of [start, end] times, e.g. [[\"08:00\", \"08:50\"], ...]")
+    commands = parser.add_subparsers(dest="command", required=True)
+    present = commands.add_parser("present", help="who was seen in a period or time range")
+    present.add_argument('--period', type=int, help="1-based period of the school day")
+    present.add_argument('--date', type=datetime.date.fromisoformat, default=None, help="YYYY-MM-DD (default: today)")
+    present.add_argument('--from', dest="start", type=datetime.datetime.fromisoformat, help="range start, YYYY-MM-DDTHH:MM")
+    present.add_argument('--to', dest="end", type=datetime.datetime.fromisoformat, help="range end")
+    history = commands.add_parser("history", help="every recorded sighting of one student")
+    history.add_argument('student_id')
+    bench = commands.add_parser("bench", help="measure write throughput into a scratch log (--db is not touched)")
+    bench.add_argument('--events', type=int, default=20000)
+    bench.add_argument('--students', type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        run_benchmark(args.events, args.students)
+    else:
+        log = AttendanceLog(args.db)
+        if args.command == "history":
+            for seen_at, source, distance in log.history(args.student_id):
+                print(f"{format_time(seen_at)}  {source}  distance {distance if distance is None else round(distance, 3)}")
+        else:
+            periods = DEFAULT_PERIODS
+            if args.periods_file:
+                with open(args.periods_file, "r", encoding="utf-8") as f:
+                    periods = [tuple(period) for period in json.load(f)]
+            if args.period is not None:
+                start, end = period_bounds(args.period, args.date, periods)
+            elif args.start is not None:
+                start = args.start.timestamp()
+                end = args.end.timestamp() if args.end else time.time()
+            else:
+                parser.error("present needs --period or --from")
+            rows = log.present(start, end)
+            print(f"{len(rows)} students seen {format_time(start)} - {format_time(end)}")
+            for student_id, first_seen, last_seen, sightings in rows:
+                print(f"  {student_id}: {format_time(first_seen)} - {format_time(last_seen)} ({sightings} sightings)")
+        log.close()
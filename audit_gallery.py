@@ -0,0 +1,277 @@
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from face_store import FaceGallery, load_gallery, save_gallery
+from recognition import GALLERY_FILE, MATCH_TOLERANCE
+
+# Distances are counted into fixed histogram bins instead of being kept, so memory does not grow
+# with the gallery; anything past the last bin lands in it
+BIN_WIDTH = 0.005
+N_BINS = 300
+# Each task compares BLOCK_ROWS rows with every later row, BLOCK_COLUMNS at a time:
+# about 64 MB of float32 distances (plus temporaries) per worker
+BLOCK_ROWS = 1024
+BLOCK_COLUMNS = 16384
+# Pairs of different students closer than this are reported as possible double enrolments
+DUPLICATE_DISTANCE = 0.4
+# Per-task cap on reported duplicate pairs (the closest are kept)
+MAX_PAIRS = 1000
+# Recommended tolerance: the largest threshold at which a query of an enrolled student matches on
+# average at most this many rows of other students (a per-pair rate of this over the gallery size)
+TARGET_FALSE_MATCHES = 0.01
+# ...as long as no more than this share of genuine pairs is rejected there. Duplicate enrolments
+# push the false-match bound down into the genuine distances; no tolerance is recommended then.
+MAX_FALSE_REJECTS = 0.05
+
+_gallery = None
+
+
+def load_audit_gallery(gallery_file, partitions=None):
+    if partitions:
+        from partitions import load_partitions
+        gallery = load_partitions(gallery_file, partitions)
+    else:
+        gallery = load_gallery(gallery_file)
+    if gallery.encodings.dtype != np.float32:
+        # float16 (--compress pq-f16) galleries: convert once instead of on every block
+        gallery = FaceGallery(gallery.encodings.astype(np.float32), gallery.label_ids, gallery.names)
+    return gallery
+
+
+def init_worker(gallery_file, partitions):
+    global _gallery
+    _gallery = load_audit_gallery(gallery_file, partitions)
+
+
+def audit_block(start, duplicate_distance=DUPLICATE_DISTANCE, max_pairs=MAX_PAIRS, gallery=None):
+    # Histograms of genuine (same student) and impostor distances between rows start:start+BLOCK_ROWS
+    # and every row after each of them, plus the closest impostor pairs under duplicate_distance
+    gallery = gallery if gallery is not None else _gallery
+    count = len(gallery)
+    end = min(start + BLOCK_ROWS, count)
+    rows = np.asarray(gallery.encodings[start:end])
+    row_labels = gallery.label_ids[start:end]
+    genuine = np.zeros(N_BINS, dtype=np.int64)
+    every = np.zeros(N_BINS, dtype=np.int64)
+    pairs = []
+    for column in range(start, count, BLOCK_COLUMNS):
+        column_end = min(column + BLOCK_COLUMNS, count)
+        distances = gallery.distance_matrix(rows, column, column_end)
+        same = row_labels[:, None] == gallery.label_ids[column:column_end][None, :]
+        close = (distances <= duplicate_distance) & ~same
+        if column < end:
+            # The block straddles the diagonal: keep each pair once and skip a row against itself
+            later = np.arange(column, column_end)[None, :] > np.arange(start, end)[:, None]
+            same &= later
+            close &= later
+        bins = np.minimum(distances * (1.0 / BIN_WIDTH), N_BINS - 1).astype(np.int32)
+        every += np.bincount((bins[later] if column < end else bins).ravel(), minlength=N_BINS)
+        genuine += np.bincount(bins[same], minlength=N_BINS)
+        r, c = np.nonzero(close)
+        pairs.extend(zip((r + start).tolist(), (c + column).tolist(), distances[r, c].tolist()))
+    if len(pairs) > max_pairs:
+        pairs = sorted(pairs, key=lambda pair: pair[2])[:max_pairs]
+    return genuine, every - genuine, pairs
+
+
+def histogram_quantile(histogram, q):
+    # Upper edge of the bin holding quantile q
+    total = histogram.sum()
+    if not total:
+        return None
+    return round(float((np.searchsorted(np.cumsum(histogram), q * total) + 1) * BIN_WIDTH), 3)
+
+
+def roc_table(genuine, impostor):
+    # (threshold, false accept rate, false reject rate) at every bin edge: a distance <= threshold matches
+    thresholds = (np.arange(N_BINS) + 1) * BIN_WIDTH
+    far = np.cumsum(impostor) / max(impostor.sum(), 1)
+    frr = 1.0 - np.cumsum(genuine) / max(genuine.sum(), 1)
+    return thresholds, far, frr
+
+
+def recommend_tolerance(genuine, impostor, encodings, target_false_matches=TARGET_FALSE_MATCHES,
+                        max_false_rejects=MAX_FALSE_REJECTS):
+    # None without both kinds of pair (one student, or one photo each)
+    if not genuine.sum() or not impostor.sum():
+        return None
+    thresholds, far, frr = roc_table(genuine, impostor)
+    target_far = target_false_matches / max(encodings - 1, 1)
+    eer = int(np.argmin(np.abs(far - frr)))
+    allowed = np.nonzero(far <= target_far)[0]
+    at_target = int(allowed[-1]) if len(allowed) else None
+    if at_target is not None and frr[at_target] > max_false_rejects:
+        at_target = None
+    return {
+        "equal_error_threshold": float(thresholds[eer]),
+        "equal_error_rate": float((far[eer] + frr[eer]) / 2),
+        "target_false_matches": target_false_matches,
+        "target_far": target_far,
+        "max_false_rejects": max_false_rejects,
+        "recommended_tolerance": None if at_target is None else float(thresholds[at_target]),
+        "far_at_recommended": None if at_target is None else float(far[at_target]),
+        "frr_at_recommended": None if at_target is None else float(frr[at_target]),
+    }
+
+
+def group_duplicates(gallery, pairs):
+    # {(student a, student b): [closest distance, close pairs, row a, row b]}, closest first
+    students = {}
+    for a, b, distance in pairs:
+        key, rows = (gallery.label(a), gallery.label(b)), (a, b)
+        if key[0] > key[1]:
+            key, rows = key[::-1], rows[::-1]
+        entry = students.setdefault(key, [distance, 0, rows[0], rows[1]])
+        entry[1] += 1
+        if distance < entry[0]:
+            entry[0], entry[2], entry[3] = distance, rows[0], rows[1]
+    return dict(sorted(students.items(), key=lambda item: item[1][0]))
+
+
+def run_audit(gallery_file, partitions=None, workers=None, duplicate_distance=DUPLICATE_DISTANCE,
+              max_pairs=MAX_PAIRS):
+    gallery = load_audit_gallery(gallery_file, partitions)
+    starts = range(0, len(gallery), BLOCK_ROWS)
+    workers = min(workers or os.cpu_count() or 1, len(starts))
+    genuine = np.zeros(N_BINS, dtype=np.int64)
+    impostor = np.zeros(N_BINS, dtype=np.int64)
+    pairs = []
+    begin = time.perf_counter()
+    if workers <= 1:
+        results = (audit_block(start, duplicate_distance, max_pairs, gallery) for start in starts)
+        executor = None
+    else:
+        # Spawned workers each memory-map the gallery; one BLAS thread apiece so they do not
+        # oversubscribe the cores
+        for name in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+            os.environ.setdefault(name, "1")
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                       initializer=init_worker, initargs=(gallery_file, partitions))
+        results = executor.map(audit_block, starts, [duplicate_distance] * len(starts), [max_pairs] * len(starts))
+    try:
+        for block_genuine, block_impostor, block_pairs in results:
+            genuine += block_genuine
+            impostor += block_impostor
+            pairs.extend(block_pairs)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    seconds = time.perf_counter() - begin
+    # Sizes rather than the gallery itself, so its memory map is released on return
+    return len(gallery), len(gallery.names), genuine, impostor, group_duplicates(gallery, pairs), seconds
+
+
+def distribution(histogram):
+    return {"pairs": int(histogram.sum()),
+            **{f"p{q:g}": histogram_quantile(histogram, q / 100) for q in (0.01, 1, 5, 50, 95, 99, 99.99)}}
+
+
+def print_report(encodings, students, genuine, impostor, duplicates, seconds, recommendation,
+                 tolerance=MATCH_TOLERANCE, top=20):
+    pairs = int(genuine.sum() + impostor.sum())
+    print(f"Gallery: {encodings} encodings, {students} students; "
+          f"{pairs} pairs in {seconds:.1f}s ({pairs / max(seconds, 1e-9) / 1e6:.1f}M pairs/s)")
+    for name, histogram in (("genuine", genuine), ("impostor", impostor)):
+        stats = distribution(histogram)
+        print(f"  {name:<9} {stats['pairs']:>12} pairs, distance p1 {stats['p1']}  p5 {stats['p5']}  "
+              f"median {stats['p50']}  p95 {stats['p95']}  p99 {stats['p99']}")
+    if recommendation is None:
+        print("Need at least two students and a student with two photos to compare thresholds.")
+    else:
+        print_roc(encodings, genuine, impostor, recommendation, tolerance)
+    if duplicates and recommendation is not None:
+        # A student enrolled twice shows up as close impostor pairs and drags the recommendation down
+        if recommendation["recommended_tolerance"] is None:
+            print("Resolve the pairs below and re-run for a recommendation.")
+        else:
+            print("Resolve the pairs below and re-run before adopting the recommendation.")
+    print(f"{len(duplicates)} pairs of students have photos closer than the duplicate distance")
+    for (a, b), (distance, count, row_a, row_b) in list(duplicates.items())[:top]:
+        print(f"  {a} / {b}: {distance:.3f} (rows {row_a}, {row_b}; {count} close pairs)")
+
+
+def print_roc(encodings, genuine, impostor, recommendation, tolerance):
+    thresholds, far, frr = roc_table(genuine, impostor)
+    # FAR/FRR per pair; false matches: impostor rows a query of an enrolled student matches on average
+    print(f"{'threshold':>10}{'FAR':>12}{'FRR':>10}{'false matches':>15}")
+    for threshold in (0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.65):
+        i = int(round(threshold / BIN_WIDTH)) - 1
+        marker = "  <- current" if abs(threshold - tolerance) < BIN_WIDTH / 2 else ""
+        print(f"{thresholds[i]:>10.3f}{far[i]:>12.2e}{frr[i]:>10.4f}{far[i] * (encodings - 1):>15.4f}{marker}")
+    print(f"Equal error rate {recommendation['equal_error_rate']:.4f} at {recommendation['equal_error_threshold']:.3f}")
+    if recommendation["recommended_tolerance"] is None:
+        print(f"No threshold keeps false matches under {recommendation['target_false_matches']:g} per query "
+              f"with FRR at most {recommendation['max_false_rejects']:g}")
+    else:
+        print(f"Recommended tolerance {recommendation['recommended_tolerance']:.3f} "
+              f"(FAR {recommendation['far_at_recommended']:.2e}, FRR {recommendation['frr_at_recommended']:.4f}, "
+              f"<= {recommendation['target_false_matches']:g} false matches per query; current {tolerance})")
+
+
+def write_report(path, encodings, students, genuine, impostor, duplicates, seconds, recommendation):
+    report = {
+        "encodings": encodings,
+        "students": students,
+        "seconds": seconds,
+        "bin_width": BIN_WIDTH,
+        "genuine": {**distribution(genuine), "histogram": genuine.tolist()},
+        "impostor": {**distribution(impostor), "histogram": impostor.tolist()},
+        "recommendation": recommendation,
+        "duplicates": [{"students": [a, b], "distance": distance, "close_pairs": count, "rows": [row_a, row_b]}
+                       for (a, b), (distance, count, row_a, row_b) in duplicates.items()],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+def make_synthetic_gallery(path, identities, per_identity, duplicates, seed=0):
+    # bench_matcher's synthetic gallery, with `duplicates` students enrolled a second time under new ids
+    from bench_matcher import SAMPLE_NOISE, make_synthetic_encodings
+    encodings, labels, centers = make_synthetic_encodings(identities, per_identity, seed)
+    rng = np.random.default_rng(seed + 1)
+    twins = rng.choice(identities, duplicates, replace=False)
+    extra = np.repeat(centers[twins], per_identity, axis=0)
+    extra += rng.normal(0, SAMPLE_NOISE, extra.shape).astype(np.float32)
+    labels += [f"student{i}-again" for i in twins for _ in range(per_identity)]
+    save_gallery(path, FaceGallery.from_encodings(np.concatenate([encodings, extra]), labels))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare every gallery encoding with every other: genuine/impostor "
+                                                 "distance distributions, a tolerance recommendation and "
+                                                 "students who look enrolled twice.")
+    parser.add_argument('--gallery', default=GALLERY_FILE)
+    parser.add_argument('--partitions', nargs='+', default=None,
+                        help="audit only these partitions of a gallery trained with --partition-by")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument('--duplicate-distance', type=float, default=DUPLICATE_DISTANCE,
+                        help="report different students with photos at most this far apart")
+    parser.add_argument('--target-false-matches', type=float, default=TARGET_FALSE_MATCHES,
+                        help="average impostor rows a query may match at the recommended tolerance")
+    parser.add_argument('--max-false-rejects', type=float, default=MAX_FALSE_REJECTS,
+                        help="largest false reject rate allowed at the recommended tolerance")
+    parser.add_argument('--top', type=int, default=20, help="duplicate student pairs to print")
+    parser.add_argument('--report', default=None, help="also write the histograms and duplicates as JSON here")
+    parser.add_argument('--synthetic', type=int, default=None, metavar="IDENTITIES",
+                        help="audit a synthetic gallery of this many students instead of --gallery")
+    parser.add_argument('--per-identity', type=int, default=10)
+    parser.add_argument('--synthetic-duplicates', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        gallery_file, partitions = args.gallery, args.partitions
+        if args.synthetic:
+            gallery_file, partitions = os.path.join(workdir, "synthetic.gallery"), None
+            make_synthetic_gallery(gallery_file, args.synthetic, args.per_identity, args.synthetic_duplicates)
+        results = run_audit(gallery_file, partitions, args.workers, args.duplicate_distance)
+    recommendation = recommend_tolerance(results[2], results[3], results[0], args.target_false_matches,
+                                         args.max_false_rejects)
+    print_report(*results, recommendation, top=args.top)
+    if args.report:
+        write_report(args.report, *results, recommendation)
+        print(f"Wrote {args.report}")
@@ -0,0 +1,220 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+import face_recognition
+from detection import DEFAULT_DETECTION, add_detection_arguments, detect_and_encode, settings_from_args
+from instrumentation import metrics, run_captured
+from recognition import GALLERY_FILE, FaceRecognizer
+from result_cache import CACHE_FILE, EncodingCache, content_digest
+from train import IMAGE_EXTENSIONS, unpack_captured
+
+VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mov', '.mkv', '.webm'}
+FIELDS = ["source", "frame", "face", "top", "right", "bottom", "left", "student_id", "distance"]
+
+
+def iter_input_files(paths):
+    # Files as given, folders walked recursively in a stable order
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def iter_video_frames(video_path, frame_step=1):
+    # Decode every frame_step-th frame as RGB; skipped frames are only grabbed, not decoded
+    import cv2
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise IOError(f"Could not open video {video_path}")
+    try:
+        frame_index = 0
+        while True:
+            if frame_index % frame_step:
+                if not capture.grab():
+                    break
+            else:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yield frame_index, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            frame_index += 1
+    finally:
+        capture.release()
+
+
+def iter_work_items(paths, frame_step=1):
+    # (source, frame index, payload): images are passed by path and decoded in the worker
+    for path in iter_input_files(paths):
+        extension = os.path.splitext(path)[1].lower()
+        if extension in IMAGE_EXTENSIONS:
+            yield path, None, path
+        elif extension in VIDEO_EXTENSIONS:
+            try:
+                for frame_index, frame in iter_video_frames(path, frame_step):
+                    yield path, frame_index, frame
+            except IOError as e:
+                print(e, file=sys.stderr)
+
+
+def encode_item(item, detection=DEFAULT_DETECTION):
+    # Runs inside a worker process: decode, detect and encode every face
+    source, frame_index, payload = item
+    try:
+        image = face_recognition.load_image_file(payload) if frame_index is None else payload
+        boxes, encodings = detect_and_encode(image, detection)
+        return source, frame_index, boxes, encodings, None
+    except Exception as e:
+        return source, frame_index, [], [], str(e)
+
+
+def ordered_map(func, items, workers, max_pending=None, lookup=None):
+    # Like executor.map, but pulls from `items` lazily so at most max_pending frames are in memory.
+    # lookup(item) may return a ready result (e.g. from a cache) so the item skips the workers.
+    if workers <= 1:
+        for item in items:
+            result = lookup(item) if lookup is not None else None
+            yield result if result is not None else func(item)
+        return
+
+    max_pending = max_pending or workers * 2
+    captured = metrics.enabled
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            result = lookup(item) if lookup is not None else None
+            if result is not None:
+                future = Future()
+                future.set_result((result, []) if captured else result)
+            elif captured:
+                # Stage timings made in the workers come back with each result
+                future = executor.submit(run_captured, func, item)
+            else:
+                future = executor.submit(func, item)
+            pending.append(future)
+            if len(pending) >= max_pending:
+                yield unpack_captured(pending.popleft().result(), captured)
+        while pending:
+            yield unpack_captured(pending.popleft().result(), captured)
+
+
+class CsvResultWriter:
+    def __init__(self, stream):
+        self.writer = csv.DictWriter(stream, fieldnames=FIELDS)
+        self.writer.writeheader()
+
+    def write(self, row):
+        self.writer.writerow(row)
+
+
+class JsonlResultWriter:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, row):
+        self.stream.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+class BatchStats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.frames = 0
+        self.faces = 0
+        self.matched = 0
+        self.errors = 0
+
+    def summary(self):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        return (f"{self.frames} images/frames, {self.faces} faces ({self.matched} matched), {self.errors} errors "
+                f"in {elapsed:.1f}s: {self.frames / elapsed:.2f} frames/sec, {self.faces / elapsed:.2f} faces/sec")
+
+
+def recognize_batch(recognizer, paths, writer, workers=None, frame_step=1, report_every=5.0, cache=None):
+    stats = BatchStats()
+    last_report = stats.start
+    workers = workers or os.cpu_count() or 1
+
+    # Photos already in the cache are answered without decoding; misses are stored by digest
+    digests = {}
+
+    def lookup(item):
+        source, frame_index, _ = item
+        if cache is None or frame_index is not None:
+            return None
+        try:
+            digest = content_digest(source)
+        except OSError:
+            return None
+        cached = cache.get(digest, recognizer.detection)
+        if cached is None:
+            digests[source] = digest
+            return None
+        return (source, frame_index, *cached, None)
+
+    encode = partial(encode_item, detection=recognizer.detection)
+    for source, frame_index, boxes, encodings, error in ordered_map(encode, iter_work_items(paths, frame_step), workers, lookup=lookup):
+        stats.frames += 1
+        if error is not None:
+            stats.errors += 1
+            digests.pop(source, None)
+            print(f"Error processing {source}: {error}", file=sys.stderr)
+            continue
+        if frame_index is None and source in digests:
+            cache.put(digests.pop(source), recognizer.detection, boxes, encodings)
+
+        for face_index, (box, (student_id, distance)) in enumerate(zip(boxes, recognizer.match_many(encodings))):
+            stats.faces += 1
+            stats.matched += student_id is not None
+            top, right, bottom, left = box
+            writer.write({"source": source, "frame": frame_index, "face": face_index,
+                          "top": top, "right": right, "bottom": bottom, "left": left,
+                          "student_id": student_id, "distance": None if distance is None else round(distance, 4)})
+
+        if time.perf_counter() - last_report >= report_every:
+            last_report = time.perf_counter()
+            print(stats.summary(), file=sys.stderr)
+
+    print(stats.summary(), file=sys.stderr)
+    if cache is not None:
+        print(cache.summary(), file=sys.stderr)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recognize students in folders of photos and video files.")
+    parser.add_argument('paths', nargs='+', help="image files, video files or folders")
+    parser.add_argument('--gallery', default=GALLERY_FILE)
+    parser.add_argument('--partitions', nargs='+', default=None,
+                        help="only search these partitions of a gallery trained with --partition-by")
+    parser.add_argument('--output', help="results file (.csv or .jsonl); default: CSV on stdout")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help="override the format implied by --output")
+    parser.add_argument('--workers', type=int, default=None, help="decode/encode processes (default: all cores)")
+    parser.add_argument('--frame-step', type=int, default=1, help="only process every Nth video frame")
+    parser.add_argument('--cache', default=CACHE_FILE, help="encoding cache for photos (skips re-encoding unchanged photos)")
+    parser.add_argument('--no-cache', action='store_true', help="always decode and encode every photo")
+    parser.add_argument('--metrics', default=None,
+                        help="stage timing sinks: comma-separated log, histogram, prometheus=PATH")
+    add_detection_arguments(parser)
+    args = parser.parse_args()
+    metrics.configure(args.metrics)
+
+    output_format = args.format or ('jsonl' if args.output and args.output.endswith('.jsonl') else 'csv')
+    stream = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+    try:
+        writer = JsonlResultWriter(stream) if output_format == 'jsonl' else CsvResultWriter(stream)
+        recognizer = FaceRecognizer.from_file(args.gallery, detection=settings_from_args(args), partitions=args.partitions)
+        cache = None if args.no_cache else EncodingCache(args.cache, args.gallery)
+        recognize_batch(recognizer, args.paths, writer, args.workers, args.frame_step, cache=cache)
+    finally:
+        metrics.flush()
+        if stream is not sys.stdout:
+            stream.close()
@@ -0,0 +1,76 @@
+import argparse
+import itertools
+import time
+import numpy as np
+import face_recognition
+from batch_recognize import iter_input_files
+from detection import DetectionSettings, box_iou, locate_faces
+from train import IMAGE_EXTENSIONS
+
+# Reference: full-resolution HOG with one upsample, i.e. what the app did before downscaling
+REFERENCE = DetectionSettings(model="hog", max_side=0, upsample=1, num_jitters=1)
+
+
+def run_config(images, settings):
+    # Per image: (detect seconds, encode seconds, boxes, encodings)
+    results = []
+    for image in images:
+        start = time.perf_counter()
+        boxes = locate_faces(image, settings)
+        detected = time.perf_counter()
+        encodings = face_recognition.face_encodings(image, boxes, num_jitters=settings.num_jitters)
+        results.append((detected - start, time.perf_counter() - detected, boxes, encodings))
+    return results
+
+
+def compare_to_reference(results, reference):
+    # Detection recall against the reference boxes, and how far matched encodings moved
+    found = total = 0
+    drift = []
+    for (_, _, boxes, encodings), (_, _, ref_boxes, ref_encodings) in zip(results, reference):
+        total += len(ref_boxes)
+        for ref_box, ref_encoding in zip(ref_boxes, ref_encodings):
+            overlaps = [box_iou(ref_box, box) for box in boxes]
+            if overlaps and max(overlaps) >= 0.5:
+                found += 1
+                drift.append(np.linalg.norm(encodings[int(np.argmax(overlaps))] - ref_encoding))
+    recall = found / total if total else float('nan')
+    return recall, (float(np.mean(drift)) if drift else float('nan'))
+
+
+def run_benchmark(images, configs):
+    reference = run_config(images, REFERENCE)
+    rows = []
+    for settings in configs:
+        results = reference if settings == REFERENCE else run_config(images, settings)
+        detect_ms = 1000 * np.mean([r[0] for r in results])
+        encode_ms = 1000 * np.mean([r[1] for r in results])
+        faces = sum(len(r[2]) for r in results)
+        recall, drift = compare_to_reference(results, reference)
+        rows.append((settings, detect_ms, encode_ms, faces, recall, drift))
+
+    print(f"{len(images)} images, reference = {REFERENCE.model} at full resolution")
+    print()
+    print("| model | max side | upsample | jitters | detect ms | encode ms | total ms | faces | recall vs ref | encoding drift |")
+    print("|---|---|---|---|---|---|---|---|---|---|")
+    for settings, detect_ms, encode_ms, faces, recall, drift in rows:
+        print(f"| {settings.model} | {settings.max_side or 'full'} | {settings.upsample} | {settings.num_jitters} "
+              f"| {detect_ms:.1f} | {encode_ms:.1f} | {detect_ms + encode_ms:.1f} | {faces} | {recall:.3f} | {drift:.4f} |")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Speed/accuracy tradeoff of detector model, downscaling and jitters.")
+    parser.add_argument('paths', nargs='+', help="image files or folders (e.g. the training images)")
+    parser.add_argument('--limit', type=int, default=50, help="benchmark at most this many images")
+    parser.add_argument('--models', nargs='+', default=['hog'], choices=['hog', 'cnn'])
+    parser.add_argument('--max-sides', type=int, nargs='+', default=[0, 1600, 1024, 640])
+    parser.add_argument('--upsample', type=int, nargs='+', default=[1])
+    parser.add_argument('--jitters', type=int, nargs='+', default=[1])
+    args = parser.parse_args()
+
+    paths = [path for path in iter_input_files(args.paths) if path.lower().endswith(tuple(IMAGE_EXTENSIONS))]
+    images = [face_recognition.load_image_file(path) for path in paths[:args.limit]]
+    configs = [DetectionSettings(*values) for values in
+               itertools.product(args.models, args.max_sides, args.upsample, args.jitters)]
+    run_benchmark(images, configs)
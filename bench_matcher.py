@@ -0,0 +1,96 @@
+import argparse
+import time
+import numpy as np
+from face_store import FaceGallery, load_gallery
+from matcher import BruteForceMatcher, IVFMatcher, PQMatcher, build_ivf, build_pq, gallery_memory
+
+# Roughly the geometry of dlib face encodings: different people sit ~0.9 apart,
+# photos of the same person ~0.4 apart, so the 0.6 tolerance separates them.
+IDENTITY_SPREAD = 0.9 / 16
+SAMPLE_NOISE = 0.4 / 16
+
+
+def make_synthetic_encodings(identities, per_identity, seed=0):
+    # Returns (encodings, labels, centers) for a fake gallery of `identities` people
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0, IDENTITY_SPREAD, (identities, 128)).astype(np.float32)
+    labels = np.repeat(np.arange(identities), per_identity)
+    encodings = centers[labels] + rng.normal(0, SAMPLE_NOISE, (len(labels), 128)).astype(np.float32)
+    return encodings, [f"student{i}" for i in labels], centers
+
+
+def make_queries(gallery, count, seed=1):
+    # New "photos" of enrolled people: a gallery row plus fresh noise
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(gallery), count, replace=len(gallery) < count)
+    noise = rng.normal(0, SAMPLE_NOISE, (count, gallery.encodings.shape[1])).astype(np.float32)
+    return np.asarray(gallery.encodings[rows]) + noise
+
+
+def time_searches(matcher, queries, k=1):
+    results = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(matcher.search(query, k=k))
+        latencies.append(time.perf_counter() - start)
+    return results, np.array(latencies) * 1000
+
+
+def run_benchmark(gallery, queries, n_lists=None, nprobes=(1, 2, 4, 8, 16, 32), reranks=(16, 64, 256)):
+    start = time.perf_counter()
+    indexed = build_ivf(gallery, n_lists=n_lists)
+    build_seconds = time.perf_counter() - start
+    n_lists = len(indexed.extras["ivf_centroids"])
+
+    exact_results, exact_ms = time_searches(BruteForceMatcher(indexed), queries)
+    exact_top1 = [ids[0] for ids, _ in exact_results]
+
+    rows = [("exact", "-", 1.0, exact_ms.mean(), np.percentile(exact_ms, 99), 1.0)]
+    for nprobe in nprobes:
+        if nprobe > n_lists:
+            break
+        results, ms = time_searches(IVFMatcher(indexed, nprobe=nprobe), queries)
+        recall = np.mean([len(ids) and ids[0] == truth for (ids, _), truth in zip(results, exact_top1)])
+        rows.append(("ivf", nprobe, recall, ms.mean(), np.percentile(ms, 99), exact_ms.mean() / ms.mean()))
+
+    # PQ codes in the same row order, so row ids compare directly with exact search
+    start = time.perf_counter()
+    compressed = build_pq(indexed) if reranks else None
+    pq_seconds = time.perf_counter() - start
+    for rerank in reranks:
+        results, ms = time_searches(PQMatcher(compressed, rerank=rerank), queries)
+        recall = np.mean([len(ids) and ids[0] == truth for (ids, _), truth in zip(results, exact_top1)])
+        rows.append(("pq", rerank, recall, ms.mean(), np.percentile(ms, 99), exact_ms.mean() / ms.mean()))
+
+    print(f"Gallery: {len(gallery)} encodings, {len(gallery.names)} identities, {len(queries)} queries")
+    print(f"IVF build: {n_lists} lists in {build_seconds:.2f}s")
+    if compressed is not None:
+        memory = gallery_memory(compressed)
+        print(f"PQ build: {pq_seconds:.2f}s, {memory['pq_scan'] / 1e6:.1f} MB scanned vs "
+              f"{memory['float32_scan'] / 1e6:.1f} MB exact")
+    # param: nprobe for ivf, re-ranked candidates for pq
+    print(f"{'backend':<8}{'param':>8}{'recall@1':>10}{'mean ms':>10}{'p99 ms':>10}{'speedup':>9}")
+    for backend, nprobe, recall, mean_ms, p99_ms, speedup in rows:
+        print(f"{backend:<8}{nprobe:>8}{recall:>10.4f}{mean_ms:>10.3f}{p99_ms:>10.3f}{speedup:>8.1f}x")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall/latency of the IVF matcher against exact search.")
+    parser.add_argument('--gallery', help="benchmark a trained .gallery file instead of synthetic data")
+    parser.add_argument('--identities', type=int, default=5000)
+    parser.add_argument('--per-identity', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--lists', type=int, default=None, help="IVF lists (default: sqrt of gallery size)")
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--rerank', type=int, nargs='*', default=[16, 64, 256],
+                        help="PQ candidates re-ranked exactly (none: skip PQ)")
+    args = parser.parse_args()
+
+    if args.gallery:
+        gallery = load_gallery(args.gallery)
+    else:
+        encodings, labels, _ = make_synthetic_encodings(args.identities, args.per_identity)
+        gallery = FaceGallery.from_encodings(encodings, labels)
+    run_benchmark(gallery, make_queries(gallery, args.queries), args.lists, args.nprobe, args.rerank)
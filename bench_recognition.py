@@ -0,0 +1,219 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from bench_matcher import IDENTITY_SPREAD, SAMPLE_NOISE
+from detection import add_detection_arguments, locate_faces, settings_from_args
+from face_store import FaceGallery, load_gallery, save_gallery
+from matcher import IVF_MIN_SIZE, build_ivf, build_pq, load_matcher
+from recognition import MATCH_TOLERANCE, FaceRecognizer
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STAGES = ["decode", "detect", "encode", "match"]
+
+
+def latency_stats(seconds):
+    if not seconds:
+        return None
+    ms = np.asarray(seconds) * 1000
+    return {"count": len(ms), "mean_ms": float(ms.mean()), "p50_ms": float(np.percentile(ms, 50)),
+            "p99_ms": float(np.percentile(ms, 99)), "total_s": float(ms.sum() / 1000)}
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+
+
+@contextlib.contextmanager
+def measure(result, trace_memory):
+    # Adds wall time (and the traced allocation peak) of the block to the result dict
+    if trace_memory:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    yield
+    result["seconds"] = time.perf_counter() - start
+    if trace_memory:
+        result["traced_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+
+
+def rate(hits, total):
+    return hits / total if total else None
+
+
+def score_predictions(truths, predictions, enrolled):
+    # Top-1 accuracy and error rates at the recognizer's tolerance. Queries of enrolled students
+    # are genuine; anyone else is an impostor, and any match for them is a false accept.
+    genuine = [(truth, predicted) for truth, predicted in zip(truths, predictions) if truth in enrolled]
+    impostor = [predicted for truth, predicted in zip(truths, predictions) if truth not in enrolled]
+    return {
+        "tolerance": MATCH_TOLERANCE,
+        "genuine_queries": len(genuine),
+        "impostor_queries": len(impostor),
+        "top1_accuracy": rate(sum(predicted == truth for truth, predicted in genuine), len(genuine)),
+        "false_reject_rate": rate(sum(predicted is None for _, predicted in genuine), len(genuine)),
+        "misidentification_rate": rate(sum(predicted is not None and predicted != truth for truth, predicted in genuine), len(genuine)),
+        "false_accept_rate": rate(sum(predicted is not None for predicted in impostor), len(impostor)),
+    }
+
+
+def make_identities(identities, per_identity, queries_per_identity, seed=0):
+    # Synthetic people in dlib-like encoding geometry: (enrolment encodings, labels, query encodings, labels)
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0, IDENTITY_SPREAD, (identities, 128))
+    enrol_labels = np.repeat(np.arange(identities), per_identity)
+    query_labels = np.repeat(np.arange(identities), queries_per_identity)
+    enrol = centers[enrol_labels] + rng.normal(0, SAMPLE_NOISE, (len(enrol_labels), 128))
+    queries = centers[query_labels] + rng.normal(0, SAMPLE_NOISE, (len(query_labels), 128))
+    return enrol, [f"student{i}" for i in enrol_labels], queries, [f"student{i}" for i in query_labels]
+
+
+def run_synthetic(args, workdir):
+    # Enrolment and matching only: there are no pixels to decode, detect or encode
+    enrolled_count = args.identities
+    enrol, enrol_labels, queries, query_labels = make_identities(
+        enrolled_count + args.impostors, args.per_identity, args.queries_per_identity, args.seed)
+    keep = [i for i, label in enumerate(enrol_labels) if int(label[7:]) < enrolled_count]
+    enrol, enrol_labels = enrol[keep], [enrol_labels[i] for i in keep]
+
+    gallery_file = os.path.join(workdir, "bench.gallery")
+    enrolment = {"images": len(enrol_labels)}
+    with measure(enrolment, args.trace_memory):
+        gallery = FaceGallery.from_encodings(enrol, enrol_labels)
+        if args.matcher == "pq":
+            gallery = build_pq(gallery)
+        elif args.matcher == "ivf" or (args.matcher == "auto" and len(gallery) >= IVF_MIN_SIZE):
+            gallery = build_ivf(gallery)
+        save_gallery(gallery_file, gallery)
+    enrolment["images_per_s"] = len(enrol_labels) / enrolment["seconds"]
+
+    gallery = load_gallery(gallery_file)
+    recognizer = FaceRecognizer(gallery, load_matcher(gallery, args.matcher))
+    query = {"queries": len(query_labels)}
+    with measure(query, args.trace_memory):
+        match_seconds, predictions = [], []
+        for encoding in queries:
+            start = time.perf_counter()
+            predictions.append(recognizer.match(encoding)[0])
+            match_seconds.append(time.perf_counter() - start)
+    query["queries_per_s"] = len(query_labels) / query["seconds"]
+    start = time.perf_counter()
+    recognizer.match_many(queries)
+    query["batched_queries_per_s"] = len(query_labels) / (time.perf_counter() - start)
+    query["stages"] = {stage: None for stage in STAGES}
+    query["stages"]["match"] = latency_stats(match_seconds)
+    return enrolment, query, score_predictions(query_labels, predictions, set(enrol_labels)), len(gallery)
+
+
+def list_labeled_images(images_dir):
+    from train import list_training_images
+    return list(list_training_images(images_dir))
+
+
+def run_fixture(args, workdir):
+    # Real photos in train.py's layout (one folder per student). Query folders whose name is not
+    # an enrolled student are impostors.
+    import face_recognition
+    from train import train_model
+
+    detection = settings_from_args(args)
+    index, compress = ("exact", "pq") if args.matcher == "pq" else (args.matcher, None)
+    gallery_file = os.path.join(workdir, "bench.gallery")
+    enrolment = {"images": len(list_labeled_images(args.images_dir))}
+    with contextlib.redirect_stdout(sys.stderr), measure(enrolment, args.trace_memory):
+        train_model(args.images_dir, gallery_file, os.path.join(workdir, "manifest.pkl"),
+                    workers=args.workers, index=index, detection=detection, compress=compress)
+    enrolment["images_per_s"] = enrolment["images"] / enrolment["seconds"]
+    # Re-running over unchanged photos should be nearly free thanks to the manifest
+    incremental = {}
+    with contextlib.redirect_stdout(sys.stderr), measure(incremental, False):
+        train_model(args.images_dir, gallery_file, os.path.join(workdir, "manifest.pkl"),
+                    workers=args.workers, index=index, detection=detection, compress=compress)
+    enrolment["incremental_seconds"] = incremental["seconds"]
+
+    gallery = load_gallery(gallery_file)
+    recognizer = FaceRecognizer(gallery, load_matcher(gallery, args.matcher), detection=detection)
+    samples = list_labeled_images(args.queries_dir)
+    stage_seconds = {stage: [] for stage in STAGES}
+    truths, predictions = [], []
+    query = {"queries": len(samples)}
+    with measure(query, args.trace_memory):
+        for truth, path in samples:
+            start = time.perf_counter()
+            image = face_recognition.load_image_file(path)
+            decoded = time.perf_counter()
+            boxes = locate_faces(image, detection)
+            detected = time.perf_counter()
+            encodings = face_recognition.face_encodings(image, boxes, num_jitters=detection.num_jitters)
+            encoded = time.perf_counter()
+            matches = recognizer.match_many(encodings)
+            matched = time.perf_counter()
+            for stage, seconds in zip(STAGES, (decoded - start, detected - decoded, encoded - detected, matched - encoded)):
+                stage_seconds[stage].append(seconds)
+            # The closest face in the photo is the answer for that photo
+            known = [(distance, student_id) for student_id, distance in matches if distance is not None]
+            truths.append(truth)
+            predictions.append(min(known)[1] if known else None)
+    query["queries_per_s"] = len(samples) / query["seconds"]
+    query["stages"] = {stage: latency_stats(seconds) for stage, seconds in stage_seconds.items()}
+    return enrolment, query, score_predictions(truths, predictions, set(gallery.names)), len(gallery)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Enrolment/query latency, throughput, memory and accuracy as JSON.")
+    parser.add_argument('--images-dir', help="enrolment photos (one folder per student); default: synthetic encodings")
+    parser.add_argument('--queries-dir', help="query photos in the same layout, not the enrolment photos (required with --images-dir)")
+    parser.add_argument('--identities', type=int, default=1000, help="synthetic: enrolled students")
+    parser.add_argument('--impostors', type=int, default=200, help="synthetic: people who are not enrolled")
+    parser.add_argument('--per-identity', type=int, default=5, help="synthetic: enrolment photos per student")
+    parser.add_argument('--queries-per-identity', type=int, default=2)
+    parser.add_argument('--matcher', choices=['auto', 'exact', 'ivf', 'pq'], default='auto')
+    parser.add_argument('--workers', type=int, default=None, help="enrolment processes")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--trace-memory', action='store_true', help="also report traced allocation peaks (slows Python code)")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    add_detection_arguments(parser)
+    args = parser.parse_args()
+    if args.images_dir and not args.queries_dir:
+        # Querying the enrolment photos themselves would match every one at distance ~0
+        parser.error("--images-dir needs a separate --queries-dir")
+
+    if args.trace_memory:
+        tracemalloc.start()
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.images_dir:
+            enrolment, query, accuracy, gallery_rows = run_fixture(args, workdir)
+        else:
+            enrolment, query, accuracy, gallery_rows = run_synthetic(args, workdir)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "mode": "fixture" if args.images_dir else "synthetic",
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "gallery_rows": gallery_rows,
+        "enrolment": enrolment,
+        "query": query,
+        "accuracy": accuracy,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
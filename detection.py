@@ -0,0 +1,74 @@
+from collections import namedtuple
+import numpy as np
+from PIL import Image
+from instrumentation import metrics
+
+# model: "hog" (fast, CPU) or "cnn" (more accurate, much slower without a GPU)
+# max_side: detect on a copy whose longest side is at most this many pixels (0 = full resolution)
+# upsample: face_locations number_of_times_to_upsample, for finding small faces
+# num_jitters: face_encodings re-sampling; higher is slightly more accurate and proportionally slower
+DetectionSettings = namedtuple("DetectionSettings", ["model", "max_side", "upsample", "num_jitters"])
+DEFAULT_DETECTION = DetectionSettings(model="hog", max_side=1024, upsample=1, num_jitters=1)
+
+
+def downscale(image, max_side):
+    # Returns (image, scale); detection cost grows with pixel count, so 12MP photos are shrunk first
+    height, width = image.shape[:2]
+    if not max_side or max(height, width) <= max_side:
+        return image, 1.0
+    scale = max_side / max(height, width)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return np.asarray(Image.fromarray(image).resize(size, Image.BILINEAR)), scale
+
+
+def locate_faces(image, settings=DEFAULT_DETECTION):
+    # Detect on the downscaled copy and map the boxes back to full-resolution coordinates.
+    # face_recognition (dlib and its models) is imported on first use, not when this module loads.
+    import face_recognition
+    with metrics.timer("detect"):
+        small, scale = downscale(image, settings.max_side)
+        boxes = face_recognition.face_locations(small, number_of_times_to_upsample=settings.upsample, model=settings.model)
+    if scale == 1.0:
+        return boxes
+
+    height, width = image.shape[:2]
+    return [(max(0, int(round(top / scale))), min(width, int(round(right / scale))),
+             min(height, int(round(bottom / scale))), max(0, int(round(left / scale))))
+            for top, right, bottom, left in boxes]
+
+
+def detect_and_encode(image, settings=DEFAULT_DETECTION):
+    # (top, right, bottom, left) boxes and 128-d encodings for every face in an RGB image.
+    # Encoding runs on the full-resolution pixels so landmarks are as sharp as possible.
+    import face_recognition
+    boxes = locate_faces(image, settings)
+    metrics.count("faces_found", len(boxes))
+    with metrics.timer("encode"):
+        encodings = face_recognition.face_encodings(image, boxes, num_jitters=settings.num_jitters)
+    return boxes, encodings
+
+
+def box_area(box):
+    top, right, bottom, left = box
+    return (right - left) * (bottom - top)
+
+
+def box_iou(a, b):
+    top, right, bottom, left = max(a[0], b[0]), min(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    union = box_area(a) + box_area(b) - inter
+    return inter / union if union else 0.0
+
+
+def add_detection_arguments(parser):
+    parser.add_argument('--model', choices=['hog', 'cnn'], default=DEFAULT_DETECTION.model, help="face detector")
+    parser.add_argument('--max-side', type=int, default=DEFAULT_DETECTION.max_side,
+                        help="downscale the longest side to this before detection (0 = full resolution)")
+    parser.add_argument('--upsample', type=int, default=DEFAULT_DETECTION.upsample,
+                        help="detector upsampling passes (finds smaller faces, slower)")
+    parser.add_argument('--jitters', type=int, default=DEFAULT_DETECTION.num_jitters,
+                        help="encoding re-samples per face (more accurate, slower)")
+
+
+def settings_from_args(args):
+    return DetectionSettings(args.model, args.max_side, args.upsample, args.jitters)
@@ -0,0 +1,191 @@
+import json
+import os
+import pickle
+import struct
+import sys
+import numpy as np
+
+# On-disk gallery layout (little endian):
+#   b"FACEGAL1" | uint32 header length | JSON header | padding | arrays
+# The header lists every array as a named section (offset, dtype, shape). The base sections are
+# float32 encodings (count x dim), float32 squared norms and int32 label ids; indexes built at
+# training time add their own sections. Every array starts on a 64-byte boundary so it can be
+# memory-mapped in place.
+MAGIC = b"FACEGAL1"
+ALIGNMENT = 64
+BASE_SECTIONS = ("encodings", "sq_norms", "label_ids")
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class FaceGallery:
+    def __init__(self, encodings, label_ids, names, sq_norms=None, extras=None, version=0):
+        self.encodings = encodings
+        self.label_ids = label_ids
+        self.names = names
+        if sq_norms is None:
+            sq_norms = np.einsum('ij,ij->i', encodings, encodings, dtype=np.float32)
+        self.sq_norms = sq_norms
+        # Extra named arrays stored alongside the encodings (e.g. ANN index data)
+        self.extras = extras if extras is not None else {}
+        # Bumped by every save_gallery over the same path (0 for galleries never saved)
+        self.version = version
+
+    @classmethod
+    def from_encodings(cls, encodings, labels):
+        # Build a gallery from the (list of arrays, list of names) pair face_recognition produces
+        if len(encodings) != len(labels):
+            raise ValueError(f"Got {len(encodings)} encodings but {len(labels)} labels.")
+        matrix = np.ascontiguousarray(np.asarray(encodings, dtype=np.float32).reshape(len(encodings), -1))
+        names = sorted(set(labels))
+        index = {name: i for i, name in enumerate(names)}
+        label_ids = np.array([index[label] for label in labels], dtype=np.int32)
+        return cls(matrix, label_ids, names)
+
+    def __len__(self):
+        return self.encodings.shape[0]
+
+    @property
+    def labels(self):
+        return [self.names[i] for i in self.label_ids]
+
+    def label(self, index):
+        return self.names[self.label_ids[index]]
+
+    def tolerance(self, index, default):
+        # Prototype galleries carry a per-student distance threshold
+        thresholds = self.extras.get("label_thresholds")
+        if thresholds is None:
+            return default
+        return float(thresholds[self.label_ids[index]])
+
+    def take(self, order, extras=None):
+        # New in-memory gallery with rows reordered/selected by `order`
+        order = np.asarray(order)
+        return FaceGallery(np.ascontiguousarray(self.encodings[order]), self.label_ids[order],
+                           self.names, self.sq_norms[order], extras)
+
+    def distances(self, query):
+        # Euclidean distance to every row as a single matrix-vector product:
+        # |g - q|^2 = |g|^2 + |q|^2 - 2 g.q
+        query = np.asarray(query, dtype=np.float32)
+        sq = self.sq_norms - 2.0 * (self.encodings @ query) + np.dot(query, query)
+        return np.sqrt(np.maximum(sq, 0.0))
+
+    def distance_matrix(self, queries, start=0, end=None):
+        # M x N distances from several queries to rows start:end as one matrix-matrix product
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.encodings.shape[1])
+        query_sq = np.einsum('ij,ij->i', queries, queries)
+        sq = self.sq_norms[start:end][None, :] - 2.0 * (queries @ self.encodings[start:end].T) + query_sq[:, None]
+        return np.sqrt(np.maximum(sq, 0.0))
+
+
+def save_gallery(path, gallery, version=None):
+    # Written to a temp file and renamed over the old one, so readers see either the old or the
+    # new gallery, never a partial one. version defaults to one past the file being replaced.
+    if len(gallery) == 0:
+        raise ValueError("Refusing to save an empty face gallery.")
+
+    arrays = {
+        # float16 encodings (a PQ gallery's re-rank copy) stay float16; anything else is float32
+        "encodings": np.ascontiguousarray(gallery.encodings, dtype='<f2' if gallery.encodings.dtype == np.float16 else '<f4'),
+        "sq_norms": np.ascontiguousarray(gallery.sq_norms, dtype='<f4'),
+        "label_ids": np.ascontiguousarray(gallery.label_ids, dtype='<i4'),
+    }
+    for name, array in gallery.extras.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array.astype(array.dtype.newbyteorder('<'), copy=False)
+
+    # Offsets depend on the header length, so size the header with worst-case offsets first
+    sections = {name: {"offset": 2 ** 63, "dtype": array.dtype.str, "shape": list(array.shape)}
+                for name, array in arrays.items()}
+    header = {"count": len(gallery), "dim": arrays["encodings"].shape[1],
+              "names": list(gallery.names), "sections": sections,
+              "version": version if version is not None else gallery_version(path) + 1}
+    header_len = len(json.dumps(header).encode("utf-8"))
+    offset = _align(len(MAGIC) + 4 + header_len)
+    for name, array in arrays.items():
+        sections[name]["offset"] = offset
+        offset = _align(offset + array.nbytes)
+    header_bytes = json.dumps(header).encode("utf-8").ljust(header_len)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", header_len))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.write(b"\0" * (sections[name]["offset"] - f.tell()))
+            f.write(array.tobytes())
+        # On disk before the rename, so a crash cannot leave a renamed but empty file
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a face gallery file.")
+        (header_len,) = struct.unpack("<I", f.read(4))
+        return json.loads(f.read(header_len).decode("utf-8"))
+
+
+def gallery_version(path):
+    # 0 if there is no readable gallery at path yet
+    try:
+        return read_header(path).get("version", 0)
+    except (OSError, ValueError, struct.error):
+        return 0
+
+
+def load_gallery(path, mmap=True):
+    # With mmap=True the arrays are read-only views of the file: no parsing, no copies
+    header = read_header(path)
+    # A file copied in by hand may still be incomplete; refuse it rather than map past its end
+    file_size = os.path.getsize(path)
+    for name, section in header["sections"].items():
+        end = section["offset"] + int(np.prod(section["shape"])) * np.dtype(section["dtype"]).itemsize
+        if end > file_size:
+            raise ValueError(f"{path} is truncated: section '{name}' ends at byte {end} of {file_size}.")
+
+    arrays = {}
+    for name, section in header["sections"].items():
+        shape = tuple(section["shape"])
+        if int(np.prod(shape)) == 0:
+            # np.memmap cannot map zero bytes
+            arrays[name] = np.empty(shape, dtype=section["dtype"])
+        elif mmap:
+            arrays[name] = np.memmap(path, dtype=section["dtype"], mode="r", offset=section["offset"], shape=shape)
+        else:
+            with open(path, "rb") as f:
+                f.seek(section["offset"])
+                arrays[name] = np.fromfile(f, dtype=section["dtype"], count=int(np.prod(shape))).reshape(shape)
+
+    extras = {name: array for name, array in arrays.items() if name not in BASE_SECTIONS}
+    return FaceGallery(arrays["encodings"], arrays["label_ids"], header["names"], arrays["sq_norms"], extras,
+                       header.get("version", 0))
+
+
+def load_legacy_pickles(model_file, labels_file=None):
+    # train.py used to write one (encodings, names) pickle; the app expected two separate pickles
+    with open(model_file, "rb") as f:
+        encodings = pickle.load(f)
+    if labels_file is None:
+        encodings, labels = encodings
+    else:
+        with open(labels_file, "rb") as f:
+            labels = pickle.load(f)
+    return FaceGallery.from_encodings(encodings, labels)
+
+
+if __name__ == "__main__":
+    # Convert old pickles: python face_store.py student_face_model.pkl [student_labels.pkl] student_faces.gallery
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python face_store.py MODEL_PKL [LABELS_PKL] OUTPUT_GALLERY")
+        sys.exit(1)
+    gallery = load_legacy_pickles(*sys.argv[1:-1])
+    save_gallery(sys.argv[-1], gallery)
+    print(f"Saved {len(gallery)} encodings for {len(gallery.names)} students to {sys.argv[-1]}")
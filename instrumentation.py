@@ -0,0 +1,239 @@
+import atexit
+import bisect
+import os
+import sys
+import time
+
+METRICS_ENV = "STUDENT_METRICS"
+METRIC_PREFIX = "student_face_"
+# Histogram bucket upper bounds in seconds (Prometheus defaults, plus one for slow photos)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class NullTimer:
+    # Shared no-op timer returned while metrics are disabled
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class Timer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class LogSink:
+    # One line per event, for following a single slow recognition
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def observe(self, name, seconds):
+        print(f"[metrics] {name}: {seconds * 1000:.1f} ms", file=self.stream or sys.stderr)
+
+    def count(self, name, value):
+        print(f"[metrics] {name} += {value}", file=self.stream or sys.stderr)
+
+    def gauge(self, name, value):
+        print(f"[metrics] {name} = {value}", file=self.stream or sys.stderr)
+
+    def flush(self):
+        pass
+
+
+class HistogramSink:
+    # Cumulative bucket counts, sum and count per timer, plus counters and gauges, in memory
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+        histogram["counts"][bisect.bisect_left(self.buckets, seconds)] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+    def count(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def flush(self):
+        pass
+
+    def percentile(self, name, q):
+        # Upper bound of the bucket holding the q-th percentile (inf past the last bucket)
+        histogram = self.histograms.get(name)
+        if not histogram:
+            return None
+        rank = q / 100 * histogram["count"]
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), histogram["counts"]):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def summary(self):
+        lines = []
+        for name, histogram in sorted(self.histograms.items()):
+            mean_ms = histogram["sum"] / histogram["count"] * 1000
+            lines.append(f"{name}: n={histogram['count']} mean={mean_ms:.1f}ms "
+                         f"p50<={self.percentile(name, 50) * 1000:g}ms p99<={self.percentile(name, 99) * 1000:g}ms")
+        lines.extend(f"{name}: {value}" for name, value in sorted(self.counters.items()))
+        lines.extend(f"{name}: {value}" for name, value in sorted(self.gauges.items()))
+        return "\n".join(lines)
+
+
+class PrometheusFileSink(HistogramSink):
+    # Histograms, counters and gauges in the Prometheus text format, rewritten atomically on
+    # flush() so node_exporter's textfile collector never reads a partial file
+    def __init__(self, path, buckets=DEFAULT_BUCKETS):
+        super().__init__(buckets)
+        self.path = path
+
+    def render(self):
+        lines = []
+        for name, histogram in sorted(self.histograms.items()):
+            metric = f"{METRIC_PREFIX}{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram["counts"]):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{le="{bound:g}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram["count"]}')
+            lines.append(f"{metric}_sum {histogram['sum']:.6f}")
+            lines.append(f"{metric}_count {histogram['count']}")
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE {METRIC_PREFIX}{name}_total counter")
+            lines.append(f"{METRIC_PREFIX}{name}_total {value}")
+        for name, value in sorted(self.gauges.items()):
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} gauge")
+            lines.append(f"{METRIC_PREFIX}{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.render())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not write metrics file {self.path}: {e}", file=sys.stderr)
+
+
+class CaptureSink:
+    # Records events so a worker process can send them back with its result
+    def __init__(self):
+        self.events = []
+
+    def observe(self, name, seconds):
+        self.events.append(("observe", name, seconds))
+
+    def count(self, name, value):
+        self.events.append(("count", name, value))
+
+    def gauge(self, name, value):
+        self.events.append(("gauge", name, value))
+
+    def flush(self):
+        pass
+
+
+class Metrics:
+    # Stage timers, counters and gauges fanned out to pluggable sinks. With no sinks, timer()
+    # returns a shared no-op and the other calls return after one attribute check.
+    def __init__(self):
+        self.sinks = []
+        self.enabled = False
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+        self.enabled = True
+        return sink
+
+    def remove_sink(self, sink):
+        self.sinks.remove(sink)
+        self.enabled = bool(self.sinks)
+
+    def timer(self, name):
+        return Timer(self, name) if self.enabled else NULL_TIMER
+
+    def observe(self, name, seconds):
+        if self.enabled:
+            for sink in self.sinks:
+                sink.observe(name, seconds)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            for sink in self.sinks:
+                sink.count(name, value)
+
+    def gauge(self, name, value):
+        if self.enabled:
+            for sink in self.sinks:
+                sink.gauge(name, value)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    def replay(self, events):
+        for kind, name, value in events:
+            getattr(self, kind)(name, value)
+
+    def configure(self, spec):
+        # spec: comma-separated sinks, e.g. "log,histogram,prometheus=metrics.prom"
+        for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+            kind, _, value = item.partition("=")
+            if kind == "log":
+                self.add_sink(LogSink())
+            elif kind == "histogram":
+                self.add_sink(HistogramSink())
+            elif kind == "prometheus":
+                self.add_sink(PrometheusFileSink(value or "student_face.prom"))
+            else:
+                raise ValueError(f"Unknown metrics sink '{kind}' (expected log, histogram or prometheus=PATH)")
+        if self.enabled:
+            atexit.register(self.close)
+        return self
+
+    def close(self):
+        # Final flush; in-memory histograms are printed since nothing else would show them
+        self.flush()
+        for sink in self.sinks:
+            if type(sink) is HistogramSink and sink.histograms:
+                print(sink.summary(), file=sys.stderr)
+
+
+# The process-wide instance; disabled until an entry point calls metrics.configure(...)
+metrics = Metrics()
+
+
+def run_captured(func, *args):
+    # Worker-process wrapper: returns (func(*args), metric events) for metrics.replay in the parent.
+    # Sinks inherited through fork are set aside so events are only reported once, by the parent.
+    saved, sink = metrics.sinks, CaptureSink()
+    metrics.sinks, metrics.enabled = [sink], True
+    try:
+        return func(*args), sink.events
+    finally:
+        metrics.sinks, metrics.enabled = saved, bool(saved)
@@ -0,0 +1,288 @@
+import argparse
+import sys
+import threading
+import time
+from queue import Empty, Full, Queue
+import numpy as np
+import cv2
+import face_recognition
+from attendance import ATTENDANCE_FILE, AttendanceLog
+from detection import add_detection_arguments, box_iou, locate_faces, settings_from_args
+from instrumentation import metrics
+from recognition import GALLERY_FILE, FaceRecognizer
+
+# Run the detector on every Nth frame; tracks are followed by template matching in between
+DETECT_EVERY = 10
+# Mean absolute grey-level change (0-255) of a 64x48 thumbnail that forces an early detection
+SCENE_CHANGE = 12.0
+# Tracking runs on a grey copy this many pixels wide
+TRACK_WIDTH = 320
+# Normalized cross-correlation below this means the track was lost
+MIN_TRACK_SCORE = 0.5
+# A detection box overlapping a track at least this much is the same face
+MIN_TRACK_IOU = 0.3
+# Tracks not confirmed by this many detections in a row are dropped
+MAX_MISSED = 2
+# An unrecognized track is encoded again after this many detections (e.g. once it faces the camera)
+UNKNOWN_RETRY = 3
+
+
+class Track:
+    def __init__(self, track_id, box):
+        self.track_id = track_id
+        self.box = box
+        self.template = None
+        self.student_id = None
+        self.distance = None
+        self.missed = 0
+        self.encoded_at = None
+
+
+class LiveStats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.frames = 0
+        self.detections = 0
+        self.encodings = 0
+        self.check_ins = 0
+
+    def summary(self):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        return (f"{self.frames} frames ({self.frames / elapsed:.1f} fps), {self.detections} detections, "
+                f"{self.encodings} faces encoded, {self.check_ins} check-ins")
+
+
+class LiveRecognizer:
+    # Per-frame face tracking for a camera feed. The detector runs every detect_every frames,
+    # when the scene changes or when a track is lost; in between, faces are followed by template
+    # matching on a small grey copy. Only faces that start a new track (or are still unknown)
+    # are encoded, so a face standing in front of the kiosk is recognized once.
+    def __init__(self, recognizer, detect_every=DETECT_EVERY, scene_change=SCENE_CHANGE, on_check_in=None):
+        self.recognizer = recognizer
+        self.detection = recognizer.detection
+        self.detect_every = detect_every
+        self.scene_change = scene_change
+        self.on_check_in = on_check_in
+        self.tracks = []
+        self.next_track_id = 0
+        self.checked_in = set()
+        self.frames_since_detection = None
+        self.detection_thumb = None
+        self.force_detection = True
+        self.stats = LiveStats()
+
+    def process(self, frame):
+        # frame: RGB array. Returns the current tracks.
+        self.stats.frames += 1
+        grey = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        scale = min(1.0, TRACK_WIDTH / grey.shape[1])
+        small = cv2.resize(grey, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else grey
+        thumb = cv2.resize(small, (64, 48), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+        if self.should_detect(thumb):
+            self.detect(frame, small, scale)
+            self.detection_thumb = thumb
+            self.frames_since_detection = 0
+        else:
+            self.track(small, scale)
+            self.frames_since_detection += 1
+        return self.tracks
+
+    def should_detect(self, thumb):
+        if self.force_detection or self.frames_since_detection is None:
+            return True
+        if self.frames_since_detection + 1 >= self.detect_every:
+            return True
+        return float(np.abs(thumb - self.detection_thumb).mean()) >= self.scene_change
+
+    def detect(self, frame, small, scale):
+        self.stats.detections += 1
+        self.force_detection = False
+        boxes = locate_faces(frame, self.detection)
+
+        # Greedily pair detections with existing tracks by overlap
+        unmatched = list(range(len(boxes)))
+        for track in self.tracks:
+            overlaps = [(box_iou(track.box, boxes[i]), i) for i in unmatched]
+            best = max(overlaps, default=(0.0, None))
+            if best[0] >= MIN_TRACK_IOU:
+                track.box = boxes[best[1]]
+                track.missed = 0
+                unmatched.remove(best[1])
+            else:
+                track.missed += 1
+        self.tracks = [track for track in self.tracks if track.missed <= MAX_MISSED]
+
+        for i in unmatched:
+            self.tracks.append(Track(self.next_track_id, boxes[i]))
+            self.next_track_id += 1
+        for track in self.tracks:
+            if track.missed == 0:
+                track.template = self.cut_template(small, track.box, scale)
+
+        # Only new faces, and unknown faces due for a retry, are encoded
+        detections = self.stats.detections
+        to_encode = [track for track in self.tracks if track.student_id is None and track.missed == 0
+                     and (track.encoded_at is None or detections - track.encoded_at >= UNKNOWN_RETRY)]
+        if to_encode:
+            encodings = face_recognition.face_encodings(frame, [track.box for track in to_encode], num_jitters=self.detection.num_jitters)
+            self.stats.encodings += len(encodings)
+            for track, (student_id, distance) in zip(to_encode, self.recognizer.match_many(encodings)):
+                track.student_id, track.distance, track.encoded_at = student_id, distance, detections
+                if student_id is not None and student_id not in self.checked_in:
+                    self.checked_in.add(student_id)
+                    self.stats.check_ins += 1
+                    if self.on_check_in is not None:
+                        self.on_check_in(track)
+
+    def cut_template(self, small, box, scale):
+        top, right, bottom, left = [int(round(v * scale)) for v in box]
+        template = small[max(0, top):bottom, max(0, left):right]
+        return template if template.size and min(template.shape) >= 8 else None
+
+    def track(self, small, scale):
+        # Look for each face's template in a window around its last position
+        for track in self.tracks:
+            if track.template is None:
+                continue
+            height, width = track.template.shape
+            top, right, bottom, left = [int(round(v * scale)) for v in track.box]
+            margin_y, margin_x = height // 2, width // 2
+            y0, x0 = max(0, top - margin_y), max(0, left - margin_x)
+            window = small[y0:min(small.shape[0], bottom + margin_y), x0:min(small.shape[1], right + margin_x)]
+            if window.shape[0] < height or window.shape[1] < width:
+                self.force_detection = True
+                continue
+            result = cv2.matchTemplate(window, track.template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, (dx, dy) = cv2.minMaxLoc(result)
+            if score < MIN_TRACK_SCORE:
+                self.force_detection = True
+                continue
+            new_top, new_left = y0 + dy, x0 + dx
+            track.box = (int(round(new_top / scale)), int(round((new_left + width) / scale)),
+                         int(round((new_top + height) / scale)), int(round(new_left / scale)))
+
+
+class FrameGrabber:
+    # Reads frames in a background thread. From a camera only the newest frame is kept, so a slow
+    # detection skips frames instead of building up latency; a video file is read frame by frame.
+    def __init__(self, source, drop_frames=True):
+        self.capture = cv2.VideoCapture(source)
+        if not self.capture.isOpened():
+            raise IOError(f"Could not open video source {source}")
+        self.drop_frames = drop_frames
+        self.frames = Queue(maxsize=1 if drop_frames else 8)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="frame-grabber", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            frame_index = 0
+            while not self.stopped.is_set():
+                ok, frame = self.capture.read()
+                if not ok:
+                    break
+                self.put((frame_index, frame))
+                frame_index += 1
+        finally:
+            self.capture.release()
+            self.put(None)
+
+    def put(self, item):
+        if self.drop_frames:
+            try:
+                self.frames.get_nowait()  # Drop the frame nobody has picked up yet
+            except Empty:
+                pass
+            self.frames.put(item)
+            return
+        while not self.stopped.is_set():
+            try:
+                self.frames.put(item, timeout=0.1)
+                return
+            except Full:
+                continue
+
+    def __iter__(self):
+        # (frame index, BGR frame) until the source ends or stop() is called
+        while True:
+            item = self.frames.get()
+            if item is None or self.stopped.is_set():
+                return
+            yield item
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join(timeout=1.0)
+
+
+def draw_tracks(frame, tracks):
+    for track in tracks:
+        top, right, bottom, left = track.box
+        color = (0, 200, 0) if track.student_id else (0, 0, 255)
+        cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
+        cv2.putText(frame, track.student_id or "unknown", (left, max(0, top - 8)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+
+
+def run_live(live, grabber, show=False, report_every=5.0):
+    last_report = time.perf_counter()
+    try:
+        for frame_index, frame in grabber:
+            tracks = live.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            if show:
+                draw_tracks(frame, tracks)
+                cv2.imshow("Live check-in (q to quit)", frame)
+                if cv2.waitKey(1) & 0xFF in (ord('q'), 27):
+                    break
+            if time.perf_counter() - last_report >= report_every:
+                last_report = time.perf_counter()
+                print(live.stats.summary(), file=sys.stderr)
+    finally:
+        grabber.stop()
+        if show:
+            cv2.destroyAllWindows()
+    print(live.stats.summary(), file=sys.stderr)
+    return live.stats
+
+
+def print_check_in(track):
+    print(f"{time.strftime('%H:%M:%S')} checked in {track.student_id} (distance {track.distance:.3f})", flush=True)
+
+
+def log_check_ins(attendance):
+    # on_check_in callback that also appends each check-in to the attendance log
+    def on_check_in(track):
+        print_check_in(track)
+        attendance.record(track.student_id, track.distance)
+    return on_check_in
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Real-time check-in from a camera (or a video file standing in for one).")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--camera', type=int, default=0, help="camera index")
+    source.add_argument('--video', help="video file to use instead of a camera")
+    parser.add_argument('--realtime', action='store_true', help="with --video, drop frames like a camera would when processing falls behind")
+    parser.add_argument('--gallery', default=GALLERY_FILE)
+    parser.add_argument('--partitions', nargs='+', default=None,
+                        help="only search these partitions of a gallery trained with --partition-by")
+    parser.add_argument('--detect-every', type=int, default=DETECT_EVERY, help="run the detector every Nth frame")
+    parser.add_argument('--scene-change', type=float, default=SCENE_CHANGE, help="thumbnail difference that forces a detection")
+    parser.add_argument('--show', action='store_true', help="show the annotated feed in a window")
+    parser.add_argument('--attendance-db', default=ATTENDANCE_FILE, help="attendance log to append check-ins to")
+    parser.add_argument('--metrics', default=None,
+                        help="stage timing sinks: comma-separated log, histogram, prometheus=PATH")
+    add_detection_arguments(parser)
+    args = parser.parse_args()
+    metrics.configure(args.metrics)
+
+    recognizer = FaceRecognizer.from_file(args.gallery, detection=settings_from_args(args), partitions=args.partitions)
+    attendance = AttendanceLog(args.attendance_db)
+    live = LiveRecognizer(recognizer, args.detect_every, args.scene_change, on_check_in=log_check_ins(attendance))
+    grabber = FrameGrabber(args.video if args.video else args.camera, drop_frames=args.video is None or args.realtime)
+    try:
+        run_live(live, grabber, show=args.show)
+    finally:
+        metrics.flush()
+        attendance.close()
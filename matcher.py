@@ -0,0 +1,294 @@
+import numpy as np
+from face_store import FaceGallery
+
+# train.py --index auto only builds an IVF index for galleries at least this large
+IVF_MIN_SIZE = 10000
+DEFAULT_NPROBE = 16
+# Product quantization: 16 sub-vectors of 8 dims, one byte each (16 bytes per encoding)
+PQ_SUBSPACES = 16
+PQ_CENTROIDS = 256
+# Approximate candidates re-ranked with the stored encodings
+DEFAULT_RERANK = 64
+
+
+def top_k(ids, distances, k):
+    # Return the k smallest distances (ascending) together with their gallery row ids
+    if len(distances) == 0:
+        return ids[:0], distances[:0]
+    if k == 1:
+        best = np.argmin(distances)
+        return ids[best:best + 1], distances[best:best + 1]
+    if k < len(distances):
+        part = np.argpartition(distances, k)[:k]
+        order = part[np.argsort(distances[part])]
+    else:
+        order = np.argsort(distances)
+    return ids[order], distances[order]
+
+
+def pad_results(ids, distances, k):
+    # Fixed-width rows for search_many: missing neighbours are id -1 at distance inf
+    padded_ids = np.full(k, -1, dtype=np.int64)
+    padded_distances = np.full(k, np.inf, dtype=np.float32)
+    padded_ids[:len(ids)] = ids
+    padded_distances[:len(distances)] = distances
+    return padded_ids, padded_distances
+
+
+class BruteForceMatcher:
+    # Exact search: one matrix-vector product over the whole gallery
+    name = "exact"
+
+    def __init__(self, gallery, block_size=65536):
+        self.gallery = gallery
+        self.block_size = block_size
+
+    def search(self, query, k=1):
+        distances = self.gallery.distances(query)
+        return top_k(np.arange(len(distances)), distances, k)
+
+    def search_many(self, queries, k=1):
+        # M queries against the gallery in blocks of rows, so memory stays at M x block_size
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.gallery.encodings.shape[1])
+        best_ids = np.full((len(queries), 0), -1, dtype=np.int64)
+        best_distances = np.full((len(queries), 0), np.inf, dtype=np.float32)
+        for start in range(0, len(self.gallery), self.block_size):
+            distances = self.gallery.distance_matrix(queries, start, start + self.block_size)
+            ids = np.broadcast_to(np.arange(start, start + distances.shape[1]), distances.shape)
+            distances = np.concatenate([best_distances, distances], axis=1)
+            ids = np.concatenate([best_ids, ids], axis=1)
+            if distances.shape[1] > k:
+                keep = np.argpartition(distances, k - 1, axis=1)[:, :k]
+                distances = np.take_along_axis(distances, keep, axis=1)
+                ids = np.take_along_axis(ids, keep, axis=1)
+            best_ids, best_distances = ids, distances
+
+        missing = k - best_ids.shape[1]
+        if missing > 0:
+            best_ids = np.concatenate([best_ids, np.full((len(queries), missing), -1)], axis=1)
+            best_distances = np.concatenate([best_distances, np.full((len(queries), missing), np.inf, dtype=np.float32)], axis=1)
+        order = np.argsort(best_distances, axis=1)
+        return np.take_along_axis(best_ids, order, axis=1), np.take_along_axis(best_distances, order, axis=1)
+
+
+class IVFMatcher:
+    # Inverted-file index: the gallery rows are stored grouped by k-means cluster, so each
+    # inverted list is a contiguous slice. A query only scans the `nprobe` nearest clusters.
+    name = "ivf"
+
+    def __init__(self, gallery, nprobe=DEFAULT_NPROBE):
+        self.gallery = gallery
+        self.centroids = np.asarray(gallery.extras["ivf_centroids"], dtype=np.float32)
+        self.list_offsets = np.asarray(gallery.extras["ivf_offsets"], dtype=np.int64)
+        self.centroid_sq_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        self.nprobe = max(1, min(nprobe, len(self.centroids)))
+
+    def probe_lists(self, query):
+        # Nearest clusters first; |q|^2 is constant so it is left out of the ranking
+        scores = self.centroid_sq_norms - 2.0 * (self.centroids @ query)
+        if self.nprobe < len(scores):
+            probe = np.argpartition(scores, self.nprobe - 1)[:self.nprobe]
+            return probe[np.argsort(scores[probe])]
+        return np.argsort(scores)
+
+    def search(self, query, k=1):
+        query = np.asarray(query, dtype=np.float32)
+        query_sq = np.dot(query, query)
+        encodings, sq_norms = self.gallery.encodings, self.gallery.sq_norms
+
+        id_chunks, dist_chunks = [], []
+        for list_id in self.probe_lists(query):
+            start, end = self.list_offsets[list_id], self.list_offsets[list_id + 1]
+            if start == end:
+                continue
+            sq = sq_norms[start:end] - 2.0 * (encodings[start:end] @ query) + query_sq
+            id_chunks.append(np.arange(start, end))
+            dist_chunks.append(np.sqrt(np.maximum(sq, 0.0)))
+
+        if not id_chunks:
+            return top_k(np.arange(0), np.empty(0, dtype=np.float32), k)
+        return top_k(np.concatenate(id_chunks), np.concatenate(dist_chunks), k)
+
+    def search_many(self, queries, k=1):
+        # Each query probes its own lists, so queries are searched one by one
+        rows = [pad_results(*self.search(query, k), k) for query in queries]
+        if not rows:
+            return np.empty((0, k), dtype=np.int64), np.empty((0, k), dtype=np.float32)
+        return np.stack([r[0] for r in rows]), np.stack([r[1] for r in rows])
+
+
+class PQMatcher:
+    # Product-quantized first pass: each query builds a table of distances from its sub-vectors
+    # to every codebook centroid, and a gallery row's approximate distance is the sum of one table
+    # lookup per subspace by its byte codes. Only the codes are scanned, so the encodings stay on
+    # disk (memory-mapped) except for the few candidate rows re-ranked exactly.
+    name = "pq"
+
+    def __init__(self, gallery, rerank=DEFAULT_RERANK):
+        self.gallery = gallery
+        self.codebooks = np.asarray(gallery.extras["pq_codebooks"], dtype=np.float32)
+        # Subspace-major (subspaces x rows), so each lookup pass reads one contiguous byte array
+        self.codes = gallery.extras["pq_codes"]
+        self.rerank = rerank
+
+    def distance_table(self, query):
+        # (subspaces, centroids) squared distances from each query sub-vector to each centroid
+        parts = query.reshape(len(self.codebooks), 1, -1)
+        return ((self.codebooks - parts) ** 2).sum(axis=2)
+
+    def approximate_distances(self, query):
+        table = self.distance_table(query)
+        approx = np.zeros(self.codes.shape[1], dtype=np.float32)
+        for subspace_table, subspace_codes in zip(table, self.codes):
+            approx += np.take(subspace_table, subspace_codes)
+        return approx
+
+    def search(self, query, k=1):
+        query = np.asarray(query, dtype=np.float32)
+        approx = self.approximate_distances(query)
+        candidates = top_k(np.arange(len(approx)), approx, max(k, self.rerank))[0]
+        # Sorted row order reads the memory-mapped encodings front to back
+        candidates = np.sort(candidates)
+        rows = np.asarray(self.gallery.encodings[candidates], dtype=np.float32)
+        distances = np.sqrt(((rows - query) ** 2).sum(axis=1))
+        return top_k(candidates, distances, k)
+
+    def search_many(self, queries, k=1):
+        rows = [pad_results(*self.search(query, k), k) for query in queries]
+        if not rows:
+            return np.empty((0, k), dtype=np.int64), np.empty((0, k), dtype=np.float32)
+        return np.stack([r[0] for r in rows]), np.stack([r[1] for r in rows])
+
+
+def assign_nearest(data, centroids, block_size=65536):
+    # Index of the nearest centroid for every row, computed in blocks to bound memory
+    centroid_sq = np.einsum('ij,ij->i', centroids, centroids)
+    assignment = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), block_size):
+        block = np.asarray(data[start:start + block_size], dtype=np.float32)
+        assignment[start:start + block_size] = np.argmin(centroid_sq - 2.0 * (block @ centroids.T), axis=1)
+    return assignment
+
+
+def kmeans(data, n_clusters, iterations=20, sample_size=256, seed=0):
+    # Plain Lloyd iterations on a random sample of at most sample_size points per cluster
+    rng = np.random.default_rng(seed)
+    if len(data) > n_clusters * sample_size:
+        data = data[np.sort(rng.choice(len(data), n_clusters * sample_size, replace=False))]
+    data = np.asarray(data, dtype=np.float32)
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignment = assign_nearest(data, centroids)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        sums = np.stack([np.bincount(assignment, weights=data[:, d], minlength=n_clusters)
+                         for d in range(data.shape[1])], axis=1)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty clusters from random points so every list stays useful
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+
+    return centroids
+
+
+def default_n_lists(count):
+    return max(1, int(round(np.sqrt(count))))
+
+
+def build_ivf(gallery, n_lists=None, iterations=20, seed=0):
+    # Returns a new gallery with rows grouped by cluster plus the IVF sections
+    n_lists = min(n_lists or default_n_lists(len(gallery)), len(gallery))
+    centroids = kmeans(gallery.encodings, n_lists, iterations=iterations, seed=seed)
+    assignment = assign_nearest(gallery.encodings, centroids)
+    order = np.argsort(assignment, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))]).astype(np.int64)
+
+    extras = dict(gallery.extras)
+    extras["ivf_centroids"] = centroids
+    extras["ivf_offsets"] = offsets
+    return gallery.take(order, extras)
+
+
+def build_pq(gallery, subspaces=PQ_SUBSPACES, float16=False, iterations=20, seed=0):
+    # Returns a gallery with PQ codes and codebooks, in the same row order. With float16 the
+    # stored encodings (used only to re-rank) are halved as well. IVF sections are dropped:
+    # the PQ scan replaces the inverted lists as the first pass.
+    encodings = np.asarray(gallery.encodings, dtype=np.float32)
+    dim = encodings.shape[1]
+    if dim % subspaces:
+        raise ValueError(f"{dim}-d encodings cannot be split into {subspaces} equal sub-vectors.")
+    centroids = min(PQ_CENTROIDS, len(gallery))
+    codebooks = np.empty((subspaces, centroids, dim // subspaces), dtype=np.float32)
+    codes = np.empty((subspaces, len(gallery)), dtype=np.uint8)
+    for m, part in enumerate(np.split(encodings, subspaces, axis=1)):
+        part = np.ascontiguousarray(part)
+        # 8-d sub-vectors need far fewer training points per centroid than full encodings
+        codebooks[m] = kmeans(part, centroids, iterations=iterations, sample_size=64, seed=seed + m)
+        codes[m] = assign_nearest(part, codebooks[m])
+
+    extras = {name: array for name, array in gallery.extras.items() if not name.startswith("ivf_")}
+    extras["pq_codebooks"] = codebooks
+    extras["pq_codes"] = codes
+    stored = encodings.astype(np.float16) if float16 else encodings
+    return FaceGallery(stored, gallery.label_ids, gallery.names, gallery.sq_norms, extras)
+
+
+def gallery_memory(gallery):
+    # Bytes per part of a gallery: what exact search scans, and what a PQ scan keeps resident
+    rows = len(gallery)
+    report = {
+        "rows": rows,
+        "float64_encodings": rows * gallery.encodings.shape[1] * 8,
+        "float32_scan": rows * gallery.encodings.shape[1] * 4 + rows * 4,
+        "stored_encodings": int(gallery.encodings.nbytes),
+    }
+    if "pq_codes" in gallery.extras:
+        report["pq_scan"] = int(gallery.extras["pq_codes"].nbytes + gallery.extras["pq_codebooks"].nbytes)
+    return report
+
+
+def compare_pq(gallery, compressed, tolerance=0.6, sample_size=1000, rerank=DEFAULT_RERANK, seed=0):
+    # Leave-one-out agreement between exact matching and PQ + re-rank on sampled gallery rows:
+    # each row is a query with itself excluded, and the answer is the student (or None above the
+    # tolerance) recognize_face would return
+    exact, pq = BruteForceMatcher(gallery), PQMatcher(compressed, rerank=rerank)
+    rng = np.random.default_rng(seed)
+    sample = np.arange(len(gallery))
+    if len(sample) > sample_size:
+        sample = np.sort(rng.choice(sample, sample_size, replace=False))
+
+    def answer(ids, distances, row):
+        for index, distance in zip(ids, distances):
+            if index != row and index >= 0:
+                return gallery.label(index) if distance <= gallery.tolerance(index, tolerance) else None, distance
+        return None, np.inf
+
+    agree = 0
+    distance_error = []
+    for row in sample:
+        query = np.asarray(gallery.encodings[row], dtype=np.float32)
+        exact_answer, exact_distance = answer(*exact.search(query, k=2), row)
+        pq_answer, pq_distance = answer(*pq.search(query, k=2), row)
+        agree += exact_answer == pq_answer
+        if np.isfinite(exact_distance) and np.isfinite(pq_distance):
+            distance_error.append(abs(pq_distance - exact_distance))
+    return {
+        "evaluated": len(sample),
+        "agreement": agree / len(sample) if len(sample) else None,
+        "mean_distance_error": float(np.mean(distance_error)) if distance_error else None,
+    }
+
+
+def load_matcher(gallery, kind="auto", nprobe=DEFAULT_NPROBE, rerank=DEFAULT_RERANK):
+    # "auto" uses the PQ codes or IVF index when the gallery was trained with one
+    if kind == "pq" or (kind == "auto" and "pq_codes" in gallery.extras):
+        if "pq_codes" not in gallery.extras:
+            raise ValueError("This gallery has no PQ codes. Re-run train.py with --compress pq.")
+        return PQMatcher(gallery, rerank=rerank)
+    if kind == "exact" or (kind == "auto" and "ivf_centroids" not in gallery.extras):
+        return BruteForceMatcher(gallery)
+    if "ivf_centroids" not in gallery.extras:
+        raise ValueError("This gallery has no IVF index. Re-run train.py with --index ivf.")
+    return IVFMatcher(gallery, nprobe=nprobe)
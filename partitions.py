@@ -0,0 +1,127 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import numpy as np
+from face_store import FaceGallery, load_gallery, save_gallery
+
+# Students whose record lacks the partition field (or who are not in the database)
+UNASSIGNED = "unassigned"
+# Kiosk setting: comma-separated partitions to load, e.g. "12th" or "north-campus,south-campus"
+PARTITIONS_ENV = "STUDENT_GALLERY_PARTITIONS"
+
+
+def partition_slug(value):
+    # File-name-safe form of a partition value; values that had to be altered (e.g. Thai site
+    # names) get a hash suffix so two of them never share a file
+    slug = re.sub(r'[^A-Za-z0-9_-]+', '_', value).strip('_')
+    if slug != value:
+        slug = f"{slug or 'p'}-{hashlib.sha1(value.encode('utf-8')).hexdigest()[:8]}"
+    return slug
+
+
+def partition_file(gallery_file, value):
+    base, ext = os.path.splitext(gallery_file)
+    return f"{base}.{partition_slug(value)}{ext}"
+
+
+def index_file(gallery_file):
+    return os.path.splitext(gallery_file)[0] + ".partitions.json"
+
+
+def read_index(gallery_file):
+    with open(index_file(gallery_file), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def partitions_from_env(environ):
+    value = environ.get(PARTITIONS_ENV, "")
+    return [part.strip() for part in value.split(",") if part.strip()] or None
+
+
+def split_by_partition(encodings, labels, student_partitions):
+    # {partition: (encodings, labels)}; student_partitions maps student id -> field value
+    groups = {}
+    for encoding, label in zip(encodings, labels):
+        value = student_partitions.get(label)
+        value = UNASSIGNED if value is None or value == "" else str(value)
+        group = groups.setdefault(value, ([], []))
+        group[0].append(encoding)
+        group[1].append(label)
+    return groups
+
+
+def save_partitions(gallery_file, field, galleries):
+    # One gallery file per partition, then the index that names them. The index is replaced last,
+    # so a reader that goes through it never sees a partition from an unfinished run.
+    try:
+        old = read_index(gallery_file)
+        old_files = {info["file"] for info in old["partitions"].values()}
+        version = old.get("version", 0) + 1
+    except (OSError, ValueError, KeyError):
+        old_files, version = set(), 1
+    partitions = {}
+    for value, gallery in sorted(galleries.items()):
+        path = partition_file(gallery_file, value)
+        save_gallery(path, gallery)
+        partitions[value] = {"file": os.path.basename(path), "rows": len(gallery), "students": len(gallery.names)}
+    path = index_file(gallery_file)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"field": field, "version": version, "partitions": partitions}, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+    # Partitions that no longer exist (a student moved out of the last one of a grade, say)
+    for name in old_files - {info["file"] for info in partitions.values()}:
+        try:
+            os.remove(os.path.join(os.path.dirname(gallery_file), name))
+        except OSError:
+            pass
+    return partitions
+
+
+def merge_galleries(galleries):
+    # One in-memory gallery over several partitions. A student enrolled in more than one keeps a
+    # single label. Per-student thresholds carry over; IVF indexes do not (each partition's lists
+    # are local to it), so a merged gallery is searched exactly.
+    names = sorted({name for gallery in galleries for name in gallery.names})
+    index = {name: i for i, name in enumerate(names)}
+    label_ids = np.concatenate([np.array([index[name] for name in gallery.names], dtype=np.int32)[gallery.label_ids]
+                                for gallery in galleries])
+    extras = {}
+    if all("label_thresholds" in gallery.extras for gallery in galleries):
+        thresholds = np.zeros(len(names), dtype=np.float32)
+        for gallery in galleries:
+            for name, threshold in zip(gallery.names, gallery.extras["label_thresholds"]):
+                thresholds[index[name]] = max(thresholds[index[name]], threshold)
+        extras["label_thresholds"] = thresholds
+    return FaceGallery(np.concatenate([gallery.encodings for gallery in galleries]), label_ids, names,
+                       np.concatenate([gallery.sq_norms for gallery in galleries]), extras)
+
+
+def load_partitions(gallery_file, values, mmap=True):
+    # The gallery for the given partitions only. A single partition is memory-mapped as saved,
+    # so its IVF index (if any) is kept.
+    header = read_index(gallery_file)
+    missing = [value for value in values if value not in header["partitions"]]
+    if missing:
+        raise ValueError(f"Unknown {header['field']} partition(s) {', '.join(missing)}; "
+                         f"{gallery_file} has {', '.join(sorted(header['partitions']))}.")
+    directory = os.path.dirname(gallery_file)
+    galleries = [load_gallery(os.path.join(directory, header["partitions"][value]["file"]), mmap)
+                 for value in dict.fromkeys(values)]
+    gallery = galleries[0] if len(galleries) == 1 else merge_galleries(galleries)
+    gallery.version = header["version"]
+    return gallery
+
+
+if __name__ == "__main__":
+    # python partitions.py student_faces.gallery: list the partitions train.py --partition-by wrote
+    parser = argparse.ArgumentParser(description="List the partitions of a partitioned face gallery.")
+    parser.add_argument('gallery', nargs='?', default="student_faces.gallery")
+    args = parser.parse_args()
+    header = read_index(args.gallery)
+    print(f"{index_file(args.gallery)}: partitioned by {header['field']}, version {header['version']}")
+    for value, info in sorted(header["partitions"].items()):
+        print(f"  {value}: {info['students']} students, {info['rows']} rows in {info['file']}")
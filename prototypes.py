@@ -0,0 +1,122 @@
+import numpy as np
+from face_store import FaceGallery
+
+# Photos further than this from a student's mean encoding get their own medoid prototypes
+OUTLIER_DISTANCE = 0.35
+# Per-student threshold = furthest enrolment photo from its prototype + margin, capped at the tolerance
+THRESHOLD_MARGIN = 0.2
+MIN_THRESHOLD = 0.4
+
+
+def pairwise_distances(a, b):
+    sq = np.einsum('ij,ij->i', a, a)[:, None] + np.einsum('ij,ij->i', b, b)[None, :] - 2.0 * (a @ b.T)
+    return np.sqrt(np.maximum(sq, 0.0))
+
+
+def k_medoids(points, k, iterations=10):
+    # Farthest-first initialisation, then alternate assignment / medoid update
+    distances = pairwise_distances(points, points)
+    medoids = [int(np.argmax(distances.sum(axis=1)))]
+    while len(medoids) < k:
+        medoids.append(int(np.argmax(distances[:, medoids].min(axis=1))))
+
+    for _ in range(iterations):
+        assignment = np.argmin(distances[:, medoids], axis=1)
+        updated = []
+        for cluster in range(k):
+            members = np.flatnonzero(assignment == cluster)
+            if len(members) == 0:
+                updated.append(medoids[cluster])
+                continue
+            within = distances[np.ix_(members, members)].sum(axis=1)
+            updated.append(int(members[np.argmin(within)]))
+        if updated == medoids:
+            break
+        medoids = updated
+    return points[medoids]
+
+
+def student_prototypes(encodings, max_prototypes, tolerance):
+    # Mean encoding plus up to max_prototypes - 1 medoids of the photos the mean does not cover
+    encodings = np.asarray(encodings, dtype=np.float32)
+    prototypes = encodings.mean(axis=0, keepdims=True)
+    outliers = encodings[pairwise_distances(encodings, prototypes)[:, 0] > OUTLIER_DISTANCE]
+    if max_prototypes > 1 and len(outliers):
+        prototypes = np.vstack([prototypes, k_medoids(outliers, min(max_prototypes - 1, len(outliers)))])
+
+    cover = pairwise_distances(encodings, prototypes).min(axis=1).max()
+    threshold = float(np.clip(cover + THRESHOLD_MARGIN, MIN_THRESHOLD, tolerance))
+    return prototypes, threshold
+
+
+def group_by_label(encodings, labels):
+    groups = {}
+    for encoding, label in zip(encodings, labels):
+        groups.setdefault(label, []).append(encoding)
+    return groups
+
+
+def build_prototype_gallery(encodings, labels, max_prototypes=3, tolerance=0.6):
+    # One row per prototype; thresholds are stored per label id so row reordering (IVF) keeps them valid
+    proto_encodings, proto_labels, thresholds = [], [], {}
+    for label, group in group_by_label(encodings, labels).items():
+        prototypes, thresholds[label] = student_prototypes(group, max_prototypes, tolerance)
+        proto_encodings.extend(prototypes)
+        proto_labels.extend([label] * len(prototypes))
+
+    gallery = FaceGallery.from_encodings(proto_encodings, proto_labels)
+    gallery.extras["label_thresholds"] = np.array([thresholds[name] for name in gallery.names], dtype=np.float32)
+    return gallery
+
+
+def compare_accuracy(encodings, labels, max_prototypes=3, tolerance=0.6, sample_size=1000, seed=0):
+    # Leave-one-out top-1 accuracy of full-gallery matching vs prototype matching.
+    # Only students with at least two photos are evaluated (otherwise neither mode can be right).
+    encodings = np.asarray(encodings, dtype=np.float32)
+    full = FaceGallery.from_encodings(encodings, labels)
+    protos = build_prototype_gallery(encodings, labels, max_prototypes, tolerance)
+    thresholds = protos.extras["label_thresholds"]
+    label_ids = full.label_ids
+
+    counts = np.bincount(label_ids)
+    candidates = np.flatnonzero(counts[label_ids] > 1)
+    rng = np.random.default_rng(seed)
+    if len(candidates) > sample_size:
+        candidates = rng.choice(candidates, sample_size, replace=False)
+
+    full_correct = proto_correct = agree = 0
+    for i in candidates:
+        query, truth = encodings[i], label_ids[i]
+
+        distances = full.distances(query)
+        distances[i] = np.inf
+        best = int(np.argmin(distances))
+        full_answer = label_ids[best] if distances[best] <= tolerance else -1
+
+        # Other students' prototypes are unaffected; rebuild the query student's without the held-out photo
+        distances = protos.distances(query)
+        distances[protos.label_ids == truth] = np.inf
+        best = int(np.argmin(distances))
+        best_distance, best_label = distances[best], protos.label_ids[best]
+        best_threshold = thresholds[best_label]
+        own = np.flatnonzero(label_ids == truth)
+        prototypes, threshold = student_prototypes(encodings[own[own != i]], max_prototypes, tolerance)
+        own_distance = pairwise_distances(query[None, :], prototypes).min()
+        if own_distance < best_distance:
+            best_distance, best_label, best_threshold = own_distance, truth, threshold
+        proto_answer = best_label if best_distance <= best_threshold else -1
+
+        full_correct += full_answer == truth
+        proto_correct += proto_answer == truth
+        agree += full_answer == proto_answer
+
+    evaluated = max(len(candidates), 1)
+    return {
+        "evaluated": len(candidates),
+        "gallery_rows": len(full),
+        "prototype_rows": len(protos),
+        "compression": len(full) / len(protos),
+        "full_accuracy": float(full_correct) / evaluated,
+        "prototype_accuracy": float(proto_correct) / evaluated,
+        "agreement": float(agree) / evaluated,
+    }
@@ -0,0 +1,151 @@
+import json
+import time
+from collections import namedtuple
+import numpy as np
+from PIL import Image
+from instrumentation import metrics
+
+# min_side: smallest accepted width/height in pixels, read from the file header alone
+# min_sharpness: variance of the Laplacian of a small grey copy; blurry shots score low
+# min_brightness/max_brightness: accepted mean grey level (0-255) of that copy
+# max_hash_distance: dHash bits two photos of one student may differ by and still be duplicates
+QualitySettings = namedtuple("QualitySettings", ["min_side", "min_sharpness", "min_brightness", "max_brightness",
+                                                 "max_hash_distance"])
+DEFAULT_QUALITY = QualitySettings(min_side=80, min_sharpness=15.0, min_brightness=30, max_brightness=225,
+                                  max_hash_distance=4)
+# Blur and exposure are measured on a copy this size; JPEGs are decoded straight to it
+THUMB_SIDE = 256
+
+
+def laplacian_variance(pixels):
+    pixels = pixels.astype(np.float32)
+    laplacian = (pixels[1:-1, :-2] + pixels[1:-1, 2:] + pixels[:-2, 1:-1] + pixels[2:, 1:-1]
+                 - 4 * pixels[1:-1, 1:-1])
+    return float(laplacian.var())
+
+
+def dhash(image):
+    # 64-bit difference hash: is each pixel of a 9x8 grey copy brighter than its right neighbour
+    pixels = np.asarray(image.resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    return int.from_bytes(np.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes(), "big")
+
+
+def hash_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def assess_image(source, settings=DEFAULT_QUALITY):
+    # (reason, dhash) for a path or file object; reason is None if the photo is worth encoding.
+    # Costs a header read and a small decode, against hundreds of ms for detection + encoding.
+    try:
+        with Image.open(source) as image:
+            width, height = image.size
+            if min(width, height) < settings.min_side:
+                return f"too small ({width}x{height})", None
+            image.draft("L", (THUMB_SIDE, THUMB_SIDE))
+            grey = image.convert("L")
+    except Exception as e:
+        return f"unreadable ({type(e).__name__})", None
+    grey.thumbnail((THUMB_SIDE, THUMB_SIDE))
+    pixels = np.asarray(grey)
+    brightness = float(pixels.mean())
+    if brightness < settings.min_brightness:
+        return f"underexposed (mean level {brightness:.0f})", None
+    if brightness > settings.max_brightness:
+        return f"overexposed (mean level {brightness:.0f})", None
+    sharpness = laplacian_variance(pixels)
+    if sharpness < settings.min_sharpness:
+        return f"blurry (sharpness {sharpness:.1f})", None
+    return None, dhash(grey)
+
+
+class QualityGate:
+    # Decides which new photos go to the encoder and keeps the report. assess_image results are
+    # passed in, so callers can compute them in parallel; duplicate checks happen here, in order:
+    # the first of several near-identical photos of a student is kept.
+    def __init__(self, settings=DEFAULT_QUALITY):
+        self.settings = settings
+        self.hashes = {}
+        self.rejected = []
+        self.checked = 0
+        self.encoded = 0
+        self.encode_seconds = 0.0
+
+    def add_known(self, label, name, image_hash):
+        # A photo already in the gallery; new near-duplicates of it are rejected
+        if image_hash is not None:
+            self.hashes.setdefault(label, []).append((image_hash, name))
+
+    def admit(self, label, name, assessment):
+        # Returns the photo's dhash if it should be encoded, else None
+        reason, image_hash = assessment
+        self.checked += 1
+        if reason is None:
+            for other_hash, other_name in self.hashes.get(label, ()):
+                if hash_distance(image_hash, other_hash) <= self.settings.max_hash_distance:
+                    reason = f"near-duplicate of {other_name}"
+                    break
+        if reason is not None:
+            self.rejected.append((name, reason))
+            metrics.count("images_rejected")
+            return None
+        self.add_known(label, name, image_hash)
+        return image_hash
+
+    def record_encoding(self, count, seconds):
+        self.encoded += count
+        self.encode_seconds += seconds
+
+    def seconds_saved(self):
+        # Estimated from this run's wall-clock encode time per photo (None if nothing was encoded)
+        if not self.encoded:
+            return None
+        return len(self.rejected) * self.encode_seconds / self.encoded
+
+    def summary(self):
+        reasons = {}
+        for _, reason in self.rejected:
+            kind = reason.split(" (")[0].split(" of ")[0]
+            reasons[kind] = reasons.get(kind, 0) + 1
+        line = f"Quality gate: rejected {len(self.rejected)} of {self.checked} new images"
+        if reasons:
+            line += " (" + ", ".join(f"{count} {kind}" for kind, count in sorted(reasons.items())) + ")"
+        saved = self.seconds_saved()
+        if saved is not None and self.rejected:
+            line += f", saving about {saved:.1f}s of encoding"
+        return "\n".join([line] + [f"  {name}: {reason}" for name, reason in self.rejected])
+
+    def write_report(self, path):
+        report = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "settings": self.settings._asdict(),
+            "checked": self.checked,
+            "encoded": self.encoded,
+            "encode_seconds": self.encode_seconds,
+            "estimated_seconds_saved": self.seconds_saved(),
+            "rejected": [{"image": name, "reason": reason} for name, reason in self.rejected],
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+def add_quality_arguments(parser):
+    parser.add_argument('--quality-gate', action='store_true',
+                        help="screen new photos with the checks below before encoding (off: encode every photo)")
+    parser.add_argument('--min-side', type=int, default=DEFAULT_QUALITY.min_side,
+                        help="reject photos narrower or shorter than this many pixels")
+    parser.add_argument('--min-sharpness', type=float, default=DEFAULT_QUALITY.min_sharpness,
+                        help="reject photos whose Laplacian variance is below this (blur)")
+    parser.add_argument('--brightness', type=int, nargs=2, metavar=('MIN', 'MAX'),
+                        default=[DEFAULT_QUALITY.min_brightness, DEFAULT_QUALITY.max_brightness],
+                        help="accepted mean grey level, 0-255 (exposure)")
+    parser.add_argument('--max-hash-distance', type=int, default=DEFAULT_QUALITY.max_hash_distance,
+                        help="photos of one student within this many dHash bits are duplicates (-1 = keep all)")
+    parser.add_argument('--quality-report', default=None, help="also write the rejected photos as JSON here")
+
+
+def quality_from_args(args):
+    if not args.quality_gate:
+        return None
+    return QualitySettings(args.min_side, args.min_sharpness, args.brightness[0], args.brightness[1],
+                           args.max_hash_distance)
@@ -0,0 +1,167 @@
+import io
+import os
+import time
+from collections import namedtuple
+from detection import DEFAULT_DETECTION, detect_and_encode
+from face_store import load_gallery, load_legacy_pickles
+from instrumentation import metrics
+from matcher import load_matcher
+
+GALLERY_FILE = "student_faces.gallery"
+LEGACY_MODEL_FILE = "student_face_model.pkl"
+LEGACY_LABELS_FILE = "student_labels.pkl"
+# Same default tolerance face_recognition.compare_faces uses
+MATCH_TOLERANCE = 0.6
+
+# One detected face: (top, right, bottom, left) box, matched student id (None if unknown) and distance
+FaceMatch = namedtuple("FaceMatch", ["box", "student_id", "distance"])
+
+
+def load_face_gallery(gallery_file=GALLERY_FILE, mmap=True, partitions=None):
+    # Memory-map the face gallery; fall back to the old pair of pickle files. With partitions,
+    # only those partitions of a gallery trained with --partition-by are loaded.
+    if partitions:
+        from partitions import load_partitions
+        return load_partitions(gallery_file, partitions, mmap)
+    if os.path.exists(gallery_file):
+        return load_gallery(gallery_file, mmap)
+    if os.path.exists(LEGACY_MODEL_FILE) and os.path.exists(LEGACY_LABELS_FILE):
+        return load_legacy_pickles(LEGACY_MODEL_FILE, LEGACY_LABELS_FILE)
+    raise FileNotFoundError(f"Face gallery not found. Please run train.py to create '{gallery_file}'.")
+
+
+def warm_up_worker():
+    # Picklable no-op for a fresh worker process: pay the face_recognition/dlib import up front.
+    # Returns the seconds it took.
+    start = time.perf_counter()
+    import face_recognition  # noqa: F401
+    return time.perf_counter() - start
+
+
+def load_image(image_path):
+    import face_recognition
+    with metrics.timer("decode"):
+        return face_recognition.load_image_file(image_path)
+
+
+def encode_file(image_path, detection=DEFAULT_DETECTION):
+    # Picklable entry point for worker processes: decode, detect and encode one photo
+    return detect_and_encode(load_image(image_path), detection)
+
+
+def encode_bytes(data, detection=DEFAULT_DETECTION):
+    # Same as encode_file for an uploaded photo (the recognition server's workers)
+    return detect_and_encode(load_image(io.BytesIO(data)), detection)
+
+
+class FaceRecognizer:
+    def __init__(self, gallery, matcher=None, tolerance=MATCH_TOLERANCE, detection=DEFAULT_DETECTION):
+        self.gallery = gallery
+        self.matcher = matcher if matcher is not None else load_matcher(gallery)
+        self.tolerance = tolerance
+        self.detection = detection
+        metrics.gauge("gallery_size", len(gallery))
+
+    @classmethod
+    def from_file(cls, gallery_file=GALLERY_FILE, matcher_kind="auto", detection=DEFAULT_DETECTION, mmap=True,
+                  partitions=None):
+        gallery = load_face_gallery(gallery_file, mmap, partitions)
+        return cls(gallery, load_matcher(gallery, matcher_kind), detection=detection)
+
+    def match(self, encoding):
+        # (student_id, distance) of the nearest gallery row; student_id is None above the tolerance
+        return self.match_many([encoding])[0]
+
+    def match_many(self, encodings):
+        # All faces of an image in one batched M x N distance computation
+        if len(encodings) == 0:
+            return []
+        with metrics.timer("match"):
+            best_indices, best_distances = self.matcher.search_many(encodings, k=1)
+        results = []
+        for index, distance in zip(best_indices[:, 0], best_distances[:, 0]):
+            if index < 0:
+                results.append((None, None))
+            elif distance <= self.gallery.tolerance(index, self.tolerance):
+                results.append((self.gallery.label(index), float(distance)))
+            else:
+                results.append((None, float(distance)))
+        return results
+
+    def match_faces(self, boxes, encodings):
+        return [FaceMatch(box, student_id, distance)
+                for box, (student_id, distance) in zip(boxes, self.match_many(encodings))]
+
+    def recognize_image(self, image):
+        return self.match_faces(*detect_and_encode(image, self.detection))
+
+    def recognize_file(self, image_path, cache=None):
+        # Every face in the photo, so one class photo is a full attendance pass.
+        # With an EncodingCache, a photo seen before only redoes the matching step.
+        if cache is not None:
+            from result_cache import content_digest
+            digest = content_digest(image_path)
+            cached = cache.get(digest, self.detection)
+            if cached is not None:
+                return self.match_faces(*cached)
+        boxes, encodings = detect_and_encode(load_image(image_path), self.detection)
+        if cache is not None:
+            cache.put(digest, self.detection, boxes, encodings)
+        return self.match_faces(boxes, encodings)
+
+
+def gallery_stamp(gallery_file):
+    # save_gallery renames a new file into place, so any retrain changes the inode, size or mtime
+    try:
+        stat = os.stat(gallery_file)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class GalleryWatcher:
+    # Holds the current FaceRecognizer and swaps in a new one when train.py replaces the gallery
+    # file. Callers read .recognizer once per recognition: a recognizer already in use keeps its
+    # memory map of the old (renamed-over) file, so in-flight recognitions finish against the old
+    # gallery while new ones get the new one. A file that fails to load is reported once and the
+    # current gallery stays in use. With partitions, the partition index (written last by
+    # train.py) is watched instead of the gallery file.
+    def __init__(self, gallery_file=GALLERY_FILE, matcher_kind="auto", detection=DEFAULT_DETECTION, partitions=None):
+        self.gallery_file = gallery_file
+        self.matcher_kind = matcher_kind
+        self.detection = detection
+        self.partitions = partitions
+        if partitions:
+            from partitions import index_file
+            self.watched_file = index_file(gallery_file)
+        else:
+            self.watched_file = gallery_file
+        # Windows cannot rename over a file that is memory-mapped, which would block train.py
+        self.mmap = os.name != "nt"
+        self.stamp = gallery_stamp(self.watched_file)
+        self.failed_stamp = None
+        self.recognizer = self.load()
+
+    def load(self):
+        return FaceRecognizer.from_file(self.gallery_file, self.matcher_kind, self.detection, self.mmap, self.partitions)
+
+    @property
+    def version(self):
+        return self.recognizer.gallery.version
+
+    def check(self):
+        # One stat() unless the file changed; returns the new FaceRecognizer after a reload, else None
+        stamp = gallery_stamp(self.watched_file)
+        if stamp is None or stamp == self.stamp or stamp == self.failed_stamp:
+            return None
+        try:
+            recognizer = self.load()
+        except (OSError, ValueError, KeyError) as e:
+            self.failed_stamp = stamp
+            print(f"Keeping face gallery version {self.version}: could not load {self.gallery_file}: {e}")
+            return None
+        self.stamp = stamp
+        self.recognizer = recognizer
+        metrics.count("gallery_reloads")
+        print(f"Reloaded {self.gallery_file}: version {self.version}, {len(recognizer.gallery)} encodings")
+        return recognizer
@@ -0,0 +1,161 @@
+import time
+from collections import deque, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from instrumentation import metrics, run_captured
+
+# cache_key: (digest, detection) to store the result under; captured: the future also carries
+# metric events; remote: the future already holds FaceMatch results from a recognition server;
+# recognizer: the FaceRecognizer current at submit, so a gallery reloaded meanwhile does not
+# change the answer for a photo already queued
+Job = namedtuple("Job", ["image_path", "future", "cache_key", "captured", "remote", "submitted", "recognizer"])
+# Concurrent uploads to a recognition server
+CLIENT_THREADS = 4
+# URL of a shared recognition_server.py, e.g. http://127.0.0.1:8765
+SERVER_ENV = "STUDENT_RECOGNITION_SERVER"
+
+
+def client_from_env(environ):
+    url = environ.get(SERVER_ENV)
+    if not url:
+        return None
+    from recognition_server import RecognitionClient
+    return RecognitionClient(url)
+
+
+class RecognitionJobs:
+    # Queues photos for recognition in a worker process and hands the results back on the Tk
+    # thread by polling with after(), so dlib detection never blocks the mainloop.
+    # get_recognizer is only called once a job is submitted, so the gallery can still be
+    # loading in the background while the window is already up. With use_cache, photos seen
+    # before are answered from the EncodingCache without going to the worker. With a client
+    # (recognition_server.RecognitionClient) photos are sent to the shared server instead, and
+    # no gallery or dlib is loaded in this process at all.
+    def __init__(self, widget, get_recognizer, on_result, on_change=None, poll_ms=50, use_cache=True, client=None):
+        self.widget = widget
+        self.get_recognizer = get_recognizer
+        self.client = client
+        self.use_cache = use_cache and client is None
+        self.cache = None
+        self.on_result = on_result
+        self.on_change = on_change
+        self.poll_ms = poll_ms
+        self.executor = None
+        self.worker_ready = None
+        self.jobs = deque()
+        self.total = 0
+        self.completed = 0
+        self.poll_scheduled = False
+
+    @property
+    def pending(self):
+        return len(self.jobs)
+
+    def warm_up(self):
+        # Start the worker process and have it import face_recognition/dlib before the first job.
+        # Returns a Future for the seconds the import took in the worker (None with a client).
+        if self.client is not None:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=CLIENT_THREADS)
+            return None
+        if self.use_cache and self.cache is None:
+            from result_cache import EncodingCache
+            self.cache = EncodingCache()
+        if self.executor is None:
+            from recognition import warm_up_worker
+            self.executor = ProcessPoolExecutor(max_workers=1)
+            self.worker_ready = self.executor.submit(warm_up_worker)
+        return self.worker_ready
+
+    def submit(self, image_path):
+        # The worker process is started on first use (or by warm_up) so app startup stays fast
+        if self.client is not None:
+            self.warm_up()
+            self.add_job(Job(image_path, self.executor.submit(self.client.recognize_file, image_path),
+                             None, False, True, time.perf_counter(), None))
+            return
+
+        from recognition import encode_file
+        recognizer = self.get_recognizer()
+        detection = recognizer.detection
+        self.warm_up()
+        cache_key = cached = None
+        if self.cache is not None:
+            from result_cache import content_digest
+            try:
+                cache_key = (content_digest(image_path), detection)
+                cached = self.cache.get(*cache_key)
+            except OSError:
+                cache_key = None  # Unreadable file: the worker reports the error
+        if cached is not None:
+            future = Future()
+            future.set_result((cached, []) if metrics.enabled else cached)
+            cache_key = None
+        elif metrics.enabled:
+            # Stage timings made in the worker come back with the result
+            future = self.executor.submit(run_captured, encode_file, image_path, detection)
+        else:
+            future = self.executor.submit(encode_file, image_path, detection)
+        self.add_job(Job(image_path, future, cache_key, metrics.enabled, False, time.perf_counter(), recognizer))
+
+    def add_job(self, job):
+        self.jobs.append(job)
+        self.total += 1
+        self.notify()
+        self.schedule_poll()
+
+    def cancel_all(self):
+        # Queued jobs are dropped; a job already running finishes in the worker and is ignored
+        for job in self.jobs:
+            job.future.cancel()
+        self.jobs.clear()
+        self.total = self.completed = 0
+        self.notify()
+
+    def shutdown(self):
+        self.cancel_all()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+            self.worker_ready = None
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+    def schedule_poll(self):
+        if not self.poll_scheduled:
+            self.poll_scheduled = True
+            self.widget.after(self.poll_ms, self.poll)
+
+    def poll(self):
+        self.poll_scheduled = False
+        # Deliver finished jobs in submission order; matching is cheap so it runs here
+        while self.jobs and self.jobs[0].future.done():
+            job = self.jobs.popleft()
+            self.completed += 1
+            try:
+                result = job.future.result()
+                if job.remote:
+                    faces, error = result, None
+                else:
+                    if job.captured:
+                        result, events = result
+                        metrics.replay(events)
+                    boxes, encodings = result
+                    if job.cache_key is not None:
+                        self.cache.put(*job.cache_key, boxes, encodings)
+                    faces, error = job.recognizer.match_faces(boxes, encodings), None
+            except Exception as e:
+                faces, error = [], str(e)
+            if not self.jobs:
+                self.total = self.completed = 0
+            metrics.observe("recognize_face", time.perf_counter() - job.submitted)
+            self.on_result(job.image_path, faces, error)
+        if metrics.enabled:
+            metrics.flush()
+        self.notify()
+        if self.jobs:
+            self.schedule_poll()
+
+    def notify(self):
+        if self.on_change is not None:
+            self.on_change()
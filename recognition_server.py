@@ -0,0 +1,276 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from detection import add_detection_arguments, settings_from_args
+from instrumentation import metrics, run_captured
+from recognition import GALLERY_FILE, FaceMatch, GalleryWatcher, encode_bytes, warm_up_worker
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAX_BODY_BYTES = 32 << 20
+# Faces matched in one distance computation, and how long the first one waits for company
+MAX_BATCH = 64
+MAX_WAIT_MS = 5.0
+# How often the server looks for a gallery retrained by train.py
+RELOAD_SECONDS = 2.0
+# How often the metric sinks are flushed while serving (e.g. the --metrics prometheus=PATH file)
+METRICS_FLUSH_SECONDS = 15.0
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class RecognitionService:
+    # Loads the gallery once and serves every kiosk. Photos are decoded/detected/encoded in a
+    # process pool; the resulting encodings from concurrent requests are queued and matched
+    # together, one M x N distance computation per micro-batch. With a GalleryWatcher the gallery
+    # is swapped in place when it is retrained; each request is matched against the recognizer
+    # that was current when it arrived.
+    def __init__(self, recognizer, workers=None, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS,
+                 watcher=None, reload_seconds=RELOAD_SECONDS):
+        self.recognizer = recognizer
+        self.watcher = watcher
+        self.reload_seconds = reload_seconds
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.match_queue = None
+        self.encoding = 0
+        self.latencies = deque(maxlen=4096)
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched_faces = 0
+
+    async def start(self):
+        self.match_queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        # Pay the dlib import in every worker before the first request
+        await asyncio.gather(*[loop.run_in_executor(self.pool, warm_up_worker) for _ in range(self.workers)])
+        self.batcher = asyncio.create_task(self.run_batcher())
+        if self.watcher is not None and self.reload_seconds > 0:
+            self.reloader = asyncio.create_task(self.watch_gallery())
+        if metrics.enabled:
+            self.flusher = asyncio.create_task(self.flush_metrics())
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    async def recognize(self, data):
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        recognizer = self.recognizer
+        self.requests += 1
+        self.encoding += 1
+        try:
+            (boxes, encodings), events = await loop.run_in_executor(self.pool, run_captured, encode_bytes, data,
+                                                                    recognizer.detection)
+        finally:
+            self.encoding -= 1
+        # Decode/detect/encode timings recorded in the worker
+        metrics.replay(events)
+        matches = []
+        if encodings:
+            future = loop.create_future()
+            await self.match_queue.put((encodings, future, recognizer))
+            matches = await future
+        latency = time.perf_counter() - start
+        self.latencies.append(latency)
+        metrics.observe("recognize_face", latency)
+        return [FaceMatch(box, student_id, distance) for box, (student_id, distance) in zip(boxes, matches)]
+
+    async def run_batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.match_queue.get()]
+            faces = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+            while faces < self.max_batch:
+                try:
+                    item = self.match_queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.match_queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                batch.append(item)
+                faces += len(item[0])
+
+            # Only a batch that straddles a gallery reload is split
+            for recognizer, items in itertools.groupby(batch, key=lambda item: item[2]):
+                self.match_batch(recognizer, list(items))
+
+    def match_batch(self, recognizer, batch):
+        try:
+            results = recognizer.match_many([encoding for encodings, _, _ in batch for encoding in encodings])
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.batched_faces += len(results)
+        offset = 0
+        for encodings, future, _ in batch:
+            if not future.done():
+                future.set_result(results[offset:offset + len(encodings)])
+            offset += len(encodings)
+
+    async def watch_gallery(self):
+        # The reload itself runs on a thread so requests keep being served meanwhile
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.reload_seconds)
+            recognizer = await loop.run_in_executor(None, self.watcher.check)
+            if recognizer is not None:
+                self.recognizer = recognizer
+
+    async def flush_metrics(self):
+        # Without this the Prometheus textfile would only be written at exit
+        while True:
+            await asyncio.sleep(METRICS_FLUSH_SECONDS)
+            metrics.flush()
+
+    def stats(self):
+        latencies = np.asarray(self.latencies) * 1000
+        return {
+            "gallery_rows": len(self.recognizer.gallery),
+            "gallery_version": self.recognizer.gallery.version,
+            "requests": self.requests,
+            "errors": self.errors,
+            "queue_depth": self.encoding + (self.match_queue.qsize() if self.match_queue else 0),
+            "encoding": self.encoding,
+            "waiting_to_match": self.match_queue.qsize() if self.match_queue else 0,
+            "batches": self.batches,
+            "mean_batch_faces": self.batched_faces / self.batches if self.batches else None,
+            "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+        }
+
+    async def handle(self, reader, writer):
+        # Minimal HTTP/1.1: one request per connection, JSON responses
+        try:
+            status, body = await self.route(reader)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        except Exception as e:
+            self.errors += 1
+            status, body = 500, {"error": str(e)}
+        payload = json.dumps(body).encode("utf-8")
+        writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode("latin-1") + payload)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def route(self, reader):
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) != 3:
+            return 400, {"error": "malformed request line"}
+        method, path = request_line[0], request_line[1].split("?")[0]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if path == "/health":
+            return 200, {"status": "ok"}
+        if path == "/stats":
+            return 200, self.stats()
+        if path != "/recognize":
+            return 404, {"error": f"unknown path {path}"}
+        if method != "POST":
+            return 405, {"error": "POST the image bytes to /recognize"}
+        length = int(headers.get("content-length", 0))
+        if length <= 0:
+            return 400, {"error": "empty body"}
+        if length > MAX_BODY_BYTES:
+            return 413, {"error": f"image larger than {MAX_BODY_BYTES} bytes"}
+        data = await reader.readexactly(length)
+        try:
+            faces = await self.recognize(data)
+        except Exception as e:
+            self.errors += 1
+            return 400, {"error": str(e)}
+        return 200, {"faces": [{"box": list(face.box), "student_id": face.student_id, "distance": face.distance}
+                               for face in faces]}
+
+
+class RecognitionClient:
+    # Talks to a running recognition_server; recognize_file returns FaceMatch like FaceRecognizer
+    def __init__(self, url=f"http://{DEFAULT_HOST}:{DEFAULT_PORT}", timeout=60.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def request(self, path, data=None):
+        request = urllib.request.Request(self.url + path, data=data, method="POST" if data is not None else "GET",
+                                         headers={"Content-Type": "application/octet-stream"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(json.loads(e.read().decode("utf-8")).get("error", str(e))) from None
+
+    def recognize_bytes(self, data):
+        faces = self.request("/recognize", data)["faces"]
+        return [FaceMatch(tuple(face["box"]), face["student_id"], face["distance"]) for face in faces]
+
+    def recognize_file(self, image_path):
+        with open(image_path, "rb") as f:
+            return self.recognize_bytes(f.read())
+
+    def stats(self):
+        return self.request("/stats")
+
+
+async def serve(service, host, port):
+    await service.start()
+    server = await asyncio.start_server(service.handle, host, port)
+    print(f"Serving {len(service.recognizer.gallery)} gallery rows (version {service.recognizer.gallery.version}) "
+          f"on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared face recognition service for the kiosks on this machine.")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--gallery', default=GALLERY_FILE)
+    parser.add_argument('--partitions', nargs='+', default=None,
+                        help="only search these partitions of a gallery trained with --partition-by")
+    parser.add_argument('--workers', type=int, default=None, help="encoding processes (default: all cores)")
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH, help="faces matched per distance computation")
+    parser.add_argument('--max-wait-ms', type=float, default=MAX_WAIT_MS, help="how long a match waits to be batched")
+    parser.add_argument('--reload-seconds', type=float, default=RELOAD_SECONDS,
+                        help="how often to check for a retrained gallery (0: never)")
+    parser.add_argument('--metrics', default=None, help="metric sinks: comma-separated log, histogram, prometheus=PATH")
+    add_detection_arguments(parser)
+    args = parser.parse_args()
+
+    metrics.configure(args.metrics)
+    watcher = GalleryWatcher(args.gallery, detection=settings_from_args(args), partitions=args.partitions)
+    service = RecognitionService(watcher.recognizer, args.workers, args.max_batch, args.max_wait_ms,
+                                 watcher, args.reload_seconds)
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
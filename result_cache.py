@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import numpy as np
+from instrumentation import metrics
+from recognition import GALLERY_FILE
+
+CACHE_FILE = ".recognition_cache.db"
+MAX_CACHE_BYTES = 256 << 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    boxes TEXT NOT NULL,
+    encodings BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def content_digest(path, chunk_size=1 << 20):
+    # Keyed by the bytes, not the path: a renamed or copied photo is still a hit
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def gallery_fingerprint(gallery_file):
+    # save_gallery replaces the file atomically, so a retrain always changes size or mtime
+    try:
+        stat = os.stat(gallery_file)
+    except FileNotFoundError:
+        return "missing"
+    return f"{os.path.abspath(gallery_file)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+class EncodingCache:
+    # Persistent map from (image content hash, detection settings) to the detected boxes and
+    # encodings, so a photo seen before skips decode/detect/encode and only redoes matching.
+    # Least recently used entries are evicted past max_bytes, and the whole cache is dropped
+    # when the gallery file changes (a retrain may use different detection or encoder settings).
+    def __init__(self, cache_file=CACHE_FILE, gallery_file=GALLERY_FILE, max_bytes=MAX_CACHE_BYTES):
+        self.cache_file = cache_file
+        self.gallery_file = gallery_file
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(cache_file)
+        self.conn.executescript(SCHEMA)
+        self.check_gallery()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def check_gallery(self):
+        # Clears the cache if the gallery changed since it was filled; returns True if it did
+        fingerprint = gallery_fingerprint(self.gallery_file)
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'gallery'").fetchone()
+        if row is not None and row[0] == fingerprint:
+            return False
+        with self.conn:
+            self.conn.execute("DELETE FROM entries")
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('gallery', ?)", (fingerprint,))
+        self.total_bytes = 0
+        return row is not None
+
+    def key(self, digest, detection):
+        return "|".join([digest, detection.model, str(detection.max_side), str(detection.upsample), str(detection.num_jitters)])
+
+    def get(self, digest, detection):
+        # (boxes, encodings) or None
+        key = self.key(digest, detection)
+        row = self.conn.execute("SELECT boxes, encodings FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            metrics.count("cache_misses")
+            return None
+        self.hits += 1
+        metrics.count("cache_hits")
+        with self.conn:
+            self.conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time_ns(), key))
+        boxes = [tuple(box) for box in json.loads(row[0])]
+        encodings = list(np.frombuffer(row[1], dtype=np.float64).reshape(len(boxes), -1)) if boxes else []
+        return boxes, encodings
+
+    def put(self, digest, detection, boxes, encodings):
+        key = self.key(digest, detection)
+        blob = np.asarray(encodings, dtype=np.float64).tobytes()
+        boxes_json = json.dumps([[int(v) for v in box] for box in boxes])
+        size = len(blob) + len(boxes_json) + len(key)
+        with self.conn:
+            old = self.conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO entries (key, boxes, encodings, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                              (key, boxes_json, blob, size, time.time_ns()))
+        self.total_bytes += size - (old[0] if old else 0)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        # Drop least recently used entries until the cache is back under 90% of max_bytes
+        target = int(self.max_bytes * 0.9)
+        with self.conn:
+            while self.total_bytes > target:
+                rows = self.conn.execute("SELECT key, size FROM entries ORDER BY last_used LIMIT 256").fetchall()
+                if not rows:
+                    self.total_bytes = 0
+                    break
+                for key, size in rows:
+                    if self.total_bytes <= target:
+                        break
+                    self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    self.total_bytes -= size
+
+    def summary(self):
+        return f"cache: {self.hits} hits, {self.misses} misses, {len(self)} entries, {self.total_bytes / 1e6:.1f} MB"
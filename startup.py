@@ -0,0 +1,100 @@
+import builtins
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+
+def run_in_background(function, *args, name=None):
+    # Run function(*args) in a daemon thread and return a Future for its result
+    future = Future()
+
+    def run():
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(function(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+    threading.Thread(target=run, name=name or getattr(function, "__name__", None), daemon=True).start()
+    return future
+
+
+class StartupProfiler:
+    # Times top-level imports, named phases and milestones (e.g. first window) from process
+    # start. When disabled every method is a no-op, so it can stay wired into the app.
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.start = time.perf_counter()
+        self.imports = []
+        self.phases = []
+        self.marks = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def install_import_hook(self):
+        # Record the cumulative time of each first-time import made outside another import
+        if not self.enabled:
+            return
+        original_import = builtins.__import__
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            if level or name in sys.modules or getattr(self.local, "importing", False):
+                return original_import(name, globals, locals, fromlist, level)
+            self.local.importing = True
+            start = time.perf_counter()
+            try:
+                return original_import(name, globals, locals, fromlist, level)
+            finally:
+                self.local.importing = False
+                self.record(self.imports, name, time.perf_counter() - start)
+
+        builtins.__import__ = timed_import
+
+    def record(self, entries, name, seconds):
+        thread = threading.current_thread()
+        where = "" if thread is threading.main_thread() else f" [{thread.name}]"
+        with self.lock:
+            entries.append((name + where, seconds))
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(self.phases, name, time.perf_counter() - start)
+
+    def add_phase(self, name, seconds):
+        # For work timed elsewhere, e.g. in a worker process
+        if self.enabled:
+            self.record(self.phases, name, seconds)
+
+    def mark(self, name):
+        if self.enabled:
+            self.record(self.marks, name, self.elapsed())
+
+    def report(self, min_ms=1.0):
+        if not self.enabled:
+            return
+        with self.lock:
+            imports, phases, marks = list(self.imports), list(self.phases), list(self.marks)
+        print("Startup profile (ms)")
+        print("  imports:")
+        for name, seconds in sorted(imports, key=lambda entry: -entry[1]):
+            if seconds * 1000 >= min_ms:
+                print(f"    {seconds * 1000:9.1f}  {name}")
+        print(f"    {sum(seconds for name, seconds in imports if '[' not in name) * 1000:9.1f}  total on the main thread")
+        print("  phases:")
+        for name, seconds in phases:
+            print(f"    {seconds * 1000:9.1f}  {name}")
+        print("  since start:")
+        for name, seconds in marks:
+            print(f"    {seconds * 1000:9.1f}  {name}")
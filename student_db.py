@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+import sqlite3
+
+DB_FILE = "students.db"
+JSON_FILE = "user.json"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS students_name ON students (name);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def iter_json_students(data):
+    # (student_id, record) pairs from either user.json shape:
+    # {"students": [{"id": ..., "name": ..., ...}]} or {"student1": {"name": ..., ...}}
+    if isinstance(data, dict) and isinstance(data.get("students"), list):
+        for student in data["students"]:
+            record = dict(student)
+            yield str(record.pop("id")), record
+    elif isinstance(data, dict):
+        for student_id, record in data.items():
+            yield str(student_id), dict(record)
+    else:
+        raise ValueError("Unsupported student JSON: expected {\"students\": [...]} or {id: {...}}")
+
+
+class StudentDatabase:
+    # Students in an SQLite file indexed by id and name. Records are fetched one at a time on
+    # demand, so opening the database costs the same for 30 students as for 30,000.
+    # The mapping-style methods match the dict that user.json used to be loaded into.
+    def __init__(self, db_file=DB_FILE):
+        self.db_file = db_file
+        self.conn = sqlite3.connect(db_file)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM students").fetchone()[0]
+
+    def __contains__(self, student_id):
+        return self.conn.execute("SELECT 1 FROM students WHERE id = ?", (student_id,)).fetchone() is not None
+
+    def __getitem__(self, student_id):
+        row = self.conn.execute("SELECT data FROM students WHERE id = ?", (student_id,)).fetchone()
+        if row is None:
+            raise KeyError(student_id)
+        return json.loads(row[0])
+
+    def get(self, student_id, default=None):
+        try:
+            return self[student_id]
+        except KeyError:
+            return default
+
+    def names(self):
+        # (student_id, name) for every student in insertion order; reads only the two indexed columns
+        return self.conn.execute("SELECT id, name FROM students ORDER BY rowid").fetchall()
+
+    def field_values(self, field):
+        # {student_id: value} of one top-level record field (e.g. grade), read inside SQLite
+        path = '$."' + field.replace('"', '') + '"'
+        return dict(self.conn.execute("SELECT id, json_extract(data, ?) FROM students", (path,)))
+
+    def find_by_name(self, name):
+        return [student_id for (student_id,) in self.conn.execute("SELECT id FROM students WHERE name = ?", (name,))]
+
+    def put(self, student_id, record):
+        self.put_many([(student_id, record)])
+
+    def put_many(self, items, batch_size=1000):
+        # Upsert (student_id, record) pairs in batches, one transaction per batch
+        batch = []
+        count = 0
+        for student_id, record in items:
+            batch.append((str(student_id), record.get("name", ""), json.dumps(record, ensure_ascii=False)))
+            if len(batch) >= batch_size:
+                count += self.write_batch(batch)
+                batch = []
+        if batch:
+            count += self.write_batch(batch)
+        return count
+
+    def write_batch(self, batch):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO students (id, name, data) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET name = excluded.name, data = excluded.data", batch)
+        return len(batch)
+
+    def delete(self, student_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM students WHERE id = ?", (student_id,))
+
+    def delete_missing(self, keep_ids):
+        # Delete every student whose id is not in keep_ids; returns how many were removed
+        with self.conn:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep_ids (id TEXT PRIMARY KEY)")
+            self.conn.execute("DELETE FROM keep_ids")
+            self.conn.executemany("INSERT OR IGNORE INTO keep_ids (id) VALUES (?)", ((i,) for i in keep_ids))
+            removed = self.conn.execute("DELETE FROM students WHERE id NOT IN (SELECT id FROM keep_ids)").rowcount
+            self.conn.execute("DELETE FROM keep_ids")
+        return removed
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def import_json(self, json_file, batch_size=1000):
+        # The JSON file is the source of truth: students missing from it are deleted, so a
+        # student removed from user.json can no longer be searched or matched.
+        # Returns (students imported, students removed).
+        with open(json_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        students = list(iter_json_students(data))
+        count = self.put_many(students, batch_size=batch_size)
+        removed = self.delete_missing(student_id for student_id, _ in students)
+        self.set_meta("imported_from", os.path.abspath(json_file))
+        self.set_meta("imported_mtime_ns", os.stat(json_file).st_mtime_ns)
+        return count, removed
+
+
+def open_database(db_file=DB_FILE, json_file=JSON_FILE):
+    # Opens the database, importing json_file once (and again only if the file changes)
+    db = StudentDatabase(db_file)
+    if json_file and os.path.exists(json_file):
+        mtime_ns = str(os.stat(json_file).st_mtime_ns)
+        if db.get_meta("imported_mtime_ns") != mtime_ns:
+            count, removed = db.import_json(json_file)
+            print(f"Imported {count} students from {json_file} into {db_file} ({removed} removed)")
+    return db
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import students from JSON into the SQLite student database.")
+    parser.add_argument('json_file', nargs='?', default=JSON_FILE, help="user.json in either supported shape")
+    parser.add_argument('--db', default=DB_FILE, help="SQLite database file")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    db = StudentDatabase(args.db)
+    count, removed = db.import_json(args.json_file, batch_size=args.batch_size)
+    print(f"Imported {count} students into {args.db}, removed {removed} no longer in {args.json_file} ({len(db)} total)")
+    db.close()
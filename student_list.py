@@ -0,0 +1,181 @@
+import tkinter as tk
+import unicodedata
+from tkinter import ttk
+
+
+def normalize_name(text):
+    # NFC so composed and decomposed Thai/Latin input compare equal; casefold for Latin names
+    return unicodedata.normalize("NFC", text).casefold()
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class NameIndex:
+    # Type-ahead search over (student_id, name) entries. A row matches when every word of the
+    # query is a substring of the name. Words of 3+ characters are looked up in a trigram
+    # index; a query that extends the previous one only re-checks the previous matches.
+    def __init__(self, entries):
+        self.ids = [student_id for student_id, _ in entries]
+        self.names = [name for _, name in entries]
+        self.normalized = [normalize_name(name) for name in self.names]
+        self.postings = {}
+        self.indexed_rows = 0
+        self.last_query = None
+        self.last_rows = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def indexed(self):
+        return self.indexed_rows == len(self.ids)
+
+    def display_names(self):
+        # Duplicate names stay distinct rows; the id is shown so they can be told apart
+        counts = {}
+        for name in self.normalized:
+            counts[name] = counts.get(name, 0) + 1
+        return [f"{name} ({student_id})" if counts[normalized] > 1 else name
+                for student_id, name, normalized in zip(self.ids, self.names, self.normalized)]
+
+    def build_postings(self, max_rows=None):
+        # Index the next max_rows names (all if None); returns True once every row is indexed.
+        # Callers can spread the work over idle time so opening the list stays instant.
+        postings = self.postings
+        end = len(self.ids) if max_rows is None else min(len(self.ids), self.indexed_rows + max_rows)
+        for row in range(self.indexed_rows, end):
+            for gram in trigrams(self.normalized[row]):
+                posting = postings.get(gram)
+                if posting is None:
+                    postings[gram] = [row]
+                else:
+                    posting.append(row)
+        self.indexed_rows = end
+        return self.indexed
+
+    def candidates(self, words):
+        # Superset of the matching rows, in roster order
+        longest = max(words, key=len)
+        if len(longest) < 3 or not self.indexed:
+            return range(len(self.ids))
+        lists = sorted((self.postings.get(gram, []) for gram in trigrams(longest)), key=len)
+        rows = set(lists[0])
+        for posting in lists[1:]:
+            rows.intersection_update(posting)
+            if not rows:
+                break
+        return sorted(rows)
+
+    def search(self, query):
+        # Row numbers (in roster order) of every name matching the query
+        query = normalize_name(query).strip()
+        words = query.split()
+        if not words:
+            rows = list(range(len(self.ids)))
+        else:
+            # Typing more can only narrow the result, so start from the previous matches
+            if self.last_query and query.startswith(self.last_query):
+                rows = self.last_rows
+            else:
+                rows = self.candidates(words)
+            normalized = self.normalized
+            for word in words:
+                rows = [row for row in rows if word in normalized[row]]
+        self.last_query, self.last_rows = query, rows
+        return rows
+
+
+class VirtualStudentList(ttk.Frame):
+    # A Listbox that only ever holds the visible rows of the (filtered) roster, with its own
+    # scrollbar mapping, so a 50k-student list opens and scrolls as fast as a 10-student one.
+    def __init__(self, master, entries, visible_rows=10, on_activate=None, **listbox_options):
+        super().__init__(master)
+        self.index = NameIndex(entries)
+        self.labels = self.index.display_names()
+        self.rows = list(range(len(self.index)))
+        self.visible_rows = visible_rows
+        self.on_activate = on_activate
+        self.offset = 0
+        self.selected_row = None
+
+        self.listbox = tk.Listbox(self, height=visible_rows, selectmode=tk.SINGLE, exportselection=False, **listbox_options)
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.on_scrollbar)
+        self.listbox.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.listbox.bind("<<ListboxSelect>>", self.on_select)
+        self.listbox.bind("<Double-Button-1>", lambda event: self.activate())
+        self.listbox.bind("<Return>", lambda event: self.activate())
+        self.listbox.bind("<Up>", lambda event: self.move_selection(-1))
+        self.listbox.bind("<Down>", lambda event: self.move_selection(1))
+        self.listbox.bind("<MouseWheel>", lambda event: self.scroll_to(self.offset - (1 if event.delta > 0 else -1) * 3))
+        self.listbox.bind("<Button-4>", lambda event: self.scroll_to(self.offset - 3))
+        self.listbox.bind("<Button-5>", lambda event: self.scroll_to(self.offset + 3))
+        self.render()
+        self.after_idle(self.index_step)
+
+    def index_step(self):
+        # Build the trigram index a chunk at a time between events; until it is done, searches scan
+        if not self.index.build_postings(max_rows=2000):
+            self.after(1, self.index_step)
+
+    def set_filter(self, query):
+        self.rows = self.index.search(query)
+        self.offset = 0
+        self.render()
+
+    def selected_student_id(self):
+        if self.selected_row is None:
+            return None
+        return self.index.ids[self.selected_row]
+
+    def activate(self):
+        if self.on_activate is not None and self.selected_row is not None:
+            self.on_activate(self.selected_student_id())
+        return "break"
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.scroll_to(int(float(amount) * len(self.rows)))
+        elif action == "scroll":
+            step = self.visible_rows if unit == "pages" else 1
+            self.scroll_to(self.offset + int(amount) * step)
+
+    def scroll_to(self, offset):
+        offset = max(0, min(offset, len(self.rows) - self.visible_rows))
+        if offset != self.offset:
+            self.offset = offset
+            self.render()
+        return "break"
+
+    def on_select(self, event=None):
+        selection = self.listbox.curselection()
+        if selection:
+            self.selected_row = self.rows[self.offset + selection[0]]
+
+    def move_selection(self, delta):
+        if not self.rows:
+            return "break"
+        position = self.rows.index(self.selected_row) if self.selected_row in self.rows else -1
+        position = max(0, min(position + delta, len(self.rows) - 1))
+        self.selected_row = self.rows[position]
+        if position < self.offset:
+            self.offset = position
+        elif position >= self.offset + self.visible_rows:
+            self.offset = position - self.visible_rows + 1
+        self.render()
+        return "break"
+
+    def render(self):
+        # Replace the Listbox contents with the window of rows starting at self.offset
+        visible = self.rows[self.offset:self.offset + self.visible_rows]
+        self.listbox.delete(0, tk.END)
+        if visible:
+            self.listbox.insert(tk.END, *[self.labels[row] for row in visible])
+        if self.selected_row in visible:
+            self.listbox.selection_set(visible.index(self.selected_row))
+
+        total = max(len(self.rows), 1)
+        self.scrollbar.set(self.offset / total, min(1.0, (self.offset + self.visible_rows) / total))
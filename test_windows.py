@@ -1,11 +1,23 @@
+import sys
+from startup import StartupProfiler, run_in_background
+
+# --profile-startup prints per-import and per-phase timings up to the first window
+profiler = StartupProfiler(enabled="--profile-startup" in sys.argv)
+profiler.install_import_hook()
+
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from PIL import Image, ImageTk
-import json
 import os
-import pickle
-import numpy as np
-import face_recognition
+from concurrent.futures import wait
+from attendance import AttendanceLog
+from instrumentation import METRICS_ENV, metrics
+from recognition_jobs import RecognitionJobs, client_from_env
+from student_list import VirtualStudentList
+from student_db import open_database
+from thumbnails import ThumbnailCache
+
+# How often a running app looks for a retrained face gallery
+GALLERY_CHECK_MS = 2000
 
 class StudentApp(tk.Tk):
     def __init__(self):
@@ -16,29 +28,32 @@ class StudentApp(tk.Tk):
 
         self.configure(bg='black')
         
-        self.load_database()
+        # Resized photos are cached in memory and on disk so navigation does no image decoding
+        self.thumbnails = ThumbnailCache()
+        with profiler.phase("student database"):
+            self.load_database()
+        # Every recognized face is logged; a background thread batches the writes (see warm_up)
+        self.attendance = None
+        # Recognition runs in a worker process; results come back through after() polling.
+        # The face stack itself is loaded in the background once the window is up, unless
+        # STUDENT_RECOGNITION_SERVER points at a shared recognition server.
+        self.gallery_future = None
+        self.recognition_jobs = RecognitionJobs(self, lambda: self.recognizer, self.on_recognition_result, self.on_recognition_progress,
+                                                client=client_from_env(os.environ))
+        self.recognized_ids = []
+        self.recognition_errors = []
+        self.frames = {}
         self.current_frame = None
-        self.show_student_selection()
+        with profiler.phase("selection screen"):
+            self.show_student_selection()
+        self.protocol("WM_DELETE_WINDOW", self.exit_application)
+        self.after_idle(self.on_first_paint)
 
     def load_database(self):
-    # Load student data from JSON
-     if not os.path.exists("user.json"):
-        self.create_sample_database()
-        
-    # Open the JSON file with utf-8 encoding
-     with open("user.json", "r", encoding="utf-8") as f:
-        self.students = json.load(f)
-
-    # Load face encodings and labels from pickle files
-     if not os.path.exists("student_face_model.pkl") or not os.path.exists("student_labels.pkl"):
-        raise FileNotFoundError("Face encodings or labels not found. Please provide 'student_face_model.pkl' and 'student_labels.pkl'.")
-
-     with open("student_face_model.pkl", "rb") as f:
-        self.known_face_encodings = pickle.load(f)
-
-     with open("student_labels.pkl", "rb") as f:
-        self.known_face_labels = pickle.load(f)
-
+        # Students live in an indexed SQLite file; user.json is only imported on first run
+        self.students = open_database()
+        if len(self.students) == 0:
+            self.create_sample_database()
 
     def create_sample_database(self):
         # Create a sample database of students
@@ -53,45 +68,128 @@ class StudentApp(tk.Tk):
                 "courses": ["Course A", "Course B", "Course C"]
             }
         
-        with open("user.json", "w") as f:
-            json.dump(students, f, indent=2)
+        self.students.put_many(students.items())
+
+    def on_first_paint(self):
+        self.update_idletasks()
+        profiler.mark("first window")
+        self.warm_up()
+        if profiler.enabled:
+            run_in_background(self.report_startup)
+
+    def warm_up(self):
+        # Start the worker process (which imports dlib) before any thread, then load the gallery
+        if self.attendance is None:
+            self.recognition_jobs.warm_up()
+            self.attendance = AttendanceLog()
+            if self.recognition_jobs.client is None:
+                self.gallery_future = run_in_background(self.load_recognizer)
+                self.after(GALLERY_CHECK_MS, self.check_gallery)
+
+    def load_recognizer(self):
+        # Memory-map the face gallery and pick the matcher it was trained for
+        with profiler.phase("face gallery (background)"):
+            from partitions import partitions_from_env
+            from recognition import GalleryWatcher
+            # STUDENT_GALLERY_PARTITIONS limits the kiosk to its own grade/class/site
+            return GalleryWatcher(partitions=partitions_from_env(os.environ))
+
+    @property
+    def recognizer(self):
+        # Only waits if recognition is requested before the background load has finished
+        self.warm_up()
+        return self.gallery_future.result().recognizer
+
+    def check_gallery(self):
+        # Swap in a gallery retrained by train.py without a restart; queued photos finish
+        # against the recognizer they were submitted with
+        if self.gallery_future.done():
+            if self.gallery_future.exception() is not None:
+                # No usable gallery yet (e.g. before the first train.py run): keep trying
+                self.gallery_future = run_in_background(self.load_recognizer)
+            elif self.gallery_future.result().check() is not None and self.recognition_jobs.cache is not None:
+                self.recognition_jobs.cache.check_gallery()
+        self.after(GALLERY_CHECK_MS, self.check_gallery)
+
+    def report_startup(self):
+        worker_ready = self.recognition_jobs.worker_ready
+        wait([future for future in (self.gallery_future, worker_ready) if future is not None])
+        profiler.mark("face stack ready")
+        if worker_ready is not None and worker_ready.exception() is None:
+            profiler.add_phase("face_recognition import (worker process)", worker_ready.result())
+        profiler.report()
 
     def show_student_selection(self):
-        if self.current_frame:
-            self.current_frame.destroy()
-        self.current_frame = StudentSelectionFrame(self)
-        self.current_frame.pack(fill=tk.BOTH, expand=True)
+        selection_frame = self.get_frame(StudentSelectionFrame)
+        selection_frame.update_progress()
+        self.raise_frame(selection_frame)
 
     def show_main(self, student_id):
+        # The same MainFrame is reused for every student; only its widgets are updated
+        main_frame = self.get_frame(MainFrame)
+        main_frame.show_student(student_id)
+        self.raise_frame(main_frame)
+
+    def get_frame(self, frame_class):
+        # Screens are built once and swapped in and out instead of being destroyed
+        if frame_class not in self.frames:
+            self.frames[frame_class] = frame_class(self)
+        return self.frames[frame_class]
+
+    def raise_frame(self, frame):
+        if self.current_frame is frame:
+            return
         if self.current_frame:
-            self.current_frame.destroy()
-        self.current_frame = MainFrame(self, student_id)
+            self.current_frame.pack_forget()
+        self.current_frame = frame
         self.current_frame.pack(fill=tk.BOTH, expand=True)
 
     def exit_application(self):
+        self.recognition_jobs.shutdown()
+        if self.attendance is not None:
+            self.attendance.close()
+        self.students.close()
         self.destroy()
 
     def recognize_face(self, image_path):
-        # Load the image for face recognition
-        input_image = face_recognition.load_image_file(image_path)
-        face_encodings = face_recognition.face_encodings(input_image)
-        
-        # If no faces are found in the image
-        if len(face_encodings) == 0:
-            return None
-
-        # Compare the first face found with the known faces
-        input_encoding = face_encodings[0]
-        matches = face_recognition.compare_faces(self.known_face_encodings, input_encoding)
-        face_distances = face_recognition.face_distance(self.known_face_encodings, input_encoding)
-        
-        # Find the best match
-        best_match_index = np.argmin(face_distances)
-        
-        if matches[best_match_index]:
-            matched_student_id = self.known_face_labels[best_match_index]
-            return matched_student_id
-        return None
+        # FaceMatch(box, student_id, distance) for every face found in the image
+        with metrics.timer("recognize_face"):
+            if self.recognition_jobs.client is not None:
+                return self.recognition_jobs.client.recognize_file(image_path)
+            return self.recognizer.recognize_file(image_path, self.recognition_jobs.cache)
+
+    def cancel_recognition(self):
+        self.recognition_jobs.cancel_all()
+        self.recognized_ids, self.recognition_errors = [], []
+
+    def on_recognition_progress(self):
+        if isinstance(self.current_frame, StudentSelectionFrame):
+            self.current_frame.update_progress()
+
+    def on_recognition_result(self, image_path, faces, error):
+        if error is not None:
+            self.recognition_errors.append(f"{os.path.basename(image_path)}: {error}")
+        for face in faces:
+            if face.student_id:
+                self.attendance.record(face.student_id, face.distance)
+            if face.student_id and face.student_id not in self.recognized_ids:
+                self.recognized_ids.append(face.student_id)
+        if self.recognition_jobs.pending:
+            return
+
+        # The queue has drained: report everything recognized since it started
+        matched_ids, errors = self.recognized_ids, self.recognition_errors
+        self.recognized_ids, self.recognition_errors = [], []
+        if not matched_ids:
+            message = "No matching student found for the provided face image."
+            if errors:
+                message += "\n\n" + "\n".join(errors)
+            messagebox.showerror("Error", message)
+            return
+        if len(matched_ids) > 1:
+            names = [self.students.get(student_id, {}).get("name", student_id) for student_id in matched_ids]
+            messagebox.showinfo("Recognized Students", f"{len(matched_ids)} students recognized:\n" + "\n".join(names))
+        self.show_main(matched_ids[0])
 
 
 class StudentSelectionFrame(ttk.Frame):
@@ -110,21 +208,22 @@ class StudentSelectionFrame(ttk.Frame):
 
         logo_path = "images/facereg.jpg"
         if os.path.exists(logo_path):
-            logo = Image.open(logo_path)
-            logo = logo.resize((150, 150), Image.LANCZOS)
-            logo_photo = ImageTk.PhotoImage(logo)
+            logo_photo = self.master.thumbnails.photo(logo_path, (150, 150))
             logo_label = ttk.Label(main_frame, image=logo_photo)
             logo_label.image = logo_photo
             logo_label.pack(pady=20, anchor="n")
 
         ttk.Label(main_frame, text="Select a Student or Recognize via Face", font=("Helvetica Neue", 22, "bold")).pack(pady=20)
 
-        self.student_names = {value["name"]: student_id for student_id, value in self.master.students.items()}
-        
-        self.student_listbox = tk.Listbox(main_frame, height=10, font=("Helvetica Neue", 14), selectmode=tk.SINGLE)
-        self.student_listbox.pack(pady=20, fill=tk.X, padx=20)
-        for name in self.student_names.keys():
-            self.student_listbox.insert(tk.END, name)
+        # Only the visible rows live in the Listbox; typing in the search box filters by name
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add("write", lambda *args: self.student_list.set_filter(self.search_var.get()))
+        search_entry = ttk.Entry(main_frame, textvariable=self.search_var, font=("Helvetica Neue", 14))
+        search_entry.pack(pady=(20, 0), fill=tk.X, padx=20)
+
+        entries = self.master.students.names()
+        self.student_list = VirtualStudentList(main_frame, entries, visible_rows=10, on_activate=self.master.show_main, font=("Helvetica Neue", 14))
+        self.student_list.pack(pady=20, fill=tk.X, padx=20)
 
         button_frame = ttk.Frame(main_frame)
         button_frame.pack(pady=20)
@@ -138,87 +237,148 @@ class StudentSelectionFrame(ttk.Frame):
         exit_button = ttk.Button(button_frame, text="Exit", command=self.master.exit_application)
         exit_button.pack(side=tk.RIGHT, padx=10)
 
+        progress_frame = ttk.Frame(main_frame)
+        progress_frame.pack(pady=10, fill=tk.X, padx=20)
+        self.progress_label = ttk.Label(progress_frame, text="", font=("Helvetica Neue", 12))
+        self.progress_label.pack(side=tk.LEFT, padx=10)
+        self.progress_bar = ttk.Progressbar(progress_frame, mode="indeterminate")
+        self.cancel_button = ttk.Button(progress_frame, text="Cancel", command=self.master.cancel_recognition)
+        self.update_progress()
+
     def select_student(self):
-        selected_index = self.student_listbox.curselection()
-        if selected_index:
-            selected_name = self.student_listbox.get(selected_index)
-            student_id = self.student_names[selected_name]
+        student_id = self.student_list.selected_student_id()
+        if student_id is not None:
             self.master.show_main(student_id)
 
     def recognize_face(self):
-        image_path = filedialog.askopenfilename(title="Select an Image for Face Recognition", filetypes=[("Image files", "*.jpg *.jpeg *.png")])
-        if image_path:
-            matched_student_id = self.master.recognize_face(image_path)
-            if matched_student_id:
-                self.master.show_main(matched_student_id)
-            else:
-                messagebox.showerror("Error", "No matching student found for the provided face image.")
+        # Several photos can be queued; the window stays responsive while they are processed
+        image_paths = filedialog.askopenfilenames(title="Select Images for Face Recognition", filetypes=[("Image files", "*.jpg *.jpeg *.png")])
+        try:
+            for image_path in image_paths:
+                self.master.recognition_jobs.submit(image_path)
+        except (OSError, ValueError) as e:
+            # Missing or unreadable gallery; the app keeps checking for a usable one
+            messagebox.showerror("Error", str(e))
+
+    def update_progress(self):
+        jobs = self.master.recognition_jobs
+        if jobs.pending:
+            self.progress_label.configure(text=f"Recognizing photo {jobs.completed + 1} of {jobs.total}...")
+            if not self.progress_bar.winfo_manager():
+                self.progress_bar.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=10)
+                self.cancel_button.pack(side=tk.RIGHT, padx=10)
+                self.progress_bar.start(10)
+        else:
+            self.progress_label.configure(text="")
+            self.progress_bar.stop()
+            self.progress_bar.pack_forget()
+            self.cancel_button.pack_forget()
 
 
 class MainFrame(ttk.Notebook):
-    def __init__(self, master, student_id):
+    def __init__(self, master):
         style = ttk.Style()
         style.configure('TNotebook.Tab', font=("Helvetica Neue", 12, "bold"))
         super().__init__(master, style='TNotebook', padding=10)
         
-        self.student_id = student_id
-        self.student_data = master.students[student_id]
+        self.student_id = None
+        self.student_data = None
         self.create_tabs()
 
     def create_tabs(self):
-        self.add(StudentInfoFrame(self, self.student_data), text="📊 Info")
-        self.add(StudyTableFrame(self, self.student_data), text="📅 Schedule")
+        # Tabs start empty and are filled the first time they are shown for each student
+        self.stale_tabs = set()
+        self.add(StudentInfoFrame(self), text="📊 Info")
+        self.add(StudyTableFrame(self), text="📅 Schedule")
+        self.bind("<<NotebookTabChanged>>", self.refresh_selected_tab)
+
+    def show_student(self, student_id):
+        self.student_id = student_id
+        self.student_data = self.master.students[student_id]
+        self.stale_tabs = {str(tab_id) for tab_id in self.tabs()}
+        self.select(0)
+        self.refresh_selected_tab()
+
+    def refresh_selected_tab(self, event=None):
+        tab_id = str(self.select())
+        if tab_id in self.stale_tabs:
+            self.stale_tabs.discard(tab_id)
+            self.nametowidget(tab_id).show_student(self.student_data)
 
 
 class StudentInfoFrame(ttk.Frame):
-    def __init__(self, master, student_data):
+    def __init__(self, master):
         super().__init__(master, padding=20)
-        self.create_widgets(student_data)
+        self.field_labels = []
+        self.image_label = None
 
-    def create_widgets(self, student_data):
+    def create_widgets(self):
         self.columnconfigure(0, weight=1)
         self.columnconfigure(1, weight=1)
 
         ttk.Label(self, text="Student Information", font=("Helvetica Neue", 26, "bold")).grid(row=0, column=0, columnspan=2, pady=20)
 
-        row = 1
-        for key, value in student_data.items():
-            if key not in ["image", "courses"]:
-                ttk.Label(self, text=f"{key.capitalize()}:", font=("Helvetica Neue", 16, "bold")).grid(row=row, column=0, sticky="e", pady=10)
-                ttk.Label(self, text=str(value), font=("Helvetica Neue", 16)).grid(row=row, column=1, sticky="w", pady=10)
-                row += 1
-
-        img_frame = ttk.Frame(self)
-        img_frame.grid(row=row, column=0, columnspan=2, pady=20, sticky="nsew")
-        img_frame.columnconfigure(0, weight=1)
-        img_frame.rowconfigure(0, weight=1)
+        self.img_frame = ttk.Frame(self)
+        self.img_frame.columnconfigure(0, weight=1)
+        self.img_frame.rowconfigure(0, weight=1)
+        self.image_label = ttk.Label(self.img_frame, font=("Helvetica Neue", 16))
+        self.image_label.grid(pady=20)
+
+    def show_student(self, student_data):
+        if self.image_label is None:
+            self.create_widgets()
+
+        # Reuse the label pairs from the previous student and hide any that are left over
+        fields = [(key, value) for key, value in student_data.items() if key not in ["image", "courses"]]
+        while len(self.field_labels) < len(fields):
+            self.field_labels.append((ttk.Label(self, font=("Helvetica Neue", 16, "bold")), ttk.Label(self, font=("Helvetica Neue", 16))))
+        for row, ((key_label, value_label), (key, value)) in enumerate(zip(self.field_labels, fields), 1):
+            key_label.configure(text=f"{key.capitalize()}:")
+            value_label.configure(text=str(value))
+            key_label.grid(row=row, column=0, sticky="e", pady=10)
+            value_label.grid(row=row, column=1, sticky="w", pady=10)
+        for key_label, value_label in self.field_labels[len(fields):]:
+            key_label.grid_remove()
+            value_label.grid_remove()
+        self.img_frame.grid(row=len(fields) + 1, column=0, columnspan=2, pady=20, sticky="nsew")
 
         try:
-            img = Image.open(student_data["image"])
-            img = img.resize((300, 300), Image.LANCZOS)
-            photo = ImageTk.PhotoImage(img)
-            label = ttk.Label(img_frame, image=photo)
-            label.image = photo
-            label.grid(pady=20)
+            photo = self.master.master.thumbnails.photo(student_data["image"], (300, 300))
+            self.image_label.configure(image=photo, text="")
+            self.image_label.image = photo
         except FileNotFoundError:
-            ttk.Label(img_frame, text="No Image Available", font=("Helvetica Neue", 16)).grid(pady=20)
+            self.image_label.configure(image="", text="No Image Available")
+            self.image_label.image = None
 
 
 class StudyTableFrame(ttk.Frame):
-    def __init__(self, master, student_data):
+    def __init__(self, master):
         super().__init__(master, padding=20)
-        self.create_widgets(student_data)
+        self.courses_frame = None
+        self.course_labels = []
 
-    def create_widgets(self, student_data):
+    def create_widgets(self):
         ttk.Label(self, text="Courses", font=("Helvetica Neue", 26, "bold")).pack(pady=20)
 
-        courses_frame = ttk.Frame(self)
-        courses_frame.pack(fill=tk.BOTH, expand=True)
+        self.courses_frame = ttk.Frame(self)
+        self.courses_frame.pack(fill=tk.BOTH, expand=True)
+
+    def show_student(self, student_data):
+        if self.courses_frame is None:
+            self.create_widgets()
 
-        for course in student_data["courses"]:
-            ttk.Label(courses_frame, text=course, font=("Helvetica Neue", 18)).pack(pady=10)
+        courses = student_data.get("courses", [])
+        while len(self.course_labels) < len(courses):
+            self.course_labels.append(ttk.Label(self.courses_frame, font=("Helvetica Neue", 18)))
+        for label, course in zip(self.course_labels, courses):
+            label.configure(text=course)
+            label.pack(pady=10)
+        for label in self.course_labels[len(courses):]:
+            label.pack_forget()
 
 
 if __name__ == "__main__":
+    # e.g. STUDENT_METRICS=log,prometheus=/var/lib/node_exporter/students.prom
+    metrics.configure(os.environ.get(METRICS_ENV))
     app = StudentApp()
     app.mainloop()
@@ -0,0 +1,62 @@
+import sqlite3
+import time
+import pytest
+from attendance import AttendanceLog
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    return str(tmp_path / "attendance.db")
+
+
+def test_dedup_within_window(db_file):
+    log = AttendanceLog(db_file, dedup_seconds=300, source="kiosk")
+    now = time.time()
+    assert log.record("alice", 0.4, seen_at=now)
+    assert not log.record("alice", 0.3, seen_at=now + 10)
+    assert log.record("bob", 0.5, seen_at=now + 10)
+    assert log.record("alice", 0.35, seen_at=now + 301)
+    log.close()
+    assert (log.recorded, log.duplicates, log.written) == (3, 1, 3)
+
+
+def test_queries_see_recorded_events(db_file):
+    log = AttendanceLog(db_file, source="kiosk")
+    now = time.time()
+    log.record("alice", 0.4, seen_at=now - 5)
+    log.record("bob", 0.5, seen_at=now - 3, source="gate")
+    present = log.present(now - 60, now)
+    assert [row[0] for row in present] == ["alice", "bob"]
+    assert log.history("bob") == [(pytest.approx(now - 3), "gate", pytest.approx(0.5))]
+    log.close()
+
+
+def test_restart_seeds_dedup_from_log(db_file):
+    now = time.time()
+    log = AttendanceLog(db_file, dedup_seconds=300)
+    log.record("alice", seen_at=now - 60)
+    log.record("bob", seen_at=now - 600)
+    log.close()
+
+    restarted = AttendanceLog(db_file, dedup_seconds=300)
+    # alice was seen inside the window before the restart; bob's sighting is too old to count
+    assert not restarted.record("alice", seen_at=now)
+    assert restarted.record("bob", seen_at=now)
+    restarted.close()
+
+
+def test_failed_batch_does_not_suppress_next_sighting(db_file):
+    log = AttendanceLog(db_file, write_retries=1, retry_delay=0.01)
+    conn = sqlite3.connect(db_file)
+    with conn:
+        conn.execute("ALTER TABLE events RENAME TO moved")
+    assert log.record("alice")
+    log.flush()
+    assert log.lost == 1
+    with conn:
+        conn.execute("ALTER TABLE moved RENAME TO events")
+    conn.close()
+    # The lost event is not de-duplicated against, so the re-sighting is recorded
+    assert log.record("alice")
+    log.close()
+    assert log.written == 1
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from face_store import FaceGallery, gallery_version, load_gallery, save_gallery
+
+
+def make_gallery(rows=10, dim=128, seed=0):
+    rng = np.random.default_rng(seed)
+    encodings = rng.normal(0, 0.1, (rows, dim)).astype(np.float32)
+    labels = [f"student{i % 3}" for i in range(rows)]
+    return FaceGallery.from_encodings(encodings, labels)
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_round_trip(tmp_path, mmap):
+    path = str(tmp_path / "faces.gallery")
+    gallery = make_gallery()
+    gallery.extras["label_thresholds"] = np.array([0.5, 0.55, 0.6], dtype=np.float32)
+    save_gallery(path, gallery)
+
+    loaded = load_gallery(path, mmap)
+    assert loaded.names == gallery.names
+    assert loaded.labels == gallery.labels
+    np.testing.assert_array_equal(loaded.encodings, gallery.encodings)
+    np.testing.assert_allclose(loaded.sq_norms, gallery.sq_norms)
+    np.testing.assert_array_equal(loaded.extras["label_thresholds"], gallery.extras["label_thresholds"])
+    np.testing.assert_allclose(loaded.distances(gallery.encodings[3]), gallery.distances(gallery.encodings[3]),
+                               atol=1e-6)
+
+
+def test_float16_encodings_stay_float16(tmp_path):
+    path = str(tmp_path / "faces.gallery")
+    gallery = make_gallery()
+    gallery = FaceGallery(gallery.encodings.astype(np.float16), gallery.label_ids, gallery.names, gallery.sq_norms)
+    save_gallery(path, gallery)
+    assert load_gallery(path).encodings.dtype == np.float16
+
+
+def test_version_bumps_on_every_save(tmp_path):
+    path = str(tmp_path / "faces.gallery")
+    assert gallery_version(path) == 0
+    save_gallery(path, make_gallery())
+    save_gallery(path, make_gallery(seed=1))
+    assert gallery_version(path) == 2
+    assert load_gallery(path).version == 2
+    save_gallery(path, make_gallery(), version=10)
+    assert load_gallery(path).version == 10
+
+
+def test_truncated_file_is_rejected(tmp_path):
+    path = str(tmp_path / "faces.gallery")
+    save_gallery(path, make_gallery())
+    with open(path, "r+b") as f:
+        f.truncate(f.seek(0, 2) - 100)
+    with pytest.raises(ValueError, match="truncated"):
+        load_gallery(path)
+
+
+def test_not_a_gallery(tmp_path):
+    path = tmp_path / "faces.gallery"
+    path.write_bytes(b"not a gallery at all")
+    with pytest.raises(ValueError):
+        load_gallery(str(path))
+    assert gallery_version(str(path)) == 0
+
+
+def test_empty_gallery_is_refused(tmp_path):
+    gallery = FaceGallery(np.zeros((0, 128), dtype=np.float32), np.zeros(0, dtype=np.int32), [])
+    with pytest.raises(ValueError):
+        save_gallery(str(tmp_path / "faces.gallery"), gallery)
@@ -0,0 +1,93 @@
+import numpy as np
+from bench_matcher import make_queries, make_synthetic_encodings
+from face_store import FaceGallery, load_gallery, save_gallery
+from matcher import BruteForceMatcher, IVFMatcher, PQMatcher, build_ivf, build_pq, compare_pq, load_matcher
+
+
+def make_gallery(identities=300, per_identity=5):
+    encodings, labels, _ = make_synthetic_encodings(identities, per_identity)
+    return FaceGallery.from_encodings(encodings, labels)
+
+
+def recall_at_1(matcher, exact, queries):
+    found = [matcher.search(query)[0] for query in queries]
+    truth = [exact.search(query)[0][0] for query in queries]
+    return np.mean([len(ids) and ids[0] == best for ids, best in zip(found, truth)])
+
+
+def test_exact_search_many_matches_search():
+    gallery = make_gallery()
+    queries = make_queries(gallery, 20)
+    exact = BruteForceMatcher(gallery, block_size=256)
+    ids, distances = exact.search_many(queries, k=3)
+    for query, row_ids, row_distances in zip(queries, ids, distances):
+        expected_ids, expected_distances = exact.search(query, k=3)
+        np.testing.assert_array_equal(row_ids, expected_ids)
+        np.testing.assert_allclose(row_distances, expected_distances, rtol=1e-5)
+
+
+def test_exact_search_many_pads_past_gallery_size():
+    gallery = make_gallery(identities=2, per_identity=1)
+    ids, distances = BruteForceMatcher(gallery).search_many(make_queries(gallery, 3), k=4)
+    assert ids.shape == (3, 4)
+    assert (ids[:, 2:] == -1).all() and np.isinf(distances[:, 2:]).all()
+
+
+def test_ivf_keeps_labels_with_their_rows():
+    gallery = make_gallery()
+    indexed = build_ivf(gallery)
+    assert sorted(indexed.labels) == sorted(gallery.labels)
+    exact = BruteForceMatcher(indexed)
+    for row in range(0, len(indexed), 97):
+        ids, _ = exact.search(indexed.encodings[row])
+        assert indexed.label(ids[0]) == indexed.label(row)
+
+
+def test_ivf_recall_against_exact():
+    gallery = make_gallery()
+    indexed = build_ivf(gallery)
+    queries = make_queries(indexed, 200)
+    exact = BruteForceMatcher(indexed)
+    assert recall_at_1(IVFMatcher(indexed, nprobe=8), exact, queries) >= 0.95
+    # Probing every list is exhaustive
+    n_lists = len(indexed.extras["ivf_centroids"])
+    assert recall_at_1(IVFMatcher(indexed, nprobe=n_lists), exact, queries) == 1.0
+
+
+def test_load_matcher_picks_saved_index(tmp_path):
+    path = str(tmp_path / "faces.gallery")
+    save_gallery(path, build_ivf(make_gallery()))
+    loaded = load_gallery(path)
+    assert load_matcher(loaded).name == "ivf"
+    assert load_matcher(loaded, "exact").name == "exact"
+    save_gallery(path, make_gallery())
+    assert load_matcher(load_gallery(path)).name == "exact"
+
+
+def test_pq_recall_against_exact():
+    gallery = make_gallery()
+    compressed = build_pq(gallery, iterations=5)
+    queries = make_queries(gallery, 200)
+    exact = BruteForceMatcher(gallery)
+    assert recall_at_1(PQMatcher(compressed, rerank=16), exact, queries) >= 0.95
+
+
+def test_pq_reports_exact_distances():
+    # The re-rank uses the stored encodings, so returned distances are exact, not approximate
+    gallery = make_gallery()
+    compressed = build_pq(build_ivf(gallery), iterations=5)
+    assert not any(name.startswith("ivf_") for name in compressed.extras)
+    exact = BruteForceMatcher(compressed)
+    for query in make_queries(compressed, 20):
+        ids, distances = PQMatcher(compressed).search(query, k=3)
+        np.testing.assert_allclose(distances, exact.gallery.distances(query)[ids], atol=1e-5)
+
+
+def test_pq_float16_round_trip(tmp_path):
+    gallery = make_gallery()
+    path = str(tmp_path / "faces.gallery")
+    save_gallery(path, build_pq(gallery, float16=True, iterations=5))
+    loaded = load_gallery(path)
+    assert loaded.encodings.dtype == np.float16
+    assert load_matcher(loaded).name == "pq"
+    assert compare_pq(gallery, loaded, sample_size=200)["agreement"] >= 0.95
@@ -0,0 +1,81 @@
+import json
+import os
+import numpy as np
+import pytest
+from face_store import FaceGallery
+from partitions import (UNASSIGNED, index_file, load_partitions, merge_galleries, partition_file, partition_slug,
+                        partitions_from_env, save_partitions, split_by_partition)
+
+
+def encoding(value):
+    return np.full(128, value, dtype=np.float32)
+
+
+def test_slug_keeps_safe_values():
+    assert partition_slug("12th") == "12th"
+    assert partition_slug("north-campus_2") == "north-campus_2"
+
+
+def test_slug_disambiguates_altered_values():
+    thai = partition_slug("วิทยาเขต 1")
+    assert thai.startswith("1-") and len(thai) == len("1-") + 8
+    # Both become "a_b" once cleaned; the hash suffix keeps them apart
+    assert partition_slug("a b") != partition_slug("a/b")
+    assert partition_slug("a b").startswith("a_b-")
+    assert partition_slug("!!!").startswith("p-")
+
+
+def test_partition_and_index_file_names():
+    assert partition_file(os.path.join("d", "faces.gallery"), "12th") == os.path.join("d", "faces.12th.gallery")
+    assert index_file("faces.gallery") == "faces.partitions.json"
+
+
+def test_partitions_from_env():
+    assert partitions_from_env({}) is None
+    assert partitions_from_env({"STUDENT_GALLERY_PARTITIONS": " 11th, 12th ,"}) == ["11th", "12th"]
+
+
+def test_split_by_partition():
+    groups = split_by_partition([encoding(1), encoding(2), encoding(3)], ["a", "b", "c"], {"a": "12th", "b": ""})
+    assert groups["12th"][1] == ["a"]
+    assert groups[UNASSIGNED][1] == ["b", "c"]
+
+
+def test_merge_keeps_one_label_per_student_and_max_threshold():
+    first = FaceGallery.from_encodings([encoding(1), encoding(2)], ["alice", "bob"])
+    first.extras["label_thresholds"] = np.array([0.5, 0.6], dtype=np.float32)
+    second = FaceGallery.from_encodings([encoding(3), encoding(4)], ["bob", "carol"])
+    second.extras["label_thresholds"] = np.array([0.55, 0.4], dtype=np.float32)
+
+    merged = merge_galleries([first, second])
+    assert merged.names == ["alice", "bob", "carol"]
+    assert merged.labels == ["alice", "bob", "bob", "carol"]
+    np.testing.assert_array_equal(merged.encodings[:, 0], [1, 2, 3, 4])
+    np.testing.assert_allclose(merged.extras["label_thresholds"], [0.5, 0.6, 0.4])
+
+
+def test_merge_drops_thresholds_unless_every_partition_has_them():
+    first = FaceGallery.from_encodings([encoding(1)], ["alice"])
+    first.extras["label_thresholds"] = np.array([0.5], dtype=np.float32)
+    second = FaceGallery.from_encodings([encoding(2)], ["bob"])
+    assert "label_thresholds" not in merge_galleries([first, second]).extras
+
+
+def test_save_and_load_partitions(tmp_path):
+    gallery_file = str(tmp_path / "faces.gallery")
+    galleries = {"11th": FaceGallery.from_encodings([encoding(1)], ["alice"]),
+                 "12th": FaceGallery.from_encodings([encoding(2), encoding(3)], ["bob", "carol"])}
+    save_partitions(gallery_file, "grade", galleries)
+
+    loaded = load_partitions(gallery_file, ["12th"])
+    assert loaded.labels == ["bob", "carol"] and loaded.version == 1
+    assert sorted(load_partitions(gallery_file, ["11th", "12th"]).labels) == ["alice", "bob", "carol"]
+    with pytest.raises(ValueError, match="Unknown grade"):
+        load_partitions(gallery_file, ["10th"])
+
+    # A partition that disappears is removed from disk; the index version goes up
+    save_partitions(gallery_file, "grade", {"12th": galleries["12th"]})
+    with open(index_file(gallery_file), encoding="utf-8") as f:
+        index = json.load(f)
+    assert index["version"] == 2 and list(index["partitions"]) == ["12th"]
+    assert not os.path.exists(partition_file(gallery_file, "11th"))
@@ -0,0 +1,77 @@
+import os
+import numpy as np
+from detection import DEFAULT_DETECTION
+from result_cache import EncodingCache
+
+
+def entry(value):
+    return [(10, 60, 60, 10)], [np.full(128, value, dtype=np.float64)]
+
+
+def make_cache(tmp_path, max_bytes=1 << 20):
+    gallery_file = tmp_path / "faces.gallery"
+    if not gallery_file.exists():
+        gallery_file.write_bytes(b"v1")
+    return EncodingCache(str(tmp_path / "cache.db"), str(gallery_file), max_bytes=max_bytes)
+
+
+def test_put_get_round_trip(tmp_path):
+    cache = make_cache(tmp_path)
+    assert cache.get("abc", DEFAULT_DETECTION) is None
+    cache.put("abc", DEFAULT_DETECTION, *entry(0.5))
+    boxes, encodings = cache.get("abc", DEFAULT_DETECTION)
+    assert boxes == [(10, 60, 60, 10)]
+    np.testing.assert_array_equal(encodings[0], entry(0.5)[1][0])
+    # Other detection settings are a different entry
+    assert cache.get("abc", DEFAULT_DETECTION._replace(max_side=0)) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+    cache.close()
+
+
+def test_no_faces_is_cached_too(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put("empty", DEFAULT_DETECTION, [], [])
+    assert cache.get("empty", DEFAULT_DETECTION) == ([], [])
+    cache.close()
+
+
+def test_lru_eviction(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put("probe", DEFAULT_DETECTION, *entry(0))
+    entry_size = cache.total_bytes
+    cache.close()
+    os.remove(tmp_path / "cache.db")
+
+    # Room for four and a half entries; the fifth evicts down to 90% (just over four), which
+    # drops only the least recently used one
+    max_bytes = entry_size * 9 // 2
+    cache = make_cache(tmp_path, max_bytes=max_bytes)
+    for i, digest in enumerate(["a", "b", "c", "d"]):
+        cache.put(digest, DEFAULT_DETECTION, *entry(i))
+    cache.get("a", DEFAULT_DETECTION)  # a is now more recent than b
+    cache.put("e", DEFAULT_DETECTION, *entry(4))
+    assert cache.get("b", DEFAULT_DETECTION) is None
+    for digest in ["a", "c", "d", "e"]:
+        assert cache.get(digest, DEFAULT_DETECTION) is not None
+    assert cache.total_bytes <= max_bytes
+    cache.close()
+
+
+def test_gallery_change_clears_cache(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put("abc", DEFAULT_DETECTION, *entry(0.5))
+    assert not cache.check_gallery()
+    gallery_file = tmp_path / "faces.gallery"
+    gallery_file.write_bytes(b"version 2")
+    assert cache.check_gallery()
+    assert len(cache) == 0 and cache.total_bytes == 0
+    cache.close()
+
+    # A cache opened after a retrain starts empty as well
+    cache = make_cache(tmp_path)
+    cache.put("abc", DEFAULT_DETECTION, *entry(0.5))
+    cache.close()
+    gallery_file.write_bytes(b"version three")
+    cache = make_cache(tmp_path)
+    assert len(cache) == 0
+    cache.close()
@@ -0,0 +1,56 @@
+import json
+import os
+import pytest
+from student_db import StudentDatabase, iter_json_students, open_database
+
+LIST_SHAPE = {"students": [{"id": "s1", "name": "Alice", "grade": "12th"},
+                           {"id": 2, "name": "Bob", "grade": "11th"}]}
+MAPPING_SHAPE = {"s1": {"name": "Alice", "grade": "12th"}, "2": {"name": "Bob", "grade": "11th"}}
+
+
+def write_json(path, data):
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("data", [LIST_SHAPE, MAPPING_SHAPE])
+def test_import_both_shapes(tmp_path, data):
+    db = StudentDatabase(str(tmp_path / "students.db"))
+    assert db.import_json(write_json(tmp_path / "user.json", data)) == (2, 0)
+    assert db.names() == [("s1", "Alice"), ("2", "Bob")]
+    assert db["s1"] == {"name": "Alice", "grade": "12th"}
+    assert db.find_by_name("Bob") == ["2"]
+    assert db.field_values("grade") == {"s1": "12th", "2": "11th"}
+    db.close()
+
+
+def test_unsupported_json():
+    with pytest.raises(ValueError):
+        list(iter_json_students(["not", "a", "dict"]))
+
+
+def test_reimport_updates_and_removes(tmp_path):
+    db_file = str(tmp_path / "students.db")
+    json_file = write_json(tmp_path / "user.json", MAPPING_SHAPE)
+    db = open_database(db_file, json_file)
+    assert len(db) == 2
+    db.close()
+
+    write_json(tmp_path / "user.json", {"s1": {"name": "Alice B"}, "s3": {"name": "Carol"}})
+    os.utime(json_file, ns=(0, os.stat(json_file).st_mtime_ns + 1))
+    db = open_database(db_file, json_file)
+    assert sorted(db.names()) == [("s1", "Alice B"), ("s3", "Carol")]
+    assert "2" not in db
+    db.close()
+
+
+def test_unchanged_json_is_not_reimported(tmp_path):
+    db_file = str(tmp_path / "students.db")
+    json_file = write_json(tmp_path / "user.json", MAPPING_SHAPE)
+    open_database(db_file, json_file).close()
+    db = StudentDatabase(db_file)
+    db.put("extra", {"name": "Added in the app"})
+    db.close()
+    db = open_database(db_file, json_file)
+    assert "extra" in db
+    db.close()
@@ -0,0 +1,64 @@
+import hashlib
+import os
+from collections import OrderedDict
+from PIL import Image, ImageTk
+
+THUMBNAIL_DIR = ".thumbnail_cache"
+
+
+class ThumbnailCache:
+    # Two levels: PhotoImage objects in an in-memory LRU, and pre-resized PNGs on disk, one folder
+    # per source path with a file per source mtime and target size. Navigating back to a student
+    # decodes nothing; a fresh start only decodes the small cached file instead of the full photo.
+    def __init__(self, cache_dir=THUMBNAIL_DIR, max_items=128):
+        self.cache_dir = cache_dir
+        self.max_items = max_items
+        self.photos = OrderedDict()
+
+    def photo(self, image_path, size):
+        # Raises FileNotFoundError like Image.open when the source image is missing
+        stat = os.stat(image_path)
+        key = (os.path.abspath(image_path), stat.st_mtime_ns, tuple(size))
+        photo = self.photos.get(key)
+        if photo is not None:
+            self.photos.move_to_end(key)
+            return photo
+
+        photo = ImageTk.PhotoImage(self.thumbnail(key))
+        self.photos[key] = photo
+        if len(self.photos) > self.max_items:
+            self.photos.popitem(last=False)
+        return photo
+
+    def thumbnail(self, key):
+        source_path, mtime_ns, size = key
+        source_dir = os.path.join(self.cache_dir, hashlib.sha1(source_path.encode("utf-8")).hexdigest())
+        cached_path = os.path.join(source_dir, f"{mtime_ns}_{size[0]}x{size[1]}.png")
+        if os.path.exists(cached_path):
+            try:
+                with Image.open(cached_path) as cached:
+                    cached.load()
+                    return cached
+            except OSError:
+                pass  # Corrupt cache entry: rebuild it below
+
+        with Image.open(source_path) as img:
+            thumbnail = img.resize(size, Image.LANCZOS)
+        try:
+            os.makedirs(source_dir, exist_ok=True)
+            tmp_path = cached_path + ".tmp"
+            thumbnail.save(tmp_path, "PNG")
+            os.replace(tmp_path, cached_path)
+            self.prune(source_dir, mtime_ns)
+        except OSError as e:
+            print(f"Could not write thumbnail cache {cached_path}: {e}")
+        return thumbnail
+
+    def prune(self, source_dir, mtime_ns):
+        # Thumbnails of earlier versions of the photo can never be hit again
+        for name in os.listdir(source_dir):
+            if not name.startswith(f"{mtime_ns}_"):
+                try:
+                    os.remove(os.path.join(source_dir, name))
+                except OSError:
+                    pass
@@ -1,46 +1,535 @@
 import face_recognition
+import argparse
+import hashlib
+import io
 import os
 import pickle
+import queue
+import tarfile
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from detection import DEFAULT_DETECTION, DetectionSettings, add_detection_arguments, detect_and_encode, settings_from_args
+from face_store import FaceGallery, save_gallery
+from student_db import DB_FILE, StudentDatabase
+from instrumentation import metrics, run_captured
+from matcher import IVF_MIN_SIZE, build_ivf, build_pq, compare_pq, gallery_memory
+from partitions import index_file, save_partitions, split_by_partition
+from prototypes import build_prototype_gallery, compare_accuracy
+from quality import QualityGate, add_quality_arguments, assess_image, quality_from_args
 
-def train_model(images_dir, encodings_file):
-    print(f"Loading images from directory: {images_dir}")
+# Define allowed image extensions
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif'}
 
-    known_encodings = []
-    known_names = []
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+# Archive members larger than this are skipped rather than read into memory
+MAX_IMAGE_BYTES = 32 << 20
+# Photos read ahead of the encoders when enrolling from an archive or stream
+PREFETCH = 64
+
+MANIFEST_VERSION = 1
 
-    # Define allowed image extensions
-    image_extensions = {'.jpg', '.jpeg', '.png', '.gif'}
 
-    for person_name in os.listdir(images_dir):
+def list_training_images(images_dir):
+    # Yield (person_name, image_path) for every image in the per-person folders
+    for person_name in sorted(os.listdir(images_dir)):
         person_folder = os.path.join(images_dir, person_name)
-        if os.path.isdir(person_folder):
-            for image_file in os.listdir(person_folder):
-                # Check if the file is an image
-                if not any(image_file.lower().endswith(ext) for ext in image_extensions):
+        if not os.path.isdir(person_folder):
+            continue
+        for image_file in sorted(os.listdir(person_folder)):
+            # Check if the file is an image
+            if os.path.splitext(image_file)[1].lower() not in IMAGE_EXTENSIONS:
+                continue
+            yield person_name, os.path.join(person_folder, image_file)
+
+
+def is_archive(path):
+    return isinstance(path, str) and path.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def member_label(member_name):
+    # Archives use the images folder layout, <student_id>/<photo>.jpg, optionally under a top
+    # folder; anything else (stray files, __MACOSX, dotfiles) is not a training image
+    parts = member_name.replace('\\', '/').split('/')
+    if len(parts) < 2 or os.path.splitext(parts[-1])[1].lower() not in IMAGE_EXTENSIONS:
+        return None
+    if any(part.startswith('.') or part == '__MACOSX' for part in parts):
+        return None
+    return parts[-2]
+
+
+def iter_archive(archive_path):
+    # Yield (person_name, key, image bytes) for every image in a zip or tar bundle, one member at a
+    # time. Tar files (compressed or not) are read as a single forward stream.
+    if archive_path.lower().endswith('.zip'):
+        with zipfile.ZipFile(archive_path) as bundle:
+            for info in bundle.infolist():
+                label = None if info.is_dir() else member_label(info.filename)
+                if label is None:
                     continue
+                if info.file_size > MAX_IMAGE_BYTES:
+                    print(f"Skipping {archive_path}!{info.filename}: {info.file_size} bytes")
+                    continue
+                yield label, f"{archive_path}!{info.filename}", bundle.read(info)
+        return
+    with tarfile.open(archive_path, 'r|*') as bundle:
+        for member in bundle:
+            label = member_label(member.name) if member.isfile() else None
+            if label is None:
+                continue
+            if member.size > MAX_IMAGE_BYTES:
+                print(f"Skipping {archive_path}!{member.name}: {member.size} bytes")
+                continue
+            yield label, f"{archive_path}!{member.name}", bundle.extractfile(member).read()
+
+
+def iter_samples(source):
+    # (person_name, key, image bytes) from an archive path, a list of archive paths, or any
+    # iterable of (person_name, image bytes); the last have no stable name, so key is None
+    if isinstance(source, str):
+        yield from iter_archive(source)
+        return
+    for item in source:
+        if isinstance(item, str):
+            yield from iter_archive(item)
+        else:
+            label, data = item
+            yield label, None, data
+
+
+def prefetched(iterable, depth=PREFETCH):
+    # Iterate on a background thread at most `depth` items ahead, so reading and decompressing
+    # overlaps with encoding while memory stays bounded. Errors are re-raised in the consumer.
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # Gives up once the consumer has stopped, so a consumer that died mid-stream never leaves
+        # this thread blocked on a full queue with the archive open
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def fill():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put((done, None))
+        except BaseException as e:
+            put((done, e))
+
+    threading.Thread(target=fill, name="prefetch", daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item[0] is done:
+                if item[1] is not None:
+                    raise item[1]
+                return
+            yield item
+    finally:
+        # Consumer stopped early: let the reader close the archive and exit
+        stop.set()
+
+
+def file_digest(path, chunk_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def encode_image(image_path, detection=DEFAULT_DETECTION, data=None):
+    # Runs inside a worker process, so errors are returned instead of raised.
+    # With data, the image is decoded from those bytes and image_path only names it.
+    try:
+        with metrics.timer("decode"):
+            image = face_recognition.load_image_file(image_path if data is None else io.BytesIO(data))
+        _, encoding = detect_and_encode(image, detection)
+        return image_path, (encoding[0] if encoding else None), None
+    except Exception as e:
+        return image_path, None, str(e)
+
+
+def encode_blob(key, data, detection=DEFAULT_DETECTION):
+    return encode_image(key, detection, data)
+
+
+def load_manifest(manifest_file, detection=DEFAULT_DETECTION):
+    # The manifest maps image path -> {size, mtime, sha1, encoding}
+    if not manifest_file or not os.path.exists(manifest_file):
+        return {}
+    try:
+        with open(manifest_file, 'rb') as f:
+            manifest = pickle.load(f)
+    except Exception as e:
+        print(f"Ignoring unreadable manifest {manifest_file}: {e}")
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    # Encodings made with other detector settings are not comparable, so start over.
+    # Manifests without settings were made by the full-resolution HOG pipeline.
+    if DetectionSettings(*manifest.get('detection', ('hog', 0, 1, 1))) != detection:
+        print("Detection settings changed since the last run; re-encoding every image")
+        return {}
+    return manifest['entries']
+
+
+def save_manifest(manifest_file, entries, detection=DEFAULT_DETECTION):
+    # Write to a temp file first so an interrupted run never leaves a broken manifest
+    tmp_file = manifest_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        pickle.dump({'version': MANIFEST_VERSION, 'detection': tuple(detection), 'entries': entries}, f)
+    os.replace(tmp_file, manifest_file)
+
+
+def default_manifest_path(encodings_file):
+    return os.path.splitext(encodings_file)[0] + '_manifest.pkl'
+
+
+def plan_encoding(images, old_entries):
+    # Split images into reusable manifest entries and paths that must be (re-)encoded
+    by_digest = {entry['sha1']: entry for entry in old_entries.values()}
+    entries = {}
+    to_encode = []
+
+    for person_name, image_path in images:
+        stat = os.stat(image_path)
+        entry = old_entries.get(image_path)
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            entries[image_path] = entry
+            continue
+
+        # Size or mtime changed (or a new path): only the content hash can tell
+        digest = file_digest(image_path)
+        cached = by_digest.get(digest)
+        new_entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha1': digest}
+        if cached is not None:
+            new_entry['encoding'] = cached['encoding']
+            if 'dhash' in cached:
+                new_entry['dhash'] = cached['dhash']
+            entries[image_path] = new_entry
+        else:
+            entries[image_path] = new_entry
+            to_encode.append(image_path)
 
-                image_path = os.path.join(person_folder, image_file)
+    return entries, to_encode
 
-                try:
-                    # Load image and get face encodings
-                    image = face_recognition.load_image_file(image_path)
-                    encoding = face_recognition.face_encodings(image)
 
-                    if encoding:
-                        known_encodings.append(encoding[0])
-                        known_names.append(person_name)
-                except Exception as e:
-                    print(f"Error processing image {image_path}: {e}")
+def unpack_captured(result, captured):
+    if captured:
+        result, events = result
+        metrics.replay(events)
+    return result
+
+
+def encode_images(image_paths, workers=None, detection=DEFAULT_DETECTION):
+    # Fan the images out across all cores; workers=1 keeps everything in-process
+    encode = partial(encode_image, detection=detection)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(image_paths) <= 1:
+        for image_path in image_paths:
+            yield encode(image_path)
+        return
+
+    chunksize = max(1, len(image_paths) // (workers * 4))
+    captured = metrics.enabled
+    if captured:
+        # Stage timings made in the workers come back with each result
+        encode = partial(run_captured, encode)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(encode, image_paths, chunksize=chunksize):
+            yield unpack_captured(result, captured)
+
+
+def encode_blobs(items, workers=None, detection=DEFAULT_DETECTION):
+    # encode_images for (key, image bytes) pairs, e.g. read from an archive. executor.map would
+    # read the whole source up front, so at most two photos per worker are submitted at a time.
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        for key, data in items:
+            yield encode_blob(key, data, detection)
+        return
+
+    captured = metrics.enabled
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for key, data in items:
+            if captured:
+                # Stage timings made in the workers come back with each result
+                pending.append(executor.submit(run_captured, encode_blob, key, data, detection))
+            else:
+                pending.append(executor.submit(encode_blob, key, data, detection))
+            while len(pending) >= workers * 2 or (pending and pending[0].done()):
+                yield unpack_captured(pending.popleft().result(), captured)
+        while pending:
+            yield unpack_captured(pending.popleft().result(), captured)
+
+
+def screen_images(images, entries, to_encode, gate, workers=None):
+    # Drop new photos that fail the quality gate before any of them reaches dlib. The checks are
+    # mostly image decoding, which releases the GIL, so they run on threads.
+    labels = {image_path: person_name for person_name, image_path in images}
+    pending = set(to_encode)
+    for person_name, image_path in images:
+        if image_path not in pending:
+            gate.add_known(person_name, image_path, entries[image_path].get('dhash'))
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        assessments = executor.map(partial(assess_image, settings=gate.settings), to_encode)
+        admitted = []
+        for image_path, assessment in zip(to_encode, assessments):
+            image_hash = gate.admit(labels[image_path], image_path, assessment)
+            if image_hash is None:
+                # Not cached in the manifest, so the next run checks it again
+                del entries[image_path]
+            else:
+                entries[image_path]['dhash'] = image_hash
+                admitted.append(image_path)
+    return admitted
+
+
+def encode_directory(images_dir, old_entries, workers=None, detection=DEFAULT_DETECTION, gate=None):
+    # Returns (images, manifest entries) for the per-student folders under images_dir
+    images = list(list_training_images(images_dir))
+    entries, to_encode = plan_encoding(images, old_entries)
+    if gate is not None:
+        to_encode = screen_images(images, entries, to_encode, gate, workers)
+
+    reused = len(entries) - len(to_encode)
+    dropped = len(set(old_entries) - set(entries))
+    print(f"{len(images)} images: {len(to_encode)} to encode, {reused} unchanged, {dropped} removed")
+    metrics.count("images_encoded", len(to_encode))
+    metrics.count("images_reused", reused)
+
+    encode_started = time.perf_counter()
+    for done, (image_path, encoding, error) in enumerate(encode_images(to_encode, workers, detection), 1):
+        if error is not None:
+            # Leave failed images out of the manifest so the next run retries them
+            print(f"Error processing image {image_path}: {error}")
+            del entries[image_path]
+            continue
+        entries[image_path]['encoding'] = encoding
+        if done % 100 == 0:
+            print(f"Encoded {done}/{len(to_encode)} images")
+    if gate is not None:
+        gate.record_encoding(len(to_encode), time.perf_counter() - encode_started)
+    return images, entries
+
+
+def encode_stream(source, old_entries, workers=None, detection=DEFAULT_DETECTION, gate=None, prefetch=PREFETCH):
+    # Returns (images, manifest entries) for photos decoded straight from archives or (person_name,
+    # bytes) pairs, without extracting them to disk. Photos already in the manifest are matched by
+    # content hash; the rest are read `prefetch` ahead on a thread while the workers encode.
+    # A photo repeated within the run is encoded once and its encoding copied afterwards.
+    by_digest = {entry['sha1']: entry for entry in old_entries.values()}
+    images = []
+    entries = {}
+    counts = {'encode': 0, 'reuse': 0, 'repeat': 0}
+    # digest -> key of the first copy sent to the workers; repeated key -> that key
+    seen = {}
+    repeats = {}
+
+    def to_encode():
+        # Runs on the prefetch thread; each entry exists before its key is handed to a worker
+        for index, (label, key, data) in enumerate(iter_samples(source)):
+            digest = hashlib.sha1(data).hexdigest()
+            if key is None:
+                # The position keeps byte-identical unnamed samples apart
+                key = f"{label}/{index}-{digest}"
+            images.append((label, key))
+            cached = by_digest.get(digest)
+            entries[key] = {'size': len(data), 'mtime': None, 'sha1': digest}
+            if cached is not None:
+                entries[key]['encoding'] = cached['encoding']
+                if 'dhash' in cached:
+                    entries[key]['dhash'] = cached['dhash']
+                if gate is not None:
+                    gate.add_known(label, key, cached.get('dhash'))
+                counts['reuse'] += 1
+                continue
+            if gate is not None:
+                image_hash = gate.admit(label, key, assess_image(io.BytesIO(data), gate.settings))
+                if image_hash is None:
+                    del entries[key]
+                    continue
+                entries[key]['dhash'] = image_hash
+            if digest in seen:
+                repeats[key] = seen[digest]
+                counts['repeat'] += 1
+                continue
+            seen[digest] = key
+            counts['encode'] += 1
+            yield key, data
+
+    encode_started = time.perf_counter()
+    for done, (key, encoding, error) in enumerate(encode_blobs(prefetched(to_encode(), prefetch), workers, detection), 1):
+        if error is not None:
+            print(f"Error processing image {key}: {error}")
+            del entries[key]
+            continue
+        entries[key]['encoding'] = encoding
+        if done % 100 == 0:
+            print(f"Encoded {done} images")
+    if gate is not None:
+        gate.record_encoding(counts['encode'], time.perf_counter() - encode_started)
+    for key, first in repeats.items():
+        if first in entries:
+            entries[key]['encoding'] = entries[first]['encoding']
+        else:
+            # The first copy failed to encode; retry them all next run
+            del entries[key]
+
+    dropped = len(set(old_entries) - set(entries))
+    print(f"{len(images)} images: {counts['encode']} encoded, {counts['repeat']} repeated, "
+          f"{counts['reuse']} unchanged, {dropped} removed")
+    metrics.count("images_encoded", counts['encode'])
+    metrics.count("images_reused", counts['reuse'] + counts['repeat'])
+    return images, entries
+
+
+def build_gallery(encodings, labels, index='auto', prototypes=0, compress=None):
+    if prototypes:
+        gallery = build_prototype_gallery(encodings, labels, prototypes)
+    else:
+        gallery = FaceGallery.from_encodings(encodings, labels)
+    if compress:
+        return build_pq(gallery, float16=compress == 'pq-f16')
+    if index == 'ivf' or (index == 'auto' and len(gallery) >= IVF_MIN_SIZE):
+        gallery = build_ivf(gallery)
+    return gallery
+
+
+def print_compression_report(gallery, compressed):
+    memory = gallery_memory(compressed)
+    print(f"PQ gallery: {memory['pq_scan'] / 1e6:.1f} MB scanned per query vs {memory['float32_scan'] / 1e6:.1f} MB "
+          f"for exact float32 search ({memory['float32_scan'] / memory['pq_scan']:.1f}x smaller, "
+          f"{memory['float64_encodings'] / memory['pq_scan']:.1f}x vs float64 encodings); "
+          f"re-rank copy {memory['stored_encodings'] / 1e6:.1f} MB on disk ({compressed.encodings.dtype})")
+    report = compare_pq(gallery, compressed)
+    if report['evaluated']:
+        print(f"Leave-one-out agreement with exact matching on {report['evaluated']} encodings: "
+              f"{report['agreement']:.2%} (mean distance error {report['mean_distance_error'] or 0:.4f})")
+
+
+def save_partitioned(encodings_file, encodings, labels, field, student_db=DB_FILE, index='auto', prototypes=0,
+                     compress=None):
+    # One extra gallery per value of a student record field (grade, class, site, ...), so a kiosk
+    # can load just its own cohort. Folder names are student ids in the student database.
+    students = StudentDatabase(student_db)
+    try:
+        student_partitions = students.field_values(field)
+    finally:
+        students.close()
+    galleries = {value: build_gallery(group_encodings, group_labels, index, prototypes, compress)
+                 for value, (group_encodings, group_labels)
+                 in split_by_partition(encodings, labels, student_partitions).items()}
+    partitions = save_partitions(encodings_file, field, galleries)
+    print(f"Partitioned by {field} into {index_file(encodings_file)}: " +
+          ", ".join(f"{value} ({info['rows']} rows)" for value, info in partitions.items()))
+
+
+def train_model(source, encodings_file, manifest_file=None, workers=None, rebuild=False, index='auto',
+                prototypes=0, detection=DEFAULT_DETECTION, quality=None, quality_report=None,
+                partition_by=None, student_db=DB_FILE, compress=None):
+    # source: a folder of per-student folders, a zip/tar archive in the same layout (or a list of
+    # them), or an iterable of (person_name, image bytes). quality (QualitySettings) screens new
+    # photos before encoding; None (the default) encodes every photo. partition_by also writes one
+    # gallery per value of that student field. compress ('pq' or 'pq-f16') stores product-quantized
+    # codes for a compact first-pass scan.
+    started = time.perf_counter()
+    if manifest_file is None:
+        manifest_file = default_manifest_path(encodings_file)
+    old_entries = {} if rebuild else load_manifest(manifest_file, detection)
+
+    gate = QualityGate(quality) if quality is not None else None
+    if isinstance(source, str) and not is_archive(source):
+        print(f"Loading images from directory: {source}")
+        images, entries = encode_directory(source, old_entries, workers, detection, gate)
+    else:
+        print(f"Streaming images from {source if isinstance(source, str) else 'the given archives/images'}")
+        images, entries = encode_stream(source, old_entries, workers, detection, gate)
+    if gate is not None and gate.checked:
+        print(gate.summary())
+        if quality_report:
+            gate.write_report(quality_report)
+
+    known_encodings = []
+    known_names = []
+    for person_name, image_path in images:
+        entry = entries.get(image_path)
+        if entry is not None and entry['encoding'] is not None:
+            known_encodings.append(entry['encoding'])
+            known_names.append(person_name)
+
+    save_manifest(manifest_file, entries, detection)
 
     if not known_encodings:
-        raise ValueError("No images found in the directory or no faces detected.")
+        raise ValueError("No images found or no faces detected.")
 
-    with open(encodings_file, 'wb') as f:
-        pickle.dump((known_encodings, known_names), f)
+    if prototypes:
+        # Compact to a few prototypes per student so matching scales with students, not photos
+        report = compare_accuracy(known_encodings, known_names, prototypes)
+        print(f"Prototypes: {report['gallery_rows']} encodings -> {report['prototype_rows']} rows "
+              f"({report['compression']:.1f}x smaller)")
+        print(f"Leave-one-out top-1 accuracy on {report['evaluated']} photos: "
+              f"full gallery {report['full_accuracy']:.2%}, prototypes {report['prototype_accuracy']:.2%}, "
+              f"agreement {report['agreement']:.2%}")
+    gallery = build_gallery(known_encodings, known_names, index if not compress else 'exact', prototypes)
+    if 'ivf_centroids' in gallery.extras:
+        print(f"Built IVF index with {len(gallery.extras['ivf_centroids'])} lists")
+    if compress:
+        compressed = build_pq(gallery, float16=compress == 'pq-f16')
+        print_compression_report(gallery, compressed)
+        gallery = compressed
+    save_gallery(encodings_file, gallery)
 
     print(f"Model saved to {encodings_file}")
+    if partition_by:
+        save_partitioned(encodings_file, known_encodings, known_names, partition_by, student_db, index, prototypes,
+                         compress)
+    metrics.gauge("gallery_size", len(gallery))
+    metrics.observe("train_model", time.perf_counter() - started)
+    metrics.flush()
+
 
 if __name__ == "__main__":
-    images_dir = '/train/images'
-    encodings_file = '/train/face_encodings.pkl'
-    train_model(images_dir, encodings_file)
+    parser = argparse.ArgumentParser(description="Build the face encodings model from per-student image folders.")
+    parser.add_argument('--images-dir', default='/train/images', help="per-student folders, or a zip/tar archive of them")
+    parser.add_argument('--archives', nargs='+', default=None,
+                        help="enrol from these zip/tar bundles (e.g. one per class) instead of --images-dir")
+    parser.add_argument('--encodings-file', default='/train/student_faces.gallery')
+    parser.add_argument('--manifest', default=None, help="incremental manifest path (default: next to the encodings file)")
+    parser.add_argument('--workers', type=int, default=None, help="encoding processes (default: all cores, 1 = serial)")
+    parser.add_argument('--rebuild', action='store_true', help="ignore the manifest and re-encode every image")
+    parser.add_argument('--index', choices=['auto', 'exact', 'ivf'], default='auto',
+                        help=f"search index to build (auto: IVF from {IVF_MIN_SIZE} encodings up)")
+    parser.add_argument('--compress', choices=['pq', 'pq-f16'], default=None,
+                        help="store 16-byte product-quantized codes for the first-pass scan (pq-f16: "
+                             "also keep the re-rank encodings as float16). Saves memory, not time: it "
+                             "replaces IVF and is slower than exact search below ~100k encodings")
+    parser.add_argument('--prototypes', type=int, default=0,
+                        help="store at most this many prototype encodings per student (0 = keep every photo)")
+    parser.add_argument('--metrics', default=None,
+                        help="stage timing sinks: comma-separated log, histogram, prometheus=PATH")
+    parser.add_argument('--partition-by', default=None, metavar='FIELD',
+                        help="also write one gallery per value of this student field (e.g. grade)")
+    parser.add_argument('--student-db', default=DB_FILE, help="student database holding the partition field")
+    add_detection_arguments(parser)
+    add_quality_arguments(parser)
+    args = parser.parse_args()
+    metrics.configure(args.metrics)
+    train_model(args.archives or args.images_dir, args.encodings_file, args.manifest, args.workers, args.rebuild, args.index,
+                args.prototypes, settings_from_args(args), quality_from_args(args), args.quality_report,
+                args.partition_by, args.student_db, args.compress)